@@ -0,0 +1,346 @@
+# Benchmarks for the GameStore simulator.
+#
+# Builds synthetic inventories and provider catalogs (10^3 up to 10^7 SKUs,
+# always the same for a given seed), runs every store operation with input()
+# and the screen output stubbed out, and reports throughput, latency
+# percentiles and peak memory. Results can be saved as a baseline and later
+# runs compared against it to catch regressions.
+#
+# With --cold-start it instead measures how long a fresh `gamestore.py
+# --catalog-dir` process takes to show its first menu, and to answer a first
+# report with and without the parsed-catalog cache.
+#
+# Example:
+#   python benchmark.py --sizes 1000 10000 100000 --save-baseline bench_baseline.json
+#   python benchmark.py --sizes 1000 10000 100000 --baseline bench_baseline.json
+#   python benchmark.py --cold-start --sizes 1000 100000 1000000
+
+import argparse
+import builtins
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import cycle
+
+import gamestore
+
+WORDS = ['Gura', 'Pixel', 'Retro', 'Chibi', 'Figure', 'Plushie', 'Console', 'Poster',
+         'Hoodie', 'Sticker', 'Cartridge', 'Statue', 'Keychain', 'Controller', 'Artbook']
+
+def make_synthetic_store(n_skus, seed=1234):
+    """Build a synthetic inventory and provider catalog with `n_skus` items.
+
+    Every SKU is in the inventory and offered by one to three providers
+    (about one provider per thousand SKUs, at least five).
+    Returns:
+        tuple: (inventory dict, providers dict)
+    """
+    rng = random.Random(seed)
+    n_providers = max(5, n_skus // 1000)
+    provider_names = [f"Provider {p:05d}" for p in range(n_providers)]
+    inventory = {}
+    providers = {name: {} for name in provider_names}
+    for i in range(n_skus):
+        name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} #{i}"
+        cost = round(rng.uniform(0.5, 250.0), 2)
+        home = rng.choice(provider_names)
+        inventory[name] = {'price': round(cost * rng.uniform(1.2, 2.5), 2), 'stock': rng.randint(0, 60),
+                           'cost': cost, 'provider': home}
+        providers[home][name] = {'cost': cost, 'available': rng.randint(0, 200)}
+        for other in rng.sample(provider_names, rng.randint(0, 2)):
+            providers[other][name] = {'cost': round(cost * rng.uniform(0.8, 1.3), 2),
+                                      'available': rng.randint(0, 200)}
+    return inventory, providers
+
+def copy_store(inventory, providers):
+    """Fresh copies of a synthetic store, so one build can serve every operation."""
+    return ({name: dict(details) for name, details in inventory.items()},
+            {provider: {item: dict(offer) for item, offer in items.items()}
+             for provider, items in providers.items()})
+
+def install_store(inventory, providers, money=1_000_000.0, columnar=False):
+    """Make the synthetic data the store's current state."""
+    gamestore.inventory = inventory
+    gamestore.providers = providers
+    gamestore.store_money = money
+    gamestore.sales_velocity.clear()
+    gamestore.invalidate_inventory_indexes()
+    gamestore.invalidate_offer_indexes()
+    if columnar:
+        gamestore.use_columnar_inventory()
+
+class _NullWriter:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+@contextmanager
+def stubbed_io(answers):
+    """Answer input() prompts from `answers` and discard all output.
+
+    Yields a function that starts the answers over; call it before every call
+    of the operation so a run that asks fewer questions (an error path) can't
+    shift the answers of the next one. Past the end the answers repeat.
+    """
+    replies = None
+
+    def rewind():
+        nonlocal replies
+        replies = cycle(answers)
+
+    rewind()
+    saved = builtins.input, builtins.print, sys.stdout
+    builtins.input = lambda prompt='': next(replies)
+    builtins.print = lambda *args, **kwargs: None
+    sys.stdout = _NullWriter()
+    try:
+        yield rewind
+    finally:
+        builtins.input, builtins.print, sys.stdout = saved
+
+# Operation name -> (function, answers to its prompts)
+OPERATIONS = {
+    'calculate_inventory_value': (gamestore.calculate_inventory_value, [""]),
+    'find_most_expensive': (gamestore.find_most_expensive, [""]),
+    'calculate_average_price': (gamestore.calculate_average_price, [""]),
+    'simulate_day_sales': (gamestore.simulate_day_sales, ["1.0", ""]),
+    'buy_from_provider': (gamestore.buy_from_provider, ["1", "1", "1", "yes", ""]),
+    'display_inventory': (gamestore.display_inventory, [""]),
+    'show_providers': (gamestore.show_providers, [""]),
+}
+
+def _prepare_purchase(calls):
+    """Stock the offer buy_from_provider's answers pick (first provider, first item) for `calls` buys.
+
+    Returns a function that raises RuntimeError unless every call bought its unit.
+    """
+    provider = next(iter(gamestore.providers))
+    if not gamestore.providers[provider]:
+        raise RuntimeError(f"{provider} has no offers to buy")
+    item = next(iter(gamestore.providers[provider]))
+    gamestore.update_offer(provider, item, available=calls)
+
+    def check():
+        left = gamestore.providers[provider][item]['available']
+        if left:
+            raise RuntimeError(f"buy_from_provider bought only {calls - left} of {calls} times")
+    return check
+
+# Operation name -> prepare(calls), run on the fresh store before timing; it
+# returns a check() run afterwards that raises if the operation didn't do its work
+PREPARE = {
+    'buy_from_provider': _prepare_purchase,
+}
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[min(len(sorted_values) - 1, int(round(p * (len(sorted_values) - 1))))]
+
+MIN_COMPARE_REPEATS = 5  # fewer timed calls than this are too noisy to compare
+
+def time_operation(func, answers, repeats, warmup=1, prepare=None):
+    """Time `repeats` calls of one operation and measure the peak memory of one more.
+
+    The first `warmup` calls aren't timed: they build the lazy indexes, which
+    would otherwise land in the percentiles. `prepare` is called with the
+    number of calls first (see PREPARE).
+    """
+    check = prepare(warmup + repeats + 1) if prepare else None
+    latencies = []
+    with stubbed_io(answers) as rewind:
+        for _ in range(warmup):
+            rewind()
+            func()
+        for _ in range(repeats):
+            rewind()
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+        rewind()
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if check:
+        check()
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'calls': repeats,
+        'ops_per_s': repeats / total if total else float('inf'),
+        'mean_ms': total / repeats * 1000,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'spread_ms': (percentile(latencies, 0.75) - percentile(latencies, 0.25)) * 1000,
+        'peak_kb': peak / 1024,
+    }
+
+def run_benchmarks(sizes, repeats=20, seed=1234, operations=None, columnar=False):
+    """Run every operation for every catalog size.
+
+    Returns:
+        dict: {'meta': {...}, 'results': {size: {operation: stats}}}
+    """
+    operations = operations or list(OPERATIONS)
+    results = {}
+    for size in sizes:
+        results[str(size)] = {}
+        store = make_synthetic_store(size, seed)
+        for name in operations:
+            # Fresh data for each operation so earlier ones (sales, purchases) don't skew it
+            install_store(*copy_store(*store), columnar=columnar)
+            func, answers = OPERATIONS[name]
+            results[str(size)][name] = time_operation(func, answers, repeats, prepare=PREPARE.get(name))
+        del store  # before the next size is built
+    meta = {
+        'seed': seed,
+        'repeats': repeats,
+        'columnar': columnar,
+        'numpy': gamestore.np is not None,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+    }
+    return {'meta': meta, 'results': results}
+
+def compare_to_baseline(report, baseline, threshold=0.25, noise_ms=0.05, spreads=2.0,
+                        min_repeats=MIN_COMPARE_REPEATS):
+    """List operations whose median latency got worse than the baseline.
+
+    An operation regresses when its p50 is more than `threshold` (25%) slower,
+    by more than `noise_ms` milliseconds and by more than `spreads` times the
+    baseline's interquartile range (its run-to-run noise). Operations timed
+    fewer than `min_repeats` times, in either run, are not compared.
+    Returns:
+        list: (size, operation, baseline p50, current p50) tuples
+    """
+    regressions = []
+    for size, operations in report['results'].items():
+        for name, stats in operations.items():
+            before = baseline.get('results', {}).get(size, {}).get(name)
+            if before is None or min(stats['calls'], before['calls']) < min_repeats:
+                continue
+            slower = stats['p50_ms'] - before['p50_ms']
+            if (slower > before['p50_ms'] * threshold and slower > noise_ms
+                    and slower > spreads * before.get('spread_ms', 0.0)):
+                regressions.append((size, name, before['p50_ms'], stats['p50_ms']))
+    return regressions
+
+def print_report(report):
+    print(f"{'SKUs':>9}  {'operation':<26} {'ops/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'peak KB':>10}")
+    for size, operations in report['results'].items():
+        for name, s in operations.items():
+            print(f"{size:>9}  {name:<26} {s['ops_per_s']:>10.1f} {s['p50_ms']:>10.3f} "
+                  f"{s['p95_ms']:>10.3f} {s['p99_ms']:>10.3f} {s['peak_kb']:>10.1f}")
+
+def write_catalog_dir(path, inventory, providers):
+    """Write a store as a --catalog-dir directory (inventory.csv + one CSV per provider)."""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'inventory.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(gamestore.INVENTORY_COLUMNS)
+        for name, d in inventory.items():
+            writer.writerow((name, d['price'], d['stock'], d['cost'], d['provider']))
+    for provider, items in providers.items():
+        with open(os.path.join(path, provider + '.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(('item', 'cost', 'available'))
+            for item, d in items.items():
+                writer.writerow((item, d['cost'], d['available']))
+
+def _time_process(args, stdin_text):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, gamestore.__file__] + args, input=stdin_text, text=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+                   env=dict(os.environ, TERM='dumb'))
+    return time.perf_counter() - start
+
+def time_cold_start(directory, repeats=3):
+    """Best-of-`repeats` seconds for a fresh process to reach the first menu and the first report."""
+    cache = os.path.join(directory, gamestore.CACHE_DIR_NAME)
+    report = json.dumps({'op': 'value'}) + "\n" + json.dumps({'op': 'cheapest', 'k': 1}) + "\n"
+    first_menu = min(_time_process(['--catalog-dir', directory], "\n0\n") for _ in range(repeats))
+    uncached = []
+    for _ in range(repeats):
+        shutil.rmtree(cache, ignore_errors=True)
+        uncached.append(_time_process(['--catalog-dir', directory, '--batch', '-'], report))
+    cached = min(_time_process(['--catalog-dir', directory, '--batch', '-'], report) for _ in range(repeats))
+    return {'first_menu_s': first_menu, 'first_report_uncached_s': min(uncached),
+            'first_report_cached_s': cached}
+
+def _write_synthetic_dir(directory, size, seed):
+    write_catalog_dir(directory, *make_synthetic_store(size, seed))
+
+def run_cold_start(sizes, repeats=3, seed=1234):
+    results = {}
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix=f"gamestore-{size}-")
+        try:
+            # Built in a child process so this one stays small and its own
+            # memory doesn't slow down starting the timed processes
+            with ProcessPoolExecutor(1) as executor:
+                executor.submit(_write_synthetic_dir, directory, size, seed).result()
+            results[str(size)] = time_cold_start(directory, repeats)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def print_cold_start(results):
+    print(f"{'SKUs':>9}  {'first menu s':>13} {'report (parse) s':>17} {'report (cache) s':>17}")
+    for size, r in results.items():
+        print(f"{size:>9}  {r['first_menu_s']:>13.3f} {r['first_report_uncached_s']:>17.3f} "
+              f"{r['first_report_cached_s']:>17.3f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the GameStore operations")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="catalog sizes to test (up to 10000000)")
+    parser.add_argument('--repeats', type=int, default=20, help="timed calls per operation")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--ops', nargs='+', choices=list(OPERATIONS), help="only these operations")
+    parser.add_argument('--columnar', action='store_true', help="use the columnar inventory backend")
+    parser.add_argument('--save-baseline', metavar='PATH', help="write the results to this JSON file")
+    parser.add_argument('--baseline', metavar='PATH', help="compare against this baseline JSON file")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="slowdown (fraction of p50) reported as a regression")
+    parser.add_argument('--cold-start', action='store_true',
+                        help="measure start-up time with --catalog-dir instead of the operations")
+    args = parser.parse_args(argv)
+
+    if args.cold_start:
+        print_cold_start(run_cold_start(args.sizes, min(args.repeats, 3), args.seed))
+        return 0
+    report = run_benchmarks(args.sizes, args.repeats, args.seed, args.ops, args.columnar)
+    print_report(report)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if args.repeats < MIN_COMPARE_REPEATS:
+            print(f"Not comparing: use at least --repeats {MIN_COMPARE_REPEATS} for a baseline comparison.")
+            return 2
+        regressions = compare_to_baseline(report, baseline, args.threshold)
+        for size, name, before, now in regressions:
+            print(f"REGRESSION {name} @ {size} SKUs: p50 {before:.3f} ms -> {now:.3f} ms")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
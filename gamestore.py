@@ -1,63 +1,1324 @@
+import argparse
+import atexit
+import cProfile
+import csv
+import functools
+import hashlib
+import heapq
+import json
+import math
+import multiprocessing
+import operator
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import ChainMap, Counter, namedtuple
+from collections.abc import ItemsView, MutableMapping, ValuesView
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import chain, islice, product
+from multiprocessing import shared_memory
+
+try:
+    # NumPy is optional: it makes the columnar inventory reports vectorized.
+    # Without it the stdlib array module is used instead.
+    import numpy as np
+except ImportError:
+    np = None
+
 # Helper functions for pretty printing
+# The box pieces are built once here instead of on every print
+BOX_TOP = "┌" + "─" * 58 + "┐"
+BOX_BOTTOM = "└" + "─" * 58 + "┘"
+BOX_DIVIDER = "├" + "─" * 58 + "┤"
+HEADER_TOP = "╔" + "═" * 58 + "╗"
+HEADER_BOTTOM = "╚" + "═" * 58 + "╝"
+
+def format_header(text):
+    """Return a header with a border (as one string)."""
+    return "\n" + HEADER_TOP + "\n║" + text.center(58) + "║\n" + HEADER_BOTTOM
+
+def format_submenu(text):
+    """Return a submenu header (as one string)."""
+    return "\n" + BOX_TOP + "\n│" + text.center(58) + "│\n" + BOX_BOTTOM
+
+def format_info(label, value=None, width=20):
+    """Return an info line with label and value (or just a message when there is no value)."""
+    if value is None:
+        return f"│ {label}"
+    return f"│ {label:<{width}}: {value}"
+
+def format_item(name, details):
+    """Return an item's details in a box (as one string)."""
+    lines = [BOX_DIVIDER, f"│ {name}",
+             format_info("  Price", f"${details['price']:.2f}"),
+             format_info("  Stock", details['stock'])]
+    if 'provider' in details:
+        lines.append(format_info("  Provider", details['provider']))
+    lines.append(BOX_DIVIDER)
+    return "\n".join(lines)
+
+def format_menu_item(number, text):
+    """Return a menu item line with number."""
+    return f"│  [{number}] {text:<54}│"
+
 def print_header(text):
     """Print a header with a border."""
-    width = 60
-    print("\n" + "╔" + "═" * (width-2) + "╗")
-    print("║" + text.center(width-2) + "║")
-    print("╚" + "═" * (width-2) + "╝")
+    print(format_header(text))
 
 def print_submenu(text):
     """Print a submenu header."""
-    print("\n" + "┌" + "─" * 58 + "┐")
-    print("│" + text.center(58) + "│")
-    print("└" + "─" * 58 + "┘")
+    print(format_submenu(text))
 
-def print_info(label, value, width=20):
+def print_info(label, value=None, width=20):
     """Print an info line with label and value."""
-    print(f"│ {label:<{width}}: {value}")
+    print(format_info(label, value, width))
 
 def print_item(name, details):
     """Print an item's details in a box."""
-    print("├" + "─" * 58 + "┤")
-    print(f"│ {name}")
-    print_info("  Price", f"${details['price']:.2f}")
-    print_info("  Stock", details['stock'])
-    if 'provider' in details:
-        print_info("  Provider", details['provider'])
-    print("├" + "─" * 58 + "┤")
+    print(format_item(name, details))
 
 def print_menu_item(number, text):
     """Print a menu item with number."""
-    print(f"│  [{number}] {text:<54}│")
-
-# Dictionary to store our inventory items
-# Each item maps to a dict with: price (sale price), stock (quantity on hand),
-# cost (how much we paid per unit), provider (who supplied it)
-inventory = {
-    # A themed initial selection (games, consoles, merch, figures)
-    'Gawr Gura Plushie (Small)': {'price': 24.99, 'stock': 10, 'cost': 8.00, 'provider': 'Hololive Merch Hub'},
-    'Hololive Tee - Gura': {'price': 29.99, 'stock': 6, 'cost': 12.00, 'provider': 'Hololive Merch Hub'},
-    'Megumin Figure - GSC Exclusive': {'price': 89.99, 'stock': 3, 'cost': 45.00, 'provider': 'GoodSmileCo'},
-    'Chibi Amiibo Set': {'price': 14.99, 'stock': 12, 'cost': 4.50, 'provider': 'GoodSmileCo'},
-    'Indie Pixel Adventure': {'price': 19.99, 'stock': 14, 'cost': 6.00, 'provider': 'IndieSupply'},
-    'OmegaStation X Pro': {'price': 449.99, 'stock': 1, 'cost': 260.00, 'provider': 'ConsoleCorp'},
-    'RetroBox Mini Classic': {'price': 79.99, 'stock': 5, 'cost': 42.00, 'provider': 'RetroWorks'},
-    'Pikachu Cushion': {'price': 21.99, 'stock': 8, 'cost': 7.00, 'provider': 'KawaiiGoods'},
-    'Dragon King Statue': {'price': 129.99, 'stock': 2, 'cost': 60.00, 'provider': 'FigurineWorld'},
-    'Pro Controller - Carbon': {'price': 54.99, 'stock': 9, 'cost': 22.00, 'provider': 'ConsoleCorp'}
-}
+    print(format_menu_item(number, text))
+
+class Screen:
+    """Collects the lines of one screen and writes them all with a single write."""
+
+    def __init__(self):
+        self.lines = []
+
+    def add(self, text):
+        self.lines.append(text)
+
+    def header(self, text):
+        self.lines.append(format_header(text))
+
+    def submenu(self, text):
+        self.lines.append(format_submenu(text))
+
+    def menu_item(self, number, text):
+        self.lines.append(format_menu_item(number, text))
+
+    def item(self, name, details):
+        self.lines.append(format_item(name, details))
+
+    def info(self, label, value=None, width=20):
+        self.lines.append(format_info(label, value, width))
+
+    def show(self):
+        """Write the whole screen at once and start an empty one."""
+        sys.stdout.write("\n".join(self.lines) + "\n")
+        sys.stdout.flush()
+        self.lines = []
+
+PAGE_LINES = 40  # about one terminal screen
+
+def paged(blocks, page_lines=PAGE_LINES):
+    """Group text blocks into pages of about `page_lines` lines.
+
+    Works on any iterable (including generators), reading only as far as the
+    page being built plus one block, so big listings stream page by page.
+    Yields (page, has_more) where page is a list of blocks.
+    """
+    blocks = iter(blocks)
+    pending = next(blocks, None)
+    while pending is not None:
+        page = []
+        used = 0
+        while pending is not None and (not page or used + pending.count("\n") + 1 <= page_lines):
+            page.append(pending)
+            used += pending.count("\n") + 1
+            pending = next(blocks, None)
+        yield page, pending is not None
+
+def show_paged(title, blocks, page_lines=PAGE_LINES):
+    """Show a long listing one page (one write) at a time.
+
+    Args:
+        title (str): header shown on every page
+        blocks: iterable of text blocks (e.g. format_item results)
+    """
+    screen = Screen()
+    pages = paged(blocks, page_lines)
+    number = 0
+    while True:
+        # Each page is read with the store locked; while the prompt waits the
+        # lock is let go (see ask), so a feed refresh or a service client can
+        # change the store between pages
+        with state_lock:
+            try:
+                page, has_more = next(pages)
+            except StopIteration:
+                break
+            except RuntimeError:
+                # A dict listing stops when items were added or removed meanwhile
+                print_info("⚠️  The store changed while paging; the listing stops here.")
+                break
+        number += 1
+        screen.header(f"{title} (page {number})" if number > 1 or has_more else title)
+        screen.add(BOX_TOP)
+        screen.lines.extend(page)
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        if not has_more:
+            break
+        try:
+            answer = ask("Press Enter for the next page or 'q' to stop: ")
+        except Exception:
+            break
+        if answer.strip().lower() == 'q':
+            return
+    pause()
+
+# ---------------- Columnar inventory backend ----------------
+# The default inventory is a dict of per-item dicts, which means every report
+# walks all items in a Python loop. For very large catalogs the inventory can be
+# switched to a columnar backend instead: price, stock and cost live in
+# contiguous arrays (NumPy if installed, the stdlib array module otherwise) and
+# a name -> row dict finds each item. The rest of the program keeps using
+# inventory[name]['price'] exactly as with the plain dict.
+
+INVENTORY_FIELDS = ('price', 'stock', 'cost', 'provider')
+
+class InventoryRow(MutableMapping):
+    """Dict-like view of one item stored in a ColumnarInventory."""
+
+    __slots__ = ('_table', '_name')
+
+    def __init__(self, table, name):
+        self._table = table
+        self._name = name
+
+    def __getitem__(self, key):
+        # Rows can move when other items are removed, so look the row up each time
+        return self._table._get_field(self._table._index[self._name], key)
+
+    def __setitem__(self, key, value):
+        self._table._set_field(self._table._index[self._name], key, value)
+
+    def __delitem__(self, key):
+        if key != 'provider':
+            raise KeyError(f"Field '{key}' cannot be removed from an item")
+        self._table._set_field(self._table._index[self._name], 'provider', None)
+
+    def __iter__(self):
+        row = self._table._index[self._name]
+        for key in INVENTORY_FIELDS:
+            if key != 'provider' or self._table._providers[row] is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class ColumnarInventory(MutableMapping):
+    """Inventory stored as price/stock/cost columns plus a name -> row index.
+
+    Behaves like the plain inventory dict (inventory[name]['stock'] = 5,
+    del inventory[name], name in inventory, ...) but the reports can run as
+    vectorized reductions over whole columns.
+    """
+
+    def __init__(self, items=(), capacity=16):
+        self._index = {}       # item name -> row number
+        self._names = []       # row number -> item name
+        self._providers = []   # row number -> provider name (or None)
+        self._size = 0
+        if np is not None:
+            self._price = np.zeros(capacity, dtype=np.float64)
+            self._stock = np.zeros(capacity, dtype=np.int64)
+            self._cost = np.zeros(capacity, dtype=np.float64)
+        else:
+            self._price = array('d')
+            self._stock = array('q')
+            self._cost = array('d')
+        self.update(items)
+
+    # --- dict-style access ---
+    def __getitem__(self, name):
+        if name not in self._index:
+            raise KeyError(name)
+        return InventoryRow(self, name)
+
+    def __setitem__(self, name, details):
+        row = self._index.get(name)
+        if row is None:
+            row = self._append_row(name)
+        self._price[row] = details['price']
+        self._stock[row] = details['stock']
+        self._cost[row] = details.get('cost', 0)
+        self._providers[row] = details.get('provider')
+
+    def __delitem__(self, name):
+        row = self._index.pop(name)
+        last = self._size - 1
+        if row != last:
+            # Move the last row into the hole so the columns stay contiguous
+            moved = self._names[last]
+            self._price[row] = self._price[last]
+            self._stock[row] = self._stock[last]
+            self._cost[row] = self._cost[last]
+            self._names[row] = moved
+            self._providers[row] = self._providers[last]
+            self._index[moved] = row
+        self._names.pop()
+        self._providers.pop()
+        if np is None:
+            self._price.pop()
+            self._stock.pop()
+            self._cost.pop()
+        self._size = last
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f"ColumnarInventory({len(self)} items)"
+
+    # --- row storage helpers ---
+    def _append_row(self, name):
+        row = self._size
+        if np is not None:
+            if row == len(self._price):
+                self._grow(max(16, row * 2))
+        else:
+            self._price.append(0.0)
+            self._stock.append(0)
+            self._cost.append(0.0)
+        self._names.append(name)
+        self._providers.append(None)
+        self._index[name] = row
+        self._size = row + 1
+        return row
+
+    def _grow(self, capacity):
+        for attr in ('_price', '_stock', '_cost'):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, attr, new)
+
+    def _get_field(self, row, key):
+        if key == 'price':
+            return float(self._price[row])
+        if key == 'stock':
+            return int(self._stock[row])
+        if key == 'cost':
+            return float(self._cost[row])
+        if key == 'provider' and self._providers[row] is not None:
+            return self._providers[row]
+        raise KeyError(key)
+
+    def _set_field(self, row, key, value):
+        if key == 'price':
+            self._price[row] = value
+        elif key == 'stock':
+            self._stock[row] = value
+        elif key == 'cost':
+            self._cost[row] = value
+        elif key == 'provider':
+            self._providers[row] = value
+        else:
+            raise KeyError(f"Unknown inventory field '{key}'")
+
+    # --- vectorized reports ---
+    def columns(self):
+        """Return the (price, stock, cost) columns trimmed to the live rows."""
+        n = self._size
+        return self._price[:n], self._stock[:n], self._cost[:n]
+
+    def scan_totals(self):
+        """Compute the report sums over whole columns.
+
+        Returns:
+            dict: value (sum of price*stock), cost (sum of cost*stock),
+            price_sum, stock_sum and count
+        """
+        price, stock, cost = self.columns()
+        if np is not None:
+            return {
+                'value': float(np.dot(price, stock)),
+                'cost': float(np.dot(cost, stock)),
+                'price_sum': float(price.sum()),
+                'stock_sum': int(stock.sum()),
+                'count': self._size,
+            }
+        return {
+            'value': sum(map(operator.mul, price, stock)),
+            'cost': sum(map(operator.mul, cost, stock)),
+            'price_sum': sum(price),
+            'stock_sum': sum(stock),
+            'count': self._size,
+        }
+
+def use_columnar_inventory():
+    """Switch the global inventory to the columnar backend, keeping all items."""
+    global inventory
+    if not isinstance(inventory, ColumnarInventory):
+        inventory = ColumnarInventory(inventory.items())
+        invalidate_inventory_indexes()
+    return inventory
+
+def scan_inventory_totals(items=None):
+    """Full scan of the inventory returning the sums the reports need.
+
+    Args:
+        items: inventory mapping to scan (defaults to the global inventory)
+    Returns:
+        dict: value, cost, price_sum, stock_sum and count
+    """
+    if items is None:
+        items = inventory
+    if hasattr(items, 'scan_totals'):
+        return items.scan_totals()
+    totals = {'value': 0, 'cost': 0, 'price_sum': 0, 'stock_sum': 0, 'count': 0}
+    for details in items.values():
+        totals['value'] += details['price'] * details['stock']
+        # cost may not exist for very old entries, default to 0
+        totals['cost'] += details.get('cost', 0) * details['stock']
+        totals['price_sum'] += details['price']
+        totals['stock_sum'] += details['stock']
+        totals['count'] += 1
+    return totals
+
+class LazyCatalog(MutableMapping):
+    """A mapping that calls load() for its contents the first time it is used."""
+
+    def __init__(self, load):
+        self._load = load
+        self._data = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def _contents(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self._load()
+        return self._data
+
+    def __getitem__(self, key):
+        return self._contents()[key]
+
+    def __setitem__(self, key, value):
+        self._contents()[key] = value
+
+    def __delitem__(self, key):
+        del self._contents()[key]
+
+    def __contains__(self, key):
+        return key in self._contents()
+
+    def __iter__(self):
+        return iter(self._contents())
+
+    def __len__(self):
+        return len(self._contents())
+
+    def get(self, key, default=None):
+        return self._contents().get(key, default)
+
+    def keys(self):
+        return self._contents().keys()
+
+    def items(self):
+        return self._contents().items()
+
+    def values(self):
+        return self._contents().values()
+
+# The inventory the demo store starts with. Each item maps to a dict with:
+# price (sale price), stock (quantity on hand), cost (how much we paid per
+# unit), provider (who supplied it)
+def _demo_inventory():
+    return {
+        # A themed initial selection (games, consoles, merch, figures)
+        'Gawr Gura Plushie (Small)': {'price': 24.99, 'stock': 10, 'cost': 8.00, 'provider': 'Hololive Merch Hub'},
+        'Hololive Tee - Gura': {'price': 29.99, 'stock': 6, 'cost': 12.00, 'provider': 'Hololive Merch Hub'},
+        'Megumin Figure - GSC Exclusive': {'price': 89.99, 'stock': 3, 'cost': 45.00, 'provider': 'GoodSmileCo'},
+        'Chibi Amiibo Set': {'price': 14.99, 'stock': 12, 'cost': 4.50, 'provider': 'GoodSmileCo'},
+        'Indie Pixel Adventure': {'price': 19.99, 'stock': 14, 'cost': 6.00, 'provider': 'IndieSupply'},
+        'OmegaStation X Pro': {'price': 449.99, 'stock': 1, 'cost': 260.00, 'provider': 'ConsoleCorp'},
+        'RetroBox Mini Classic': {'price': 79.99, 'stock': 5, 'cost': 42.00, 'provider': 'RetroWorks'},
+        'Pikachu Cushion': {'price': 21.99, 'stock': 8, 'cost': 7.00, 'provider': 'KawaiiGoods'},
+        'Dragon King Statue': {'price': 129.99, 'stock': 2, 'cost': 60.00, 'provider': 'FigurineWorld'},
+        'Pro Controller - Carbon': {'price': 54.99, 'stock': 9, 'cost': 22.00, 'provider': 'ConsoleCorp'}
+    }
+
+# The demo selection is only built when the inventory is first used, so a
+# store started with --db or --catalog-dir never pays for it
+inventory = LazyCatalog(_demo_inventory)
 
 # Player/store money (cash on hand). We start with some capital to buy from providers.
 store_money = 2000.00
 
+# ---------------- Inventory change tracking ----------------
+# Every change to an inventory item goes through add_inventory_item,
+# update_item or delete_inventory_item. Those helpers tell the registered
+# indexes what changed (the item before and after), so things like the running
+# report totals can be updated in constant time instead of rescanning.
+
+_inventory_indexes = []
+
+def register_inventory_index(index):
+    """Register an index that follows inventory changes.
+
+    The index must provide item_changed(name, old, new), where old and new are
+    plain dict copies of the item (None when the item did not exist / was
+    removed), and invalidate(), called when the whole inventory was replaced.
+    Returns the index so it can be registered where it is created.
+    """
+    _inventory_indexes.append(index)
+    return index
+
+def _notify_item_changed(name, old, new):
+    for index in _inventory_indexes:
+        index.item_changed(name, old, new)
+
+def invalidate_inventory_indexes():
+    """Tell every index the inventory was replaced wholesale (rebuild lazily)."""
+    for index in _inventory_indexes:
+        index.invalidate()
+
+def _rolled_back_indexes():
+    """Tell every inventory and offer index a database transaction rolled back.
+
+    The rows are back as they were before the transaction, but the indexes
+    already followed its changes, so they are rebuilt like after invalidate().
+    Listeners that don't mirror the rows (the ledger, the undo journal) provide
+    rolled_back() instead and keep their state.
+    """
+    seen = set()
+    for index in _inventory_indexes + _offer_indexes:
+        if id(index) in seen:
+            continue
+        seen.add(id(index))
+        rolled_back = getattr(index, 'rolled_back', None)
+        if rolled_back is not None:
+            rolled_back()
+        else:
+            index.invalidate()
+
+def add_inventory_item(name, details):
+    """Add a new item (or replace an existing one) in the inventory."""
+    old = dict(inventory[name]) if name in inventory else None
+    inventory[name] = details
+    _notify_item_changed(name, old, dict(details))
+
+def update_item(name, **fields):
+    """Change one or more fields (price, stock, cost, provider) of an item."""
+    details = inventory[name]
+    old = dict(details)
+    for field, value in fields.items():
+        details[field] = value
+    new = dict(old)
+    new.update(fields)
+    _notify_item_changed(name, old, new)
+
+def delete_inventory_item(name):
+    """Remove an item from the inventory."""
+    old = dict(inventory[name])
+    del inventory[name]
+    _notify_item_changed(name, old, None)
+
+# Provider offers and the store money are tracked the same way: offer indexes
+# get offer_changed(provider, item, old, new) and money listeners get
+# money_changed(old, new, reason).
+
+_offer_indexes = []
+_money_listeners = []
+
+def register_offer_index(index):
+    """Register an index that follows provider offer changes (see register_inventory_index)."""
+    _offer_indexes.append(index)
+    return index
+
+def register_money_listener(listener):
+    """Register an object whose money_changed(old, new, reason) is called on every cash change."""
+    _money_listeners.append(listener)
+    return listener
+
+def invalidate_offer_indexes():
+    """Tell every offer index the provider catalogs were replaced wholesale."""
+    for index in _offer_indexes:
+        index.invalidate()
+
+def update_offer(provider, item, **fields):
+    """Change the cost and/or available quantity of a provider's offer."""
+    details = providers[provider][item]
+    old = dict(details)
+    for field, value in fields.items():
+        details[field] = value
+    new = dict(old)
+    new.update(fields)
+    for index in _offer_indexes:
+        index.offer_changed(provider, item, old, new)
+
+def set_offer(provider, item, cost, available):
+    """Add a provider offer (and the provider if needed) or replace its cost and availability."""
+    if provider not in providers:
+        providers[provider] = {}
+    catalog = providers[provider]
+    old = dict(catalog[item]) if item in catalog else None
+    new = {'cost': cost, 'available': available}
+    catalog[item] = dict(new)
+    for index in _offer_indexes:
+        index.offer_changed(provider, item, old, new)
+
+def remove_offer(provider, item):
+    """Remove an item from a provider's catalog."""
+    catalog = providers[provider]
+    old = dict(catalog[item])
+    del catalog[item]
+    for index in _offer_indexes:
+        index.offer_changed(provider, item, old, None)
+
+def take_offer_stock(provider, item, qty):
+    """Reserve `qty` units of a provider's offer by taking them out of its available stock.
+
+    With a store fleet's shared stock the check and the take are one atomic
+    step across all store processes.
+    Raises:
+        PurchaseError: if fewer than `qty` units are available
+    """
+    details = providers[provider][item]
+    if hasattr(providers, 'reserve'):
+        left = providers.reserve(provider, item, qty)
+    else:
+        left = details['available'] - qty
+        if left < 0:
+            raise PurchaseError([f"'{item}' from '{provider}': {qty} wanted, "
+                                 f"only {details['available']} available"])
+        details['available'] = left
+    new = {'cost': details['cost'], 'available': left}
+    old = dict(new, available=left + qty)
+    for index in _offer_indexes:
+        index.offer_changed(provider, item, old, new)
+
+def return_offer_stock(provider, item, qty):
+    """Give back units taken with take_offer_stock (the purchase did not go through)."""
+    details = providers[provider][item]
+    if hasattr(providers, 'release'):
+        now = providers.release(provider, item, qty)
+    else:
+        now = details['available'] + qty
+        details['available'] = now
+    new = {'cost': details['cost'], 'available': now}
+    old = dict(new, available=now - qty)
+    for index in _offer_indexes:
+        index.offer_changed(provider, item, old, new)
+
+def set_store_money(amount, reason):
+    """Set the store money, recording why it changed."""
+    global store_money
+    old = store_money
+    store_money = amount
+    for listener in _money_listeners:
+        listener.money_changed(old, amount, reason)
+
+def adjust_store_money(delta, reason):
+    """Add (or with a negative delta, take) money from the store."""
+    set_store_money(store_money + delta, reason)
+
+class InventoryTotals:
+    """Running sums behind the value, profit and average price reports.
+
+    Each inventory change adds the new item's contribution and subtracts the
+    old one, so the reports come back in constant time. The sums are built
+    from a full scan the first time they are needed (or after invalidate()).
+    """
+
+    def __init__(self):
+        self._totals = None  # None means "rebuild from a full scan on next use"
+
+    def invalidate(self):
+        self._totals = None
+
+    def item_changed(self, name, old, new):
+        totals = self._totals
+        if totals is None:
+            return
+        if old is not None:
+            totals['value'] -= old['price'] * old['stock']
+            totals['cost'] -= old.get('cost', 0) * old['stock']
+            totals['price_sum'] -= old['price']
+            totals['stock_sum'] -= old['stock']
+            totals['count'] -= 1
+        if new is not None:
+            totals['value'] += new['price'] * new['stock']
+            totals['cost'] += new.get('cost', 0) * new['stock']
+            totals['price_sum'] += new['price']
+            totals['stock_sum'] += new['stock']
+            totals['count'] += 1
+
+    def totals(self):
+        """Return a copy of the current sums (value, cost, price_sum, stock_sum, count)."""
+        if self._totals is None:
+            self._totals = scan_inventory_totals()
+        return dict(self._totals)
+
+    def verify(self, tolerance=1e-6, rebuild=True):
+        """Cross-check the running sums against a full scan.
+
+        Args:
+            tolerance (float): largest difference not reported as drift
+            rebuild (bool): replace the running sums with the scanned ones
+        Returns:
+            dict: field -> (running, scanned) for every field that drifted
+        """
+        running = self.totals()
+        scanned = scan_inventory_totals()
+        drift = {}
+        for field, value in scanned.items():
+            if abs(running[field] - value) > tolerance:
+                drift[field] = (running[field], value)
+        if rebuild:
+            self._totals = scanned
+        return drift
+
+inventory_totals = register_inventory_index(InventoryTotals())
+
+SORTED_BUCKET_SIZE = 512  # default entries per bucket of a SortedBuckets (buckets split at twice this)
+
+class SortedBuckets:
+    """A sorted list kept as consecutive sorted buckets plus each bucket's largest entry.
+
+    add() and discard() bisect to the right bucket and only shift entries
+    inside it, instead of moving half of one huge list.
+    """
+
+    def __init__(self, items=(), load=None):
+        if load is None:
+            load = SORTED_BUCKET_SIZE
+        self._load = load
+        items = sorted(items)
+        self._buckets = [items[i:i + load] for i in range(0, len(items), load)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+
+    def __len__(self):
+        return sum(map(len, self._buckets))
+
+    def __iter__(self):
+        return chain.from_iterable(self._buckets)
+
+    def __reversed__(self):
+        return chain.from_iterable(map(reversed, reversed(self._buckets)))
+
+    def add(self, entry):
+        buckets, maxes = self._buckets, self._maxes
+        if not buckets:
+            buckets.append([entry])
+            maxes.append(entry)
+            return
+        b = bisect_left(maxes, entry)
+        if b == len(buckets):
+            b -= 1
+            buckets[b].append(entry)
+            maxes[b] = entry
+        else:
+            insort(buckets[b], entry)
+        bucket = buckets[b]
+        if len(bucket) > 2 * self._load:
+            half = len(bucket) // 2
+            buckets[b:b + 1] = [bucket[:half], bucket[half:]]
+            maxes[b:b + 1] = [bucket[half - 1], bucket[-1]]
+
+    def discard(self, entry):
+        buckets, maxes = self._buckets, self._maxes
+        b = bisect_left(maxes, entry)
+        if b == len(buckets):
+            return
+        bucket = buckets[b]
+        i = bisect_left(bucket, entry)
+        if i < len(bucket) and bucket[i] == entry:
+            del bucket[i]
+            if bucket:
+                maxes[b] = bucket[-1]
+            else:
+                del buckets[b]
+                del maxes[b]
+
+    def _locate(self, entry):
+        """(bucket, position in it) of the first entry >= `entry`."""
+        b = bisect_left(self._maxes, entry)
+        if b == len(self._buckets):
+            return b, 0
+        return b, bisect_left(self._buckets[b], entry)
+
+    def count(self, low, high):
+        """Number of entries with low <= entry < high."""
+        (b1, i1), (b2, i2) = self._locate(low), self._locate(high)
+        if b1 == b2:
+            return i2 - i1
+        return len(self._buckets[b1]) - i1 + sum(len(self._buckets[b]) for b in range(b1 + 1, b2)) + i2
+
+    def irange(self, low, high):
+        """The entries with low <= entry < high, in order."""
+        b, i = self._locate(low)
+        buckets = self._buckets
+        while b < len(buckets):
+            bucket = buckets[b]
+            for j in range(i, len(bucket)):
+                if not bucket[j] < high:
+                    return
+                yield bucket[j]
+            b += 1
+            i = 0
+
+class PriceIndex:
+    """Inventory items kept ordered by sale price.
+
+    Answers "top K most expensive / cheapest" from the ends of a sorted list
+    of (price, name) pairs and price-range queries with binary search,
+    instead of scanning the whole inventory. The list is a SortedBuckets, so
+    price changes, removals and new items only shift one short bucket as
+    they happen.
+    """
+
+    def __init__(self):
+        self._keys = None  # SortedBuckets of (price, name) pairs; None = rebuild on next use
+
+    def invalidate(self):
+        self._keys = None
+
+    def item_changed(self, name, old, new):
+        keys = self._keys
+        if keys is None:
+            return
+        old_price = old['price'] if old is not None else None
+        new_price = new['price'] if new is not None else None
+        if old_price == new_price:
+            return
+        if old is not None:
+            keys.discard((old_price, name))
+        if new is not None:
+            keys.add((new_price, name))
+
+    def _sorted(self):
+        if self._keys is None:
+            if isinstance(inventory, ColumnarInventory):
+                # Rows iterate in column order, so the prices come straight from the column
+                self._keys = SortedBuckets(zip(inventory.columns()[0].tolist(), inventory))
+            else:
+                self._keys = SortedBuckets((details['price'], name) for name, details in inventory.items())
+        return self._keys
+
+    # A database answers these from its own price index instead (see SqliteInventory)
+
+    def most_expensive(self, k=1):
+        """Return up to k item names, most expensive first."""
+        if hasattr(inventory, 'names_by_price'):
+            return inventory.names_by_price(k, descending=True)
+        return [name for _, name in islice(reversed(self._sorted()), k)]
+
+    def cheapest(self, k=1):
+        """Return up to k item names, cheapest first."""
+        if hasattr(inventory, 'names_by_price'):
+            return inventory.names_by_price(k)
+        return [name for _, name in islice(self._sorted(), k)]
+
+    def in_range(self, low, high):
+        """Return the names of items priced between low and high (inclusive), cheapest first."""
+        if hasattr(inventory, 'names_in_price_range'):
+            return inventory.names_in_price_range(low, high)
+        # (price,) sorts before every (price, name) pair of that price
+        return [name for _, name in self._sorted().irange((low,), (math.nextafter(high, math.inf),))]
+
+price_index = register_inventory_index(PriceIndex())
+
+class ItemVersions:
+    """A version number per inventory item that changes whenever the item does.
+
+    Clients that read an item and later change it can send the version they
+    read; a different current version means someone else changed it meanwhile.
+    """
+
+    def __init__(self):
+        self._seq = 0        # last version handed out
+        self._base = 0       # version of items not changed since the last invalidate()
+        self._versions = {}  # name -> version
+
+    def invalidate(self):
+        self._seq += 1
+        self._base = self._seq
+        self._versions = {}
+
+    def item_changed(self, name, old, new):
+        self._seq += 1
+        self._versions[name] = self._seq
+
+    def version(self, name):
+        return self._versions.get(name, self._base)
+
+item_versions = register_inventory_index(ItemVersions())
+
+def verify_inventory_totals(tolerance=1e-6):
+    """Compare the running totals with a full scan and rebuild them.
+
+    Returns:
+        dict: the fields that had drifted (empty when everything matched)
+    """
+    return inventory_totals.verify(tolerance)
+
+# ---------------- Price distribution ----------------
+# Besides the averages, the Price Analysis screen reports the median, p90 and
+# p99 price and how many items fall in each price band, overall and per
+# provider, both per product and weighted by units in stock. Each is kept in a
+# QuantileSketch (log-spaced buckets, every quantile within 1% of the true
+# price) and a fixed-band histogram. Both have a fixed number of buckets, take
+# removals as well as additions and can be merged, so item changes update them
+# in place and the reports never look at the catalog itself.
+
+PRICE_SKETCH_ACCURACY = 0.01  # relative error of reported quantiles
+PRICE_SKETCH_RANGE = (0.01, 10_000_000.0)  # prices outside this are clamped to it
+PRICE_BANDS = (5, 20, 50, 100, 250)  # band edges in $
+PRICE_BAND_LABELS = ("< $5", "$5-20", "$20-50", "$50-100", "$100-250", "$250+")
+PRICE_PROVIDER_ROWS = 10  # providers listed on the Price Analysis screen
+
+class QuantileSketch:
+    """Weighted quantile sketch with a bounded number of log-spaced buckets.
+
+    A price p goes in bucket ceil(log(p) / log(gamma)); any price in a bucket
+    is within PRICE_SKETCH_ACCURACY of the bucket's midpoint. Zero prices are
+    counted apart. Unlike a t-digest, removing a price is exact: it takes the
+    weight back out of the same bucket.
+    """
+
+    GAMMA = (1 + PRICE_SKETCH_ACCURACY) / (1 - PRICE_SKETCH_ACCURACY)
+    LOG_GAMMA = math.log(GAMMA)
+
+    def __init__(self):
+        self._counts = {}   # bucket key -> weight
+        self._keys = None   # sorted bucket keys; None = re-sort on next query
+        self.zeros = 0      # weight of prices <= 0
+        self.total = 0
+
+    @classmethod
+    def bucket(cls, value):
+        low, high = PRICE_SKETCH_RANGE
+        return math.ceil(math.log(min(max(value, low), high)) / cls.LOG_GAMMA)
+
+    def add(self, value, weight=1):
+        """Add `weight` at `value` (a negative weight removes it again)."""
+        if not weight:
+            return
+        self.total += weight
+        if value <= 0:
+            self.zeros += weight
+            return
+        key = self.bucket(value)
+        count = self._counts.get(key, 0) + weight
+        if count:
+            if key not in self._counts:
+                self._keys = None
+            self._counts[key] = count
+        else:
+            del self._counts[key]
+            self._keys = None
+
+    def remove(self, value, weight=1):
+        self.add(value, -weight)
+
+    def merge(self, other):
+        """Add all of `other`'s weight to this sketch and return it."""
+        for key, count in other._counts.items():
+            count += self._counts.get(key, 0)
+            if count:
+                self._counts[key] = count
+            else:
+                self._counts.pop(key, None)
+        self._keys = None
+        self.zeros += other.zeros
+        self.total += other.total
+        return self
+
+    def quantile(self, q):
+        """Estimated value below which a fraction `q` (0..1) of the weight lies."""
+        if self.total <= 0:
+            return None
+        rank = q * self.total
+        seen = self.zeros
+        if seen > rank or not self._counts:
+            return 0.0
+        if self._keys is None:
+            self._keys = sorted(self._counts)
+        for key in self._keys:
+            seen += self._counts[key]
+            if seen > rank:
+                break
+        return 2 * self.GAMMA ** key / (self.GAMMA + 1)
+
+class PriceBands:
+    """Fixed-bucket histogram of prices over PRICE_BANDS."""
+
+    def __init__(self):
+        self.counts = [0] * (len(PRICE_BANDS) + 1)
+
+    def add(self, value, weight=1):
+        self.counts[bisect_right(PRICE_BANDS, value)] += weight
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        return self
+
+    def as_dict(self):
+        return dict(zip(PRICE_BAND_LABELS, self.counts))
+
+class PriceDistribution:
+    """Price sketch and bands for one group of items, per product and per unit in stock."""
+
+    def __init__(self):
+        self.unit = QuantileSketch()
+        self.stock = QuantileSketch()
+        self.unit_bands = PriceBands()
+        self.stock_bands = PriceBands()
+
+    @property
+    def items(self):
+        return self.unit.total
+
+    def add(self, price, stock, sign=1):
+        """Count one item (sign=-1 takes it out again)."""
+        self.unit.add(price, sign)
+        self.unit_bands.add(price, sign)
+        if stock > 0:
+            self.stock.add(price, sign * stock)
+            self.stock_bands.add(price, sign * stock)
+
+    def merge(self, other):
+        self.unit.merge(other.unit)
+        self.stock.merge(other.stock)
+        self.unit_bands.merge(other.unit_bands)
+        self.stock_bands.merge(other.stock_bands)
+        return self
+
+    def summary(self):
+        """Median/p90/p99 (per product and stock-weighted) and band counts."""
+        return {
+            'items': self.unit.total,
+            'units': self.stock.total,
+            'unit': {name: self.unit.quantile(q) for name, q in (('median', 0.5), ('p90', 0.9), ('p99', 0.99))},
+            'stock_weighted': {name: self.stock.quantile(q)
+                               for name, q in (('median', 0.5), ('p90', 0.9), ('p99', 0.99))},
+            'bands': self.unit_bands.as_dict(),
+            'stock_bands': self.stock_bands.as_dict(),
+        }
+
+class PriceStats:
+    """Price distributions for the whole inventory and for each item's provider."""
+
+    def __init__(self):
+        self._all = None         # PriceDistribution; None = rebuild on next use
+        self._by_provider = {}   # provider -> PriceDistribution
+
+    def invalidate(self):
+        self._all = None
+        self._by_provider = {}
+
+    def _add(self, details, sign):
+        provider = details.get('provider') or ""
+        dist = self._by_provider.get(provider)
+        if dist is None:
+            dist = self._by_provider[provider] = PriceDistribution()
+        dist.add(details['price'], details['stock'], sign)
+        if not dist.items:
+            del self._by_provider[provider]
+        self._all.add(details['price'], details['stock'], sign)
+
+    def item_changed(self, name, old, new):
+        if self._all is None:
+            return
+        if old is not None:
+            self._add(old, -1)
+        if new is not None:
+            self._add(new, 1)
+
+    def _built(self):
+        if self._all is None:
+            self._all = PriceDistribution()
+            self._by_provider = {}
+            for details in inventory.values():
+                self._add(details, 1)
+        return self._all
+
+    def overall(self):
+        return self._built().summary()
+
+    def providers(self):
+        """Return provider -> PriceDistribution (don't modify them)."""
+        self._built()
+        return self._by_provider
+
+    def provider(self, name):
+        dist = self.providers().get(name)
+        return dist.summary() if dist is not None else None
+
+    def combined(self, names):
+        """One distribution for several providers together, merged from theirs."""
+        merged = PriceDistribution()
+        for name in names:
+            dist = self.providers().get(name)
+            if dist is not None:
+                merged.merge(dist)
+        return merged.summary()
+
+price_stats = register_inventory_index(PriceStats())
+
+# ---------------- Metrics and profiling ----------------
+# Operations marked with @instrumented count their calls, time them into a
+# latency histogram and count the errors they raise by exception type. Menu
+# screens that catch their own errors report them with record_error. Sales and
+# purchases also add to business counters. Everything is off until
+# metrics.enabled is set (--metrics), and then costs one flag check per call.
+# export_metrics writes a Prometheus text file or a JSON snapshot.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, math.inf)
+
+class Metrics:
+    """Counters, latency histograms and an optional sampling profiler.
+
+    Operations run on several threads (the menu or service, a feed refresh),
+    so the counters are updated under a lock and each thread keeps its own
+    stack of running operations.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.calls = {}      # operation -> number of calls
+        self.latency = {}    # operation -> [count per bucket..., total seconds]
+        self.errors = {}     # (operation, exception type) -> count
+        self.business = {'units_sold': 0, 'revenue': 0.0, 'cogs': 0.0,
+                         'units_bought': 0, 'purchase_cost': 0.0}
+        self._lock = threading.Lock()
+        self._local = threading.local()  # .ops: operations running on this thread (innermost last)
+        self.profiler = None
+        self.profile_every = 0
+        self._profile_countdown = 0
+        self._profiling = False  # a thread has the profiler enabled
+
+    def _ops(self):
+        ops = getattr(self._local, 'ops', None)
+        if ops is None:
+            ops = self._local.ops = []
+        return ops
+
+    @contextmanager
+    def operation(self, name, stepped=False):
+        """Record the block as one call of operation `name`.
+
+        A stepped block gives its thread to other work between steps (the
+        service's long commands), so it is only counted and timed: it isn't
+        put on the thread's operation stack or profiled.
+        """
+        ops = self._ops()
+        profile = False
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.profiler is not None and not ops and not stepped:
+                if self._profile_countdown > 1:
+                    self._profile_countdown -= 1
+                elif not self._profiling:
+                    profile = self._profiling = True
+                    self._profile_countdown = self.profile_every
+        if not stepped:
+            ops.append(name)
+        start = time.perf_counter()
+        try:
+            if profile:
+                self.profiler.enable()
+                try:
+                    yield
+                finally:
+                    self.profiler.disable()
+                    self._profiling = False
+            else:
+                yield
+        except Exception as e:
+            self.record_error(e, name)
+            raise
+        finally:
+            if not stepped:
+                ops.pop()
+            self.record_latency(name, time.perf_counter() - start)
+
+    def call(self, name, func, args, kwargs):
+        """Run func(*args, **kwargs) as operation `name`, recording its metrics."""
+        with self.operation(name):
+            return func(*args, **kwargs)
+
+    def record_latency(self, name, elapsed):
+        with self._lock:
+            buckets = self.latency.get(name)
+            if buckets is None:
+                buckets = self.latency[name] = [0] * len(LATENCY_BUCKETS) + [0.0]
+            buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            buckets[-1] += elapsed
+
+    def record_error(self, error, name=None):
+        if name is None:
+            ops = self._ops()
+            name = ops[-1] if ops else 'main'
+        key = (name, type(error).__name__)
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def record_sales(self, units, revenue, cogs):
+        if _branch_guard.active is not None:
+            return  # what-if sales never happened
+        with self._lock:
+            self.business['units_sold'] += units
+            self.business['revenue'] += revenue
+            self.business['cogs'] += cogs
+
+    def record_purchase(self, units, cost):
+        if _branch_guard.active is not None:
+            return
+        with self._lock:
+            self.business['units_bought'] += units
+            self.business['purchase_cost'] += cost
+
+    def snapshot(self):
+        """All metrics as a JSON-friendly dict."""
+        with self._lock:
+            latency = {}
+            for name, buckets in self.latency.items():
+                latency[name] = {
+                    'buckets': {('+Inf' if le == math.inf else str(le)): count
+                                for le, count in zip(LATENCY_BUCKETS, buckets)},
+                    'count': sum(buckets[:-1]),
+                    'sum_seconds': buckets[-1],
+                }
+            return {
+                'calls': dict(self.calls),
+                'latency': latency,
+                'errors': [{'op': op, 'type': kind, 'count': count}
+                           for (op, kind), count in self.errors.items()],
+                'business': dict(self.business, store_money=store_money),
+            }
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            out = ["# HELP gamestore_calls_total Calls per store operation.",
+                   "# TYPE gamestore_calls_total counter"]
+            out += [f'gamestore_calls_total{{op="{name}"}} {count}' for name, count in self.calls.items()]
+            out += ["# HELP gamestore_latency_seconds Store operation latency.",
+                    "# TYPE gamestore_latency_seconds histogram"]
+            for name, buckets in self.latency.items():
+                running = 0
+                for le, count in zip(LATENCY_BUCKETS, buckets):
+                    running += count
+                    label = '+Inf' if le == math.inf else le
+                    out.append(f'gamestore_latency_seconds_bucket{{op="{name}",le="{label}"}} {running}')
+                out.append(f'gamestore_latency_seconds_sum{{op="{name}"}} {buckets[-1]}')
+                out.append(f'gamestore_latency_seconds_count{{op="{name}"}} {running}')
+            out += ["# HELP gamestore_errors_total Errors per store operation and exception type.",
+                    "# TYPE gamestore_errors_total counter"]
+            out += [f'gamestore_errors_total{{op="{op}",type="{kind}"}} {count}'
+                    for (op, kind), count in self.errors.items()]
+            for field, value in self.business.items():
+                out.append(f"# TYPE gamestore_{field}_total counter")
+                out.append(f"gamestore_{field}_total {value}")
+            out.append("# TYPE gamestore_store_money gauge")
+            out.append(f"gamestore_store_money {store_money}")
+            return "\n".join(out) + "\n"
+
+metrics = Metrics()
+
+def instrumented(name):
+    """Decorator: record calls, latency and errors of an operation in `metrics`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            return metrics.call(name, func, args, kwargs)
+        return wrapper
+    return decorate
+
+def record_error(error):
+    """Count an error that a screen caught and showed to the user."""
+    if metrics.enabled:
+        metrics.record_error(error)
+
+def enable_profiling(every=100):
+    """Profile one in every `every` top-level instrumented calls with cProfile."""
+    metrics.enabled = True
+    metrics.profiler = cProfile.Profile()
+    metrics.profile_every = max(1, every)
+    metrics._profile_countdown = 1
+
+def export_metrics(path):
+    """Write the metrics to `path`: JSON for .json files, Prometheus text otherwise."""
+    text = (json.dumps(metrics.snapshot(), indent=2) if path.lower().endswith('.json')
+            else metrics.prometheus())
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def dump_profile(path):
+    """Save the sampled cProfile statistics (readable with pstats)."""
+    if metrics.profiler is not None:
+        metrics.profiler.dump_stats(path)
+
 def clear_screen():
     """Clears the console screen"""
     print("\n" * 50)
 
+# True while main() holds state_lock for a menu action
+_prompt_releases_lock = False
+
+def ask(prompt=""):
+    """input() for the menu screens.
+
+    While waiting for the user, main()'s hold on state_lock is let go so a
+    background feed refresh can carry on. Code that needs the store to stay
+    put across a prompt (an open branch, a paged listing) holds the lock
+    itself, so it stays locked.
+    """
+    if not _prompt_releases_lock:
+        return input(prompt)
+    state_lock.release()
+    try:
+        return input(prompt)
+    finally:
+        state_lock.acquire()
+
+@contextmanager
+def menu_action():
+    """Hold state_lock while a menu action runs, except while it waits for input (see ask)."""
+    global _prompt_releases_lock
+    with state_lock:
+        _prompt_releases_lock = True
+        try:
+            yield
+        finally:
+            _prompt_releases_lock = False
+
 def pause():
     """Pause until user presses Enter so outputs stay visible before menu redraw."""
     try:
-        input("\nPress Enter to return to the main menu...")
+        ask("\nPress Enter to return to the main menu...")
     except Exception:
         pass
 
@@ -94,7 +1355,7 @@ def get_valid_number(prompt, is_integer=False):
     """
     while True:
         try:
-            num = input(prompt)
+            num = ask(prompt)
             if is_integer:
                 num = int(num)
             else:
@@ -106,6 +1367,7 @@ def get_valid_number(prompt, is_integer=False):
         except ValueError:
             print("Please enter a valid number!")
 
+@instrumented("menu.add_item")
 def add_item():
     """Deprecated: direct adding by user is not allowed anymore.
 
@@ -115,102 +1377,119 @@ def add_item():
     print("\nDirect item creation is disabled. Buy from providers to add new items.")
     pause()
 
+@instrumented("menu.modify_item")
 def modify_item():
     """Modify an existing item in the inventory"""
     try:
         print_header("Modify Item")
-        name = input("Enter the name of the item to modify: ").strip()
+        name = choose_item_name("Enter the name (or part of it) of the item to modify: ")
+        if name is None:
+            print("Operation cancelled.")
+            pause()
+            return
 
         if name not in inventory:
             print_submenu("❌ Item not found in inventory!")
             return
 
         # Show current details and provider
-        print_submenu("Current Item Details")
-        print("┌" + "─" * 58 + "┐")
-        print_item(name, inventory[name])
-        print("└" + "─" * 58 + "┘")
+        screen = Screen()
+        screen.submenu("Current Item Details")
+        screen.add(BOX_TOP)
+        screen.item(name, inventory[name])
+        screen.add(BOX_BOTTOM)
 
         # The user is allowed only to change price and stock (not the name).
-        print_submenu("Select What to Modify")
-        print("┌" + "─" * 58 + "┐")
-        print_menu_item("1", "Price")
-        print_menu_item("2", "Stock")
-        print("└" + "─" * 58 + "┘")
+        screen.submenu("Select What to Modify")
+        screen.add(BOX_TOP)
+        screen.menu_item("1", "Price")
+        screen.menu_item("2", "Stock")
+        screen.add(BOX_BOTTOM)
+        screen.show()
 
-        choice = input("Enter your choice (1-2): ")
+        choice = ask("Enter your choice (1-2): ")
 
         if choice == '1':
             new_price = get_valid_number("Enter new price: $")
-            inventory[name]['price'] = new_price
+            update_item(name, price=new_price)
             print("Price updated successfully!")
             pause()
 
         elif choice == '2':
             new_stock = get_valid_number("Enter new stock quantity: ", True)
-            inventory[name]['stock'] = new_stock
+            update_item(name, stock=new_stock)
             print("Stock updated successfully!")
+            print_stock_warning(name)
             pause()
 
         else:
             print("Invalid choice!")
 
     except Exception as e:
+        record_error(e)
         print(f"An error occurred: {str(e)}")
         pause()
 
+@instrumented("menu.remove_item")
 def remove_item():
     """Remove an item from the inventory"""
     try:
         print_header("Remove Item")
-        name = input("Enter the name of the item to remove: ").strip()
+        name = choose_item_name("Enter the name (or part of it) of the item to remove: ")
+        if name is None:
+            print("Operation cancelled.")
+            pause()
+            return
         
         if name not in inventory:
             print_submenu("❌ Item not found in inventory!")
             return
             
-        print_submenu("Current Item Details")
-        print("┌" + "─" * 58 + "┐")
-        print_item(name, inventory[name])
-        print("└" + "─" * 58 + "┘")
+        screen = Screen()
+        screen.submenu("Current Item Details")
+        screen.add(BOX_TOP)
+        screen.item(name, inventory[name])
+        screen.add(BOX_BOTTOM)
+        screen.show()
         
-        confirm = input("\nAre you sure you want to remove this item? (yes/no): ").lower()
+        confirm = ask("\nAre you sure you want to remove this item? (yes/no): ").lower()
         if confirm == 'yes':
-            del inventory[name]
+            delete_inventory_item(name)
             print_submenu("✅ Item removed successfully!")
         else:
             print("Operation cancelled.")
             pause()
             
     except Exception as e:
+        record_error(e)
         print(f"An error occurred: {str(e)}")
         pause()
 
+@instrumented("report.inventory_value")
 def calculate_inventory_value():
     """Calculate and display the total value of inventory"""
     try:
-        total_value = 0
-        total_cost = 0
         # Sum sale value and total cost invested in inventory
-        for item, details in inventory.items():
-            item_value = details['price'] * details['stock']
-            total_value += item_value
-            # cost may not exist for very old entries, default to 0
-            item_cost = details.get('cost', 0) * details['stock']
-            total_cost += item_cost
-            
-        print_header("Inventory Value Summary")
-        print("┌" + "─" * 58 + "┐")
-        print("│ " + f"{'Total Sale Value:':<30} ${total_value:<25.2f}" + " │")
-        print("│ " + f"{'Total Cost Invested:':<30} ${total_cost:<25.2f}" + " │")
-        print("│ " + f"{'Potential Profit:':<30} ${(total_value - total_cost):<25.2f}" + " │")
-        print("└" + "─" * 58 + "┘")
+        totals = inventory_totals.totals()
+        total_value = totals['value']
+        total_cost = totals['cost']
+
+        screen = Screen()
+        screen.header("Inventory Value Summary")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Total Sale Value:':<30} ${total_value:<25.2f}" + " │")
+        screen.add("│ " + f"{'Total Cost Invested:':<30} ${total_cost:<25.2f}" + " │")
+        screen.add("│ " + f"{'Potential Profit:':<30} ${(total_value - total_cost):<25.2f}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
         pause()
 
     except Exception as e:
+        record_error(e)
         print_info(f"❌ An error occurred: {e}")
         pause()
 
+@instrumented("report.most_expensive")
 def find_most_expensive():
     """Find and display the most expensive item"""
     try:
@@ -218,147 +1497,291 @@ def find_most_expensive():
             print_submenu("❌ Inventory is empty!")
             return
             
-        most_expensive = max(inventory.items(), key=lambda x: x[1]['price'])
-        print_header("Most Expensive Item")
-        print("┌" + "─" * 58 + "┐")
-        print_item(most_expensive[0], most_expensive[1])
-        print("└" + "─" * 58 + "┘")
+        name = price_index.most_expensive(1)[0]
+        screen = Screen()
+        screen.header("Most Expensive Item")
+        screen.add(BOX_TOP)
+        screen.item(name, inventory[name])
+        screen.add(BOX_BOTTOM)
+        screen.show()
         pause()
 
     except Exception as e:
+        record_error(e)
         print_info(f"❌ An error occurred: {e}")
         pause()
 
-def calculate_average_price():
-    """Calculate and display the average price of items"""
+@instrumented("menu.browse_by_price")
+def browse_by_price():
+    """Show the top / cheapest items or the items within a price range."""
+    try:
+        if not inventory:
+            print_submenu("❌ Inventory is empty!")
+            return
+
+        screen = Screen()
+        screen.header("Browse Items by Price")
+        screen.add(BOX_TOP)
+        screen.menu_item("1", "Most expensive items")
+        screen.menu_item("2", "Cheapest items")
+        screen.menu_item("3", "Items in a price range")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+
+        choice = ask("Enter your choice (1-3): ").strip()
+        if choice == '1':
+            count = get_valid_number("How many items to show: ", True)
+            names = price_index.most_expensive(count)
+            title = f"Top {count} Most Expensive Items"
+        elif choice == '2':
+            count = get_valid_number("How many items to show: ", True)
+            names = price_index.cheapest(count)
+            title = f"Top {count} Cheapest Items"
+        elif choice == '3':
+            low = get_valid_number("Lowest price: $")
+            high = get_valid_number("Highest price: $")
+            names = price_index.in_range(low, high)
+            title = f"Items from ${low:.2f} to ${high:.2f}"
+        else:
+            print("Invalid choice!")
+            return
+
+        screen.submenu(title)
+        if not names:
+            screen.add("No items found.")
+        else:
+            screen.add(BOX_TOP)
+            for name in names:
+                screen.item(name, inventory[name])
+            screen.add(BOX_BOTTOM)
+        screen.show()
+        pause()
+
+    except Exception as e:
+        record_error(e)
+        print(f"❌ An error occurred: {str(e)}")
+        pause()
+
+def _price(value):
+    """Format a price for a 10 character column ('-' when there is none)."""
+    return f"${value:>9.2f}" if value is not None else f"{'-':>10}"
+
+@instrumented("report.average_price")
+def calculate_average_price():
+    """Calculate and display the average price of items"""
     try:
         if not inventory:
             print_submenu("❌ Inventory is empty!")
             return
             
-        total_price = 0
-        total_items = 0
+        totals = inventory_totals.totals()
         # Average per *item type* (not weighted by stock)
-        for item in inventory.values():
-            total_price += item['price']
-            total_items += 1
-
-        average = total_price / total_items
+        average = totals['price_sum'] / totals['count']
 
         # Also calculate weighted average by stock
-        total_price_stock = 0
-        total_stock = 0
-        for item in inventory.values():
-            total_price_stock += item['price'] * item['stock']
-            total_stock += item['stock']
-            
+        total_price_stock = totals['value']
+        total_stock = totals['stock_sum']
         weighted = total_price_stock / total_stock if total_stock > 0 else 0
         
-        print_header("Price Analysis")
-        print("┌" + "─" * 58 + "┐")
-        print("│ " + f"{'Average Price per Product:':<30} ${average:<25.2f}" + " │")
-        print("│ " + f"{'Weighted Average by Stock:':<30} ${weighted:<25.2f}" + " │")
-        print("└" + "─" * 58 + "┘")
+        overall = price_stats.overall()
+        unit, stock = overall['unit'], overall['stock_weighted']
+        screen = Screen()
+        screen.header("Price Analysis")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Average Price per Product:':<30} ${average:<25.2f}" + " │")
+        screen.add("│ " + f"{'Weighted Average by Stock:':<30} ${weighted:<25.2f}" + " │")
+        screen.add(BOX_DIVIDER)
+        screen.add("│ " + f"{'Per product (50/90/99%):':<24} {_price(unit['median'])} "
+                   f"{_price(unit['p90'])} {_price(unit['p99'])}" + " │")
+        screen.add("│ " + f"{'Per unit (50/90/99%):':<24} {_price(stock['median'])} "
+                   f"{_price(stock['p90'])} {_price(stock['p99'])}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.submenu("Price Bands")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Price band':<21} {'products':>10} {'share':>7} {'units':>9} {'share':>6}" + " │")
+        items, units = overall['items'] or 1, overall['units'] or 1
+        for band, count in overall['bands'].items():
+            in_stock = overall['stock_bands'][band]
+            screen.add("│ " + f"{band:<21} {count:>10} {count / items:>7.1%} "
+                       f"{in_stock:>9} {in_stock / units:>6.1%}" + " │")
+        screen.add(BOX_BOTTOM)
+        by_provider = price_stats.providers()
+        largest = heapq.nlargest(PRICE_PROVIDER_ROWS, by_provider.items(), key=lambda kv: kv[1].items)
+        screen.submenu(f"Prices by Provider ({len(largest)} of {len(by_provider)})")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Provider':<17} {'items':>6} {'median':>10} {'p90':>10} {'p99':>10}" + " │")
+        for provider, dist in largest:
+            sketch = dist.unit
+            screen.add("│ " + f"{(provider or '(none)')[:17]:<17} {dist.items:>6} {_price(sketch.quantile(0.5))} "
+                       f"{_price(sketch.quantile(0.9))} {_price(sketch.quantile(0.99))}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
         pause()
         
     except Exception as e:
+        record_error(e)
         print_info(f"❌ An error occurred: {e}")
 
 # ---------------- Providers and buying logic ----------------
 # Providers are sources where we can buy stock to add to our store.
 # Each provider has items available with a cost and available quantity.
-providers = {
-    # New set of providers with expanded catalogs (up to 10 items each)
-    'Hololive Merch Hub': {
-        'Gawr Gura Plushie (Small)': {'cost': 8.00, 'available': 50},
-        'Hololive Tee - Gura': {'cost': 12.00, 'available': 30},
-        'Gura Keychain': {'cost': 3.00, 'available': 100},
-        'Gura Acrylic Stand': {'cost': 6.00, 'available': 40},
-        'Gura Poster A2': {'cost': 4.00, 'available': 60},
-        'Gura Hoodie': {'cost': 20.00, 'available': 15},
-        'Gura Cap': {'cost': 7.00, 'available': 20},
-        'Gura Socks': {'cost': 2.50, 'available': 50},
-        'Hololive Collab Sticker Set': {'cost': 1.20, 'available': 200},
-        'Gura Plushie (Large)': {'cost': 14.00, 'available': 10}
-    },
-    'GoodSmileCo': {
-        'Megumin Figure - GSC': {'cost': 45.00, 'available': 20},
-        'Chibi Amiibo Set': {'cost': 4.50, 'available': 60},
-        'Figma Action Figure': {'cost': 30.00, 'available': 25},
-        'Nendoroid Mystery': {'cost': 22.00, 'available': 18},
-        'Scale Figure 1/7': {'cost': 55.00, 'available': 12},
-        'GSC Poster Pack': {'cost': 3.50, 'available': 80},
-        'Collectible Stand': {'cost': 6.00, 'available': 40},
-        'Limited Edition Box': {'cost': 70.00, 'available': 6},
-        'Character Badge Set': {'cost': 2.00, 'available': 120},
-        'Mini Diorama Kit': {'cost': 9.00, 'available': 30}
-    },
-    'ConsoleCorp': {
-        'OmegaStation X Pro': {'cost': 260.00, 'available': 5},
-        'Pro Controller - Carbon': {'cost': 22.00, 'available': 40},
-        'Console Carrying Case': {'cost': 12.00, 'available': 50},
-        'HDMI Elite Cable': {'cost': 5.00, 'available': 80},
-        'Charging Dock': {'cost': 9.00, 'available': 45},
-        'Console Skin - Blue': {'cost': 3.00, 'available': 100},
-        'Exclusive Bundle Pack': {'cost': 95.00, 'available': 10},
-        'Retro Adapter': {'cost': 7.00, 'available': 35},
-        'Controller Thumb Grips': {'cost': 1.50, 'available': 200},
-        'Console Stand': {'cost': 8.00, 'available': 25}
-    },
-    'IndieSupply': {
-        'Indie Pixel Adventure': {'cost': 6.00, 'available': 60},
-        'Indie Sticker Pack': {'cost': 1.50, 'available': 150},
-        'Soundtrack Digital Code': {'cost': 2.00, 'available': 200},
-        'Artbook Mini': {'cost': 4.00, 'available': 40},
-        'Collector Card': {'cost': 0.80, 'available': 300},
-        'Indie Poster (Signed)': {'cost': 7.00, 'available': 20},
-        'Limited Demo Cartridge': {'cost': 10.00, 'available': 15},
-        'Developer Sticker Set': {'cost': 1.20, 'available': 120},
-        'Game Jam Tee': {'cost': 8.00, 'available': 30},
-        'Indie Soundtrack Vinyl': {'cost': 9.00, 'available': 25}
-    },
-    'KawaiiGoods': {
-        'Pikachu Cushion': {'cost': 7.00, 'available': 40},
-        'Pikachu Mug': {'cost': 3.50, 'available': 60},
-        'Cute Plush Bundle': {'cost': 10.00, 'available': 30},
-        'Anime Socks Pack': {'cost': 2.00, 'available': 100},
-        'Chibi Backpack': {'cost': 15.00, 'available': 20},
-        'Cute Phone Charm': {'cost': 1.20, 'available': 200},
-        'Kawaii Keycap Set': {'cost': 5.00, 'available': 25},
-        'Sticker Mega Pack': {'cost': 2.50, 'available': 120},
-        'Plush Repair Kit': {'cost': 1.00, 'available': 80},
-        'Desk Mat - Cute': {'cost': 6.50, 'available': 18}
+def _demo_providers():
+    return {
+        # New set of providers with expanded catalogs (up to 10 items each)
+        'Hololive Merch Hub': {
+            'Gawr Gura Plushie (Small)': {'cost': 8.00, 'available': 50},
+            'Hololive Tee - Gura': {'cost': 12.00, 'available': 30},
+            'Gura Keychain': {'cost': 3.00, 'available': 100},
+            'Gura Acrylic Stand': {'cost': 6.00, 'available': 40},
+            'Gura Poster A2': {'cost': 4.00, 'available': 60},
+            'Gura Hoodie': {'cost': 20.00, 'available': 15},
+            'Gura Cap': {'cost': 7.00, 'available': 20},
+            'Gura Socks': {'cost': 2.50, 'available': 50},
+            'Hololive Collab Sticker Set': {'cost': 1.20, 'available': 200},
+            'Gura Plushie (Large)': {'cost': 14.00, 'available': 10}
+        },
+        'GoodSmileCo': {
+            'Megumin Figure - GSC': {'cost': 45.00, 'available': 20},
+            'Chibi Amiibo Set': {'cost': 4.50, 'available': 60},
+            'Figma Action Figure': {'cost': 30.00, 'available': 25},
+            'Nendoroid Mystery': {'cost': 22.00, 'available': 18},
+            'Scale Figure 1/7': {'cost': 55.00, 'available': 12},
+            'GSC Poster Pack': {'cost': 3.50, 'available': 80},
+            'Collectible Stand': {'cost': 6.00, 'available': 40},
+            'Limited Edition Box': {'cost': 70.00, 'available': 6},
+            'Character Badge Set': {'cost': 2.00, 'available': 120},
+            'Mini Diorama Kit': {'cost': 9.00, 'available': 30}
+        },
+        'ConsoleCorp': {
+            'OmegaStation X Pro': {'cost': 260.00, 'available': 5},
+            'Pro Controller - Carbon': {'cost': 22.00, 'available': 40},
+            'Console Carrying Case': {'cost': 12.00, 'available': 50},
+            'HDMI Elite Cable': {'cost': 5.00, 'available': 80},
+            'Charging Dock': {'cost': 9.00, 'available': 45},
+            'Console Skin - Blue': {'cost': 3.00, 'available': 100},
+            'Exclusive Bundle Pack': {'cost': 95.00, 'available': 10},
+            'Retro Adapter': {'cost': 7.00, 'available': 35},
+            'Controller Thumb Grips': {'cost': 1.50, 'available': 200},
+            'Console Stand': {'cost': 8.00, 'available': 25}
+        },
+        'IndieSupply': {
+            'Indie Pixel Adventure': {'cost': 6.00, 'available': 60},
+            'Indie Sticker Pack': {'cost': 1.50, 'available': 150},
+            'Soundtrack Digital Code': {'cost': 2.00, 'available': 200},
+            'Artbook Mini': {'cost': 4.00, 'available': 40},
+            'Collector Card': {'cost': 0.80, 'available': 300},
+            'Indie Poster (Signed)': {'cost': 7.00, 'available': 20},
+            'Limited Demo Cartridge': {'cost': 10.00, 'available': 15},
+            'Developer Sticker Set': {'cost': 1.20, 'available': 120},
+            'Game Jam Tee': {'cost': 8.00, 'available': 30},
+            'Indie Soundtrack Vinyl': {'cost': 9.00, 'available': 25}
+        },
+        'KawaiiGoods': {
+            'Pikachu Cushion': {'cost': 7.00, 'available': 40},
+            'Pikachu Mug': {'cost': 3.50, 'available': 60},
+            'Cute Plush Bundle': {'cost': 10.00, 'available': 30},
+            'Anime Socks Pack': {'cost': 2.00, 'available': 100},
+            'Chibi Backpack': {'cost': 15.00, 'available': 20},
+            'Cute Phone Charm': {'cost': 1.20, 'available': 200},
+            'Kawaii Keycap Set': {'cost': 5.00, 'available': 25},
+            'Sticker Mega Pack': {'cost': 2.50, 'available': 120},
+            'Plush Repair Kit': {'cost': 1.00, 'available': 80},
+            'Desk Mat - Cute': {'cost': 6.50, 'available': 18}
+        }
     }
-}
 
+providers = LazyCatalog(_demo_providers)  # built on first use, like the demo inventory
+
+def _provider_listing():
+    """Text blocks for the provider screen, produced lazily."""
+    for pname, items in providers.items():
+        yield format_submenu(f"📦 {pname}") + "\n" + BOX_TOP
+        for iname, details in items.items():
+            yield "│ " + f"{iname:<40} ${details['cost']:<6.2f} [{details['available']:>3}]" + " │"
+        yield BOX_BOTTOM
+
+@instrumented("menu.show_store_money")
+def show_store_money():
+    """Display the store's current balance."""
+    screen = Screen()
+    screen.header("Store Money")
+    screen.add(BOX_TOP)
+    screen.add("│ " + f"{'Current Balance:':<30} ${store_money:<25.2f}" + " │")
+    screen.add(BOX_BOTTOM)
+    screen.show()
+    pause()
+
+@instrumented("menu.show_providers")
 def show_providers():
     """Display providers and their items."""
     try:
-        print_header("Our Providers")
-        for pname, items in providers.items():
-            print_submenu(f"📦 {pname}")
-            print("┌" + "─" * 58 + "┐")
-            for iname, details in items.items():
-                print("│ " + f"{iname:<40} ${details['cost']:<6.2f} [{details['available']:>3}]" + " │")
-            print("└" + "─" * 58 + "┘")
+        show_paged("Our Providers", _provider_listing())
     except Exception as e:
-        print_info(f"❌ An error occurred: {e}")
-    pause()
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
 
+def weighted_average_cost(old_stock, old_cost, qty, cost):
+    """Average cost per unit after adding `qty` units bought at `cost` to the stock."""
+    if old_stock + qty > 0:
+        return ((old_cost * old_stock) + (cost * qty)) / (old_stock + qty)
+    return cost
+
+def apply_purchase(provider_name, item_name, qty):
+    """Move `qty` units from a provider into the inventory and pay for them.
+
+    The caller must already have checked availability and money.
+    Returns:
+        bool: True if the item was new to the inventory
+    """
+    cost = providers[provider_name][item_name]['cost']
+    # Reserve the provider stock first (PurchaseError if someone else got it),
+    # then pay; if paying or stocking fails the units go back to the provider
+    # and the money back to the store
+    take_offer_stock(provider_name, item_name, qty)
+    paid = False
+    try:
+        adjust_store_money(-(cost * qty), f"bought {qty} x {item_name} from {provider_name}")
+        paid = True
+
+        # If item exists in inventory, just increase stock and update cost (weighted average)
+        if item_name in inventory:
+            old_stock = inventory[item_name].get('stock', 0)
+            old_cost = inventory[item_name].get('cost', 0)
+            # Keep sale price as-is; user can modify price later
+            update_item(item_name, stock=old_stock + qty,
+                        cost=weighted_average_cost(old_stock, old_cost, qty, cost))
+            new_item = False
+        else:
+            # New item — add to inventory with provider and cost
+            # Default sale price is cost * 2 (simple markup), user can modify later
+            sale_price = round(cost * 2, 2)
+            add_inventory_item(item_name, {'price': sale_price, 'stock': qty, 'cost': cost, 'provider': provider_name})
+            new_item = True
+    except Exception:
+        if _storage is None:  # a database rolls itself back
+            return_offer_stock(provider_name, item_name, qty)
+            if paid:
+                adjust_store_money(cost * qty, f"refund: {qty} x {item_name} from {provider_name}")
+        raise
+    return new_item
+
+@instrumented("menu.buy_from_provider")
 def buy_from_provider():
     """Buy stock from a provider. New products can only be added through this flow."""
-    global store_money
     try:
-        print_header("Buy from Provider")
+        screen = Screen()
+        screen.header("Buy from Provider")
         # List providers
-        print_submenu("Available Providers")
-        print("┌" + "─" * 58 + "┐")
+        screen.submenu("Available Providers")
+        screen.add(BOX_TOP)
         plist = list(providers.keys())
         for i, pname in enumerate(plist, 1):
-            print_menu_item(str(i), pname)
-        print("└" + "─" * 58 + "┘")
+            screen.menu_item(str(i), pname)
+        screen.add(BOX_BOTTOM)
+        screen.show()
         
-        choice = input("Select a provider by number (or 'c' to cancel): ").strip()
+        choice = ask("Select a provider by number (or 'c' to cancel): ").strip()
         if choice.lower() == 'c':
             print_info("Operation cancelled.")
             pause()
@@ -370,34 +1793,57 @@ def buy_from_provider():
         provider_name = plist[int(choice)-1]
         # Show items from provider
         items = providers[provider_name]
-        print_submenu(f"Items from {provider_name}")
-        print("┌" + "─" * 58 + "┐")
+        screen.submenu(f"Items from {provider_name}")
+        screen.add(BOX_TOP)
         item_list = list(items.keys())
         for i, iname in enumerate(item_list, 1):
             d = items[iname]
-            print_menu_item(str(i), f"{iname} - ${d['cost']:.2f} ({d['available']} available)")
-        print("└" + "─" * 58 + "┘")
+            screen.menu_item(str(i), f"{iname} - ${d['cost']:.2f} ({d['available']} available)")
+        screen.add(BOX_BOTTOM)
+        screen.show()
 
-        ichoice = input("Select item by number (or 'c' to cancel): ").strip()
+        ichoice = ask("Select item by number or name (or 'c' to cancel): ").strip()
         if ichoice.lower() == 'c':
             print_info("Operation cancelled.")
             pause()
             return
-        if not ichoice.isdigit() or int(ichoice) < 1 or int(ichoice) > len(item_list):
-            print_info("❌ Invalid item choice!")
-            return
-            
-        item_name = item_list[int(ichoice)-1]
+        if ichoice.isdigit():
+            if int(ichoice) < 1 or int(ichoice) > len(item_list):
+                print_info("❌ Invalid item choice!")
+                return
+            item_name = item_list[int(ichoice)-1]
+        else:
+            # A name or part of one: search this provider's catalog
+            matches = offer_names.search(ichoice, 9, accept=items.__contains__)
+            if not matches:
+                print_info("❌ Invalid item choice!")
+                return
+            if len(matches) == 1:
+                item_name = matches[0]
+            else:
+                screen.submenu("Did you mean")
+                screen.add(BOX_TOP)
+                for i, iname in enumerate(matches, 1):
+                    screen.menu_item(str(i), iname)
+                screen.add(BOX_BOTTOM)
+                screen.show()
+                pick = ask("Select by number (or 'c' to cancel): ").strip()
+                if not pick.isdigit() or int(pick) < 1 or int(pick) > len(matches):
+                    print_info("Operation cancelled.")
+                    pause()
+                    return
+                item_name = matches[int(pick)-1]
         available = items[item_name]['available']
         cost = items[item_name]['cost']
 
-        print_submenu("Selected Item Details")
-        print("┌" + "─" * 58 + "┐")
-        print("│ " + f"{'Item:':<12} {item_name:<44}" + " │")
-        print("│ " + f"{'Provider:':<12} {provider_name:<44}" + " │")
-        print("│ " + f"{'Cost:':<12} ${cost:<43.2f}" + " │")
-        print("│ " + f"{'Available:':<12} {available:<44}" + " │")
-        print("└" + "─" * 58 + "┘")
+        screen.submenu("Selected Item Details")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Item:':<12} {item_name:<44}" + " │")
+        screen.add("│ " + f"{'Provider:':<12} {provider_name:<44}" + " │")
+        screen.add("│ " + f"{'Cost:':<12} ${cost:<43.2f}" + " │")
+        screen.add("│ " + f"{'Available:':<12} {available:<44}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
         
         qty = get_valid_number("Enter quantity to buy: ", True)
         if qty > available:
@@ -406,208 +1852,4286 @@ def buy_from_provider():
             return
             
         total_cost = cost * qty
-        print_submenu("Purchase Summary")
-        print("┌" + "─" * 58 + "┐")
-        print("│ " + f"{'Total Cost:':<12} ${total_cost:<43.2f}" + " │")
-        print("│ " + f"{'Available:':<12} ${store_money:<43.2f}" + " │")
-        print("└" + "─" * 58 + "┘")
+        screen.submenu("Purchase Summary")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Total Cost:':<12} ${total_cost:<43.2f}" + " │")
+        screen.add("│ " + f"{'Available:':<12} ${store_money:<43.2f}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
         
-        confirm = input("Proceed with purchase? (yes/no): ").lower()
+        confirm = ask("Proceed with purchase? (yes/no): ").lower()
         if confirm != 'yes':
             print_info("Operation cancelled.")
             pause()
             return
+        # A feed refresh may have changed the offer while we waited for input
+        offer = providers[provider_name].get(item_name) if provider_name in providers else None
+        if offer is None or offer['cost'] != cost:
+            print_info("❌ The provider changed this offer meanwhile, nothing was bought!")
+            pause()
+            return
+        if qty > offer['available']:
+            print_info("❌ Provider doesn't have that many available anymore!")
+            pause()
+            return
         if total_cost > store_money:
             print_info("❌ Not enough money to complete purchase!")
             pause()
             return
 
-        # Deduct money, reduce provider stock
-        store_money -= total_cost
-        providers[provider_name][item_name]['available'] -= qty
+        existing = item_name in inventory
+        # All changes of one purchase are saved together (when using a database)
+        with storage_transaction():
+            apply_purchase(provider_name, item_name, qty)
+        if metrics.enabled:
+            metrics.record_purchase(qty, total_cost)
 
-        # If item exists in inventory, just increase stock and update cost (simple average)
-        if item_name in inventory:
-            # Update average cost per unit (weighted)
-            old_stock = inventory[item_name].get('stock', 0)
-            old_cost = inventory[item_name].get('cost', 0)
-            if old_stock + qty > 0:
-                new_cost = ((old_cost * old_stock) + (cost * qty)) / (old_stock + qty)
-            else:
-                new_cost = cost
-            inventory[item_name]['stock'] = old_stock + qty
-            inventory[item_name]['cost'] = new_cost
-            # Keep sale price as-is; user can modify price later
+        if existing:
             print_info(f"✅ Bought {qty} units of '{item_name}'. New stock: {inventory[item_name]['stock']}")
+            print_stock_warning(item_name)
             pause()
         else:
-            # New item — add to inventory with provider and cost
-            # Default sale price is cost * 2 (simple markup), user can modify later
-            sale_price = round(cost * 2, 2)
-            inventory[item_name] = {'price': sale_price, 'stock': qty, 'cost': cost, 'provider': provider_name}
-            print_submenu("✅ New Item Added to Inventory")
-            print("┌" + "─" * 58 + "┐")
-            print_item(item_name, inventory[item_name])
-            print("└" + "─" * 58 + "┘")
+            screen.submenu("✅ New Item Added to Inventory")
+            screen.add(BOX_TOP)
+            screen.item(item_name, inventory[item_name])
+            screen.add(BOX_BOTTOM)
+            screen.show()
             pause()
 
     except Exception as e:
+        record_error(e)
         print_info(f"❌ An error occurred: {e}")
 
-# ---------------- Sales simulation ----------------
-def simulate_day_sales():
-    """Simulate a day of sales.
+# ---------------- Bulk purchase orders ----------------
+class PurchaseError(Exception):
+    """A purchase order was rejected; nothing in the store was changed."""
 
-    This uses a simple approach: for each product we simulate a small chance of selling
-    0..some units (bounded by stock). We calculate revenue, cost of goods sold, and profit.
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+def check_purchase_order(lines):
+    """Validate purchase order lines against provider stock and store money.
+
+    Args:
+        lines: iterable of (provider, item, qty)
+    Returns:
+        tuple: (dict (provider, item) -> total qty, total cost)
+    Raises:
+        PurchaseError: listing every problem found in the order
     """
-    global store_money
-    try:
-        if not inventory:
-            print_info("❌ No inventory to simulate sales.")
-            return
+    problems = []
+    wanted = {}
+    for number, (provider_name, item_name, qty) in enumerate(lines, 1):
+        if provider_name not in providers:
+            problems.append(f"line {number}: unknown provider '{provider_name}'")
+        elif item_name not in providers[provider_name]:
+            problems.append(f"line {number}: '{provider_name}' doesn't sell '{item_name}'")
+        elif isinstance(qty, bool) or not isinstance(qty, int) or qty <= 0:
+            problems.append(f"line {number}: quantity must be a positive whole number")
+        else:
+            key = (provider_name, item_name)
+            wanted[key] = wanted.get(key, 0) + qty
 
-        print_header("Simulate Day of Sales")
-        # Ask for a simple aggressiveness factor to control how busy the day is
-        factor = get_valid_number("Enter day demand factor (0.0 - quiet, 1.0 - normal, 2.0 - busy): ")
-        if factor < 0:
-            print_info("Factor cannot be negative. Using 1.0")
-            factor = 1.0
+    total_cost = 0
+    for (provider_name, item_name), qty in wanted.items():
+        offer = providers[provider_name][item_name]
+        if qty > offer['available']:
+            problems.append(f"'{item_name}' from '{provider_name}': {qty} wanted, "
+                            f"only {offer['available']} available")
+        total_cost += offer['cost'] * qty
+    if total_cost > store_money:
+        problems.append(f"order costs ${total_cost:.2f} but the store has ${store_money:.2f}")
+    if problems:
+        raise PurchaseError(problems)
+    return wanted, total_cost
 
-        total_revenue = 0
-        total_cogs = 0
-        total_items_sold = 0
-        sales_details = []
+@instrumented("bulk_purchase")
+def bulk_purchase(lines, expected_cost=None):
+    """Buy many (provider, item, qty) lines as one all-or-nothing order.
 
-        print_submenu("Simulating Sales...")
-        # Iterate through inventory and simulate sales for each item
-        for name, details in inventory.items():
-            # Simple rule: expected sales = min(stock, round(factor * (stock * 0.2)))
-            stock = details['stock']
-            if stock <= 0:
+    Every line is checked first (see check_purchase_order). Then all lines are
+    applied together; if anything fails part way, every change is undone.
+    Args:
+        lines: iterable of (provider, item, qty)
+        expected_cost (float): the total the user agreed to; the order is
+            rejected if the offers now add up to something else
+    Returns:
+        dict: lines, units, total_cost and the names of new_items
+    Raises:
+        PurchaseError: if the order can't be carried out (nothing changes)
+    """
+    wanted, total_cost = check_purchase_order(list(lines))
+    if expected_cost is not None and abs(total_cost - expected_cost) >= 0.005:
+        raise PurchaseError([f"prices changed meanwhile: the order now costs ${total_cost:.2f} "
+                             f"instead of ${expected_cost:.2f}"])
+
+    # What the touched entries looked like before, to undo a failed order
+    money_before = store_money
+    items_before = {item: (dict(inventory[item]) if item in inventory else None)
+                    for _, item in wanted}
+    new_items = []
+    bought = []
+    try:
+        with storage_transaction():
+            for (provider_name, item_name), qty in wanted.items():
+                if apply_purchase(provider_name, item_name, qty):
+                    new_items.append(item_name)
+                bought.append((provider_name, item_name, qty))
+    except Exception:
+        if _storage is None:  # a database rolls itself back
+            # Provider stock is given back rather than overwritten, so units
+            # other stores took meanwhile (see the store fleet) stay taken
+            for provider_name, item_name, qty in bought:
+                return_offer_stock(provider_name, item_name, qty)
+            for item_name, details in items_before.items():
+                if details is None:
+                    if item_name in inventory:
+                        delete_inventory_item(item_name)
+                else:
+                    add_inventory_item(item_name, details)
+            set_store_money(money_before, "purchase order undone")
+        raise
+    if metrics.enabled:
+        metrics.record_purchase(sum(wanted.values()), total_cost)
+    return {
+        'lines': len(wanted),
+        'units': sum(wanted.values()),
+        'total_cost': total_cost,
+        'new_items': new_items,
+    }
+
+@instrumented("menu.bulk_purchase")
+def bulk_purchase_menu():
+    """Enter a purchase order of several lines and buy it all at once."""
+    try:
+        screen = Screen()
+        screen.header("Bulk Purchase Order")
+        screen.add("Enter one line per item as: provider ; item ; quantity")
+        screen.add("Leave the line empty when the order is complete.")
+        screen.show()
+        lines = []
+        while True:
+            text = ask(f"Line {len(lines) + 1}: ").strip()
+            if not text:
+                break
+            parts = [part.strip() for part in text.split(";")]
+            if len(parts) != 3 or not parts[2].isdigit():
+                print("Please use the format: provider ; item ; quantity")
                 continue
-            expected = int(round(factor * (stock * 0.2)))
-            # We'll simulate actually sold between 0 and expected
-            # Because we can't import random, we use a deterministic simple pseudo-random:
-            # Use the length of the name and price to vary outcomes.
-            pseudo = (len(name) + int(details['price'])) % (expected + 1) if expected > 0 else 0
-            sold = pseudo
-            if sold > stock:
-                sold = stock
-
-            revenue = sold * details['price']
-            cogs = sold * details.get('cost', 0)
-            total_revenue += revenue
-            total_cogs += cogs
-            total_items_sold += sold
-            # reduce stock
-            inventory[name]['stock'] = stock - sold
-            sales_details.append((name, sold, revenue, cogs))
+            lines.append((parts[0], parts[1], int(parts[2])))
+        if not lines:
+            print("Operation cancelled.")
+            pause()
+            return
 
-        profit = total_revenue - total_cogs
-        store_money += profit
+        try:
+            wanted, total_cost = check_purchase_order(lines)
+        except PurchaseError as e:
+            record_error(e)
+            screen.submenu("❌ Order rejected")
+            for problem in e.problems:
+                screen.add(f"  - {problem}")
+            screen.show()
+            pause()
+            return
 
-        # Show summary
-        print_submenu("Day Sales Summary")
-        print("┌" + "─" * 58 + "┐")
-        print("│ " + f"{'Total Items Sold:':<30} {total_items_sold:<26}" + " │")
-        print("│ " + f"{'Total Revenue:':<30} ${total_revenue:<25.2f}" + " │")
-        print("│ " + f"{'Cost of Goods Sold:':<30} ${total_cogs:<25.2f}" + " │")
-        print("│ " + f"{'Profit:':<30} ${profit:<25.2f}" + " │")
-        print("│ " + f"{'Store Money After Sales:':<30} ${store_money:<25.2f}" + " │")
-        print("└" + "─" * 58 + "┘")
+        screen.submenu("Order Summary")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Lines:':<30} {len(wanted):<26}" + " │")
+        screen.add("│ " + f"{'Units:':<30} {sum(wanted.values()):<26}" + " │")
+        screen.add("│ " + f"{'Total Cost:':<30} ${total_cost:<25.2f}" + " │")
+        screen.add("│ " + f"{'Store Money:':<30} ${store_money:<25.2f}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        if ask("Place the order? (yes/no): ").lower() != 'yes':
+            print("Operation cancelled.")
+            pause()
+            return
 
-        if sales_details:
-            print_submenu("Detailed Sales by Item")
-            print("┌" + "─" * 58 + "┐")
-            for name, sold, revenue, cogs in sales_details:
-                if sold > 0:
-                    item_profit = revenue - cogs
-                    print("│ " + f"{name[:25]:<25} {sold:>3} sold, ${revenue:>7.2f} rev" + " │")
-            print("└" + "─" * 58 + "┘")
+        result = bulk_purchase(lines, expected_cost=total_cost)
+        screen.submenu(f"✅ Bought {result['units']} units for ${result['total_cost']:.2f}")
+        for name in result['new_items']:
+            screen.add(f"  New item added: {name}")
+        screen.show()
         pause()
 
     except Exception as e:
-        print_info(f"❌ An error occurred during sales simulation: {e}")
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
 
-def display_inventory():
-    """Display all items in the inventory"""
+# ---------------- Cross-provider sourcing ----------------
+class SourcingIndex:
+    """Item name -> every provider offer for it, cheapest first.
+
+    Only offers with stock available are kept, and purchases that change an
+    offer's availability update the index, so finding the cheapest source of
+    an item is a dict lookup instead of a scan over every provider catalog.
+    """
+
+    def __init__(self):
+        self._offers = None  # item -> sorted [(cost, provider)]; None = rebuild on next use
+
+    def invalidate(self):
+        self._offers = None
+
+    def offer_changed(self, provider, item, old, new):
+        offers = self._offers
+        if offers is None:
+            return
+        if old is not None and old['available'] > 0:
+            entries = offers.get(item, [])
+            i = bisect_left(entries, (old['cost'], provider))
+            if i < len(entries) and entries[i] == (old['cost'], provider):
+                del entries[i]
+            if not entries:
+                offers.pop(item, None)
+        if new is not None and new['available'] > 0:
+            insort(offers.setdefault(item, []), (new['cost'], provider))
+
+    def _index(self):
+        if self._offers is None:
+            offers = {}
+            for pname, items in providers.items():
+                for iname, details in items.items():
+                    if details['available'] > 0:
+                        offers.setdefault(iname, []).append((details['cost'], pname))
+            for entries in offers.values():
+                entries.sort()
+            self._offers = offers
+        return self._offers
+
+    def offers_for(self, item, min_qty=1):
+        """Return (cost, provider, available) offers with at least min_qty available, cheapest first."""
+        if hasattr(providers, 'offers_for_item'):
+            return providers.offers_for_item(item, min_qty)
+        result = []
+        for cost, pname in self._index().get(item, ()):
+            available = providers[pname][item]['available']
+            if available >= min_qty:
+                result.append((cost, pname, available))
+        return result
+
+sourcing_index = register_offer_index(SourcingIndex())
+
+def cheapest_offer(item, qty=1):
+    """Return the cheapest (cost, provider, available) offer with `qty` available, or None."""
+    offers = sourcing_index.offers_for(item, qty)
+    return offers[0] if offers else None
+
+def plan_best_source(item, qty):
+    """Split `qty` units of an item over the cheapest offers.
+
+    Returns:
+        list: (provider, item, qty) purchase order lines, cheapest first
+    Raises:
+        PurchaseError: if all providers together don't have enough
+    """
+    lines = []
+    remaining = qty
+    for cost, pname, available in sourcing_index.offers_for(item):
+        take = min(available, remaining)
+        lines.append((pname, item, take))
+        remaining -= take
+        if remaining == 0:
+            return lines
+    raise PurchaseError([f"only {qty - remaining} of {qty} '{item}' available from all providers"])
+
+@instrumented("buy_best_source")
+def buy_best_source(item, qty):
+    """Buy `qty` units of an item from the cheapest providers (all or nothing).
+
+    Returns:
+        dict: the bulk_purchase result plus the order lines used
+    """
+    lines = plan_best_source(item, qty)
+    result = bulk_purchase(lines)
+    result['order'] = lines
+    return result
+
+@instrumented("menu.buy_best_source")
+def buy_best_source_menu():
+    """Buy an item from whichever providers sell it cheapest."""
     try:
-        if not inventory:
-            print_submenu("Inventory is Empty!")
+        print_header("Buy from Cheapest Source")
+        item = choose_item_name("Enter the name (or part of it) of the item to buy: ", offer_names)
+        if item is None:
+            print("Operation cancelled.")
+            pause()
             return
-            
-        print_header("Current Inventory")
-        print("┌" + "─" * 58 + "┐")
-        for item, details in inventory.items():
-            print_item(item, details)
-        print("└" + "─" * 58 + "┘")
+        offers = sourcing_index.offers_for(item)
+        if not offers:
+            print_submenu("❌ No provider has that item available!")
+            pause()
+            return
+
+        screen = Screen()
+        screen.submenu(f"Offers for {item}")
+        screen.add(BOX_TOP)
+        for cost, pname, available in offers:
+            screen.add("│ " + f"{pname:<37} ${cost:<10.2f} [{available:>5}]" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+
+        qty = get_valid_number("Enter quantity to buy: ", True)
+        if qty == 0:
+            print("Operation cancelled.")
+            pause()
+            return
+        lines = plan_best_source(item, qty)
+        total_cost = sum(providers[pname][item]['cost'] * take for pname, _, take in lines)
+        screen.submenu("Purchase Plan")
+        screen.add(BOX_TOP)
+        for pname, _, take in lines:
+            screen.add("│ " + f"{take:>5} from {pname:<46}" + " │")
+        screen.add("│ " + f"{'Total Cost:':<30} ${total_cost:<25.2f}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        if ask("Proceed with purchase? (yes/no): ").lower() != 'yes':
+            print("Operation cancelled.")
+            pause()
+            return
+
+        result = bulk_purchase(lines, expected_cost=total_cost)
+        print_submenu(f"✅ Bought {result['units']} units for ${result['total_cost']:.2f}")
+        pause()
+
+    except PurchaseError as e:
+        record_error(e)
+        screen = Screen()
+        screen.submenu("❌ Purchase not possible")
+        for problem in e.problems:
+            screen.add(f"  - {problem}")
+        screen.show()
         pause()
-            
     except Exception as e:
-        print(f"❌ An error occurred: {str(e)}")
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
 
-def main():
-    """Main program loop"""
-    while True:
-        try:
-            print_header("Game Store Inventory Management")
-            print("┌" + "─" * 58 + "┐")
-            print_menu_item("1", "Add new item (disabled - buy from providers)")
-            print_menu_item("2", "Modify item (price/stock)")
-            print_menu_item("3", "Remove item")
-            print_menu_item("4", "Display inventory")
-            print_menu_item("5", "Calculate total inventory value")
-            print_menu_item("6", "Find most expensive item")
-            print_menu_item("7", "Calculate average price")
-            print_menu_item("8", "Show providers and their catalog")
-            print_menu_item("9", "Buy from provider")
-            print_menu_item("10", "Simulate a day of sales")
-            print_menu_item("11", f"Show store money (Current: ${store_money:.2f})")
-            print_menu_item("0", "Exit")
-            print("└" + "─" * 58 + "┘")
+# ---------------- Item name search ----------------
+# Item names are long ('Megumin Figure - GSC Exclusive'), so the screens that
+# ask for one also accept part of it. A NameIndex keeps every name twice:
+#   - a sorted list of (word, name) pairs, one per word of the name plus one
+#     for the whole lowercase name, so a prefix is a bisect away ("meg", "gsc").
+#     The list is cut into short sorted buckets (SortedBuckets), so adding or
+#     removing a name only shifts one bucket, even with millions of names;
+#   - trigram -> names sets for typo-tolerant matches ("megumni figre").
+# Like the other indexes it follows add/remove changes as they happen and is
+# built from a full scan only on first use or after invalidate(). With --db
+# the names stay in the database: searches are passed on to its search_names.
 
-            choice = input("\nEnter your choice (number): ")
-            
-            clear_screen()
-            
-            if choice == '1':
-                add_item()
-            elif choice == '2':
-                modify_item()
-            elif choice == '3':
-                remove_item()
-            elif choice == '4':
-                display_inventory()
-            elif choice == '5':
-                calculate_inventory_value()
-            elif choice == '6':
-                find_most_expensive()
-            elif choice == '7':
-                calculate_average_price()
-            elif choice == '8':
-                show_providers()
-            elif choice == '9':
-                buy_from_provider()
-            elif choice == '10':
-                simulate_day_sales()
-            elif choice == '11':
-                print_header("Store Money")
-                print("┌" + "─" * 58 + "┐")
-                print("│ " + f"{'Current Balance:':<30} ${store_money:<25.2f}" + " │")
-                print("└" + "─" * 58 + "┘")
-                pause()
-            elif choice == '0':
-                print_submenu("✨ Thank you for using the Game Store Inventory Management System!")
+FUZZY_MIN_SIMILARITY = 0.5  # fraction of the query's trigrams a fuzzy match must contain
+FUZZY_MAX_CANDIDATES = 500  # names scored per fuzzy lookup, taken from the rarest trigrams first
+WHOLE_NAME = "\0"  # marks the whole-name entries in the word list (sorts before any word)
+NAME_BUCKET_SIZE = 512  # entries per bucket of the word list (buckets split at twice this)
+
+def _name_words(key):
+    return {WHOLE_NAME + key} | set(re.findall(r"\w+", key))
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class NameIndex:
+    """Prefix and fuzzy search over inventory item names or provider offer names.
+
+    `source` is 'inventory' (follows item changes) or 'offers' (follows offer
+    changes; a name stays in the index while any provider still offers it).
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._counts = None  # name -> how many places it appears; None = rebuild on next use
+        self._words = SortedBuckets(load=NAME_BUCKET_SIZE)  # (word, name) pairs
+        self._grams = {}     # trigram -> set of names
+
+    def invalidate(self):
+        self._counts = None
+        self._words = SortedBuckets(load=NAME_BUCKET_SIZE)
+        self._grams = {}
+
+    def item_changed(self, name, old, new):
+        if self._counts is not None:
+            self._changed(name, old, new)
+
+    def offer_changed(self, provider, item, old, new):
+        if self._counts is not None:
+            self._changed(item, old, new)
+
+    def _changed(self, name, old, new):
+        if old is None and new is not None:
+            count = self._counts.get(name, 0)
+            self._counts[name] = count + 1
+            if count == 0:
+                self._insert(name)
+        elif old is not None and new is None:
+            count = self._counts.get(name, 0) - 1
+            if count > 0:
+                self._counts[name] = count
+            elif name in self._counts:
+                del self._counts[name]
+                self._delete(name)
+
+    def _insert(self, name):
+        key = name.lower()
+        for word in _name_words(key):
+            self._words.add((word, name))
+        for gram in _trigrams(key):
+            self._grams.setdefault(gram, set()).add(name)
+
+    def _delete(self, name):
+        key = name.lower()
+        for word in _name_words(key):
+            self._words.discard((word, name))
+        for gram in _trigrams(key):
+            names = self._grams.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._grams[gram]
+
+    def _build(self):
+        if self._counts is not None:
+            return
+        counts = {}
+        if self.source == 'inventory':
+            for name in inventory.keys():
+                counts[name] = 1
+        else:
+            for items in providers.values():
+                for name in items.keys():
+                    counts[name] = counts.get(name, 0) + 1
+        words = []
+        grams = {}
+        for name in counts:
+            key = name.lower()
+            words.extend((word, name) for word in _name_words(key))
+            for gram in _trigrams(key):
+                names = grams.get(gram)
+                if names is None:
+                    grams[gram] = [name]
+                else:
+                    names.append(name)
+        # Lists while building, sets once they are complete (much faster in bulk)
+        grams = {gram: set(names) for gram, names in grams.items()}
+        self._counts, self._words, self._grams = counts, SortedBuckets(words, NAME_BUCKET_SIZE), grams
+
+    def _backend(self):
+        source = inventory if self.source == 'inventory' else providers
+        return source if hasattr(source, 'search_names') else None
+
+    def __contains__(self, name):
+        if self._backend() is not None:
+            return name in inventory if self.source == 'inventory' else bool(providers.offers_for_item(name, 0))
+        self._build()
+        return name in self._counts
+
+    def __len__(self):
+        self._build()
+        return len(self._counts)
+
+    @staticmethod
+    def _prefix_range(prefix):
+        """(low, high) bounds of the word list entries whose word starts with `prefix`."""
+        return (prefix,), (prefix + "\U0010ffff",)
+
+    def prefix_matches(self, query, limit=10, accept=None):
+        """Names with a word starting with each word of `query`, whole-name prefixes first."""
+        self._build()
+        key = query.strip().lower()
+        if not key:
+            return []
+        words = self._words
+        # Whole-name prefix ("megumin fig")
+        found = []
+        seen = set()
+        for _, name in words.irange(*self._prefix_range(WHOLE_NAME + key)):
+            if accept is None or accept(name):
+                found.append(name)
+                seen.add(name)
+                if len(found) >= limit:
+                    return found
+        # Every query word starts some word of the name ("meg gsc"): walk the
+        # smallest prefix range and check the other words against the name
+        tokens = re.findall(r"\w+", key) or [key]
+        ranges = sorted((self._prefix_range(token) + (token,) for token in tokens),
+                        key=lambda r: words.count(r[0], r[1]))
+        low, high, _ = ranges[0]
+        others = [token for _, _, token in ranges[1:]]
+        for _, name in words.irange(low, high):
+            if name in seen:
+                continue
+            if others:
+                name_words = re.findall(r"\w+", name.lower())
+                if not all(any(w.startswith(t) for w in name_words) for t in others):
+                    continue
+            if accept is None or accept(name):
+                found.append(name)
+                seen.add(name)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def fuzzy_matches(self, query, limit=10, accept=None, min_similarity=FUZZY_MIN_SIMILARITY):
+        """Names containing enough of the trigrams of `query`, most similar first.
+
+        Returns:
+            list: (similarity, name) pairs; similarity is the fraction of the
+            query's trigrams found in the name (shorter names win ties)
+        """
+        self._build()
+        key = query.strip().lower()
+        if not key:
+            return []
+        postings = sorted((self._grams.get(gram, ()) for gram in _trigrams(key)), key=len)
+        # A name containing at least `need` of the query's trigrams must contain
+        # one of its len - need + 1 rarest ones, so only those give candidates
+        need = max(1, math.ceil(min_similarity * len(postings)))
+        candidates = set()
+        for names in postings[:len(postings) - need + 1]:
+            candidates.update(islice(names, FUZZY_MAX_CANDIDATES - len(candidates)))
+            if len(candidates) >= FUZZY_MAX_CANDIDATES:
                 break
-            else:
-                print_submenu("❌ Invalid choice! Please try again.")
-                
-        except Exception as e:
-            print(f"An unexpected error occurred: {str(e)}")
-            print("Please try again.")
+        shared = Counter()
+        for names in postings:
+            shared.update(candidates.intersection(names))
+        scored = [(count / len(postings), name) for name, count in shared.items()
+                  if count >= need and (accept is None or accept(name))]
+        scored.sort(key=lambda s: (-s[0], len(s[1]), s[1]))
+        return scored[:limit]
 
-if __name__ == "__main__":
+    def search(self, query, limit=10, accept=None):
+        """Ranked names for `query`: exact match, then prefix matches, then fuzzy ones.
+
+        Args:
+            query (str): the name or part of it, typos allowed
+            limit (int): most names returned
+            accept: optional filter, called with each name
+        Returns:
+            list[str]: matching names, best first
+        """
+        backend = self._backend()
+        if backend is not None:
+            return backend.search_names(query, limit, accept)
+        self._build()
+        query = query.strip()
+        found = []
+        if query in self._counts and (accept is None or accept(query)):
+            found.append(query)
+        for name in self.prefix_matches(query, limit, accept):
+            if name not in found:
+                found.append(name)
+        if len(found) < limit:
+            for _, name in self.fuzzy_matches(query, limit, accept):
+                if name not in found:
+                    found.append(name)
+                    if len(found) >= limit:
+                        break
+        return found[:limit]
+
+inventory_names = register_inventory_index(NameIndex('inventory'))
+offer_names = register_offer_index(NameIndex('offers'))
+
+def choose_item_name(prompt, index=None, accept=None):
+    """Ask for an item name, offering the closest names when it isn't exact.
+
+    Returns:
+        str: the chosen name, the text as typed when nothing matched, or None when cancelled
+    """
+    index = index or inventory_names
+    typed = ask(prompt).strip()
+    if typed in index and (accept is None or accept(typed)):
+        return typed
+    matches = index.search(typed, 9, accept) if typed else []
+    if not matches:
+        return typed
+    if len(matches) == 1:
+        print_info(f"Using '{matches[0]}'")
+        return matches[0]
+    screen = Screen()
+    screen.submenu("Did you mean")
+    screen.add(BOX_TOP)
+    for i, name in enumerate(matches, 1):
+        screen.menu_item(str(i), name)
+    screen.add(BOX_BOTTOM)
+    screen.show()
+    choice = ask("Select by number (or 'c' to cancel): ").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(matches):
+        return matches[int(choice) - 1]
+    return None
+
+# ---------------- Automatic replenishment ----------------
+@instrumented("plan_replenishment")
+def plan_replenishment(budget=None, cover_days=7):
+    """Work out a restock order that earns the most margin within a budget.
+
+    For every item with recent sales we want enough stock to cover
+    `cover_days` days at its current sales velocity. Each provider offer for
+    such an item earns (sale price - provider cost) per unit. Offers are taken
+    greedily by margin per dollar spent (best value for the cash first), each
+    limited by the item's remaining need, the offer's availability and the
+    money left. Offers that earn nothing are pruned up front.
+
+    Args:
+        budget (float): money to spend (default and maximum: store_money)
+        cover_days (int): days of sales the restocked items should last
+    Returns:
+        dict: lines (provider, item, qty), total_cost and expected_margin
+    """
+    budget = store_money if budget is None else min(budget, store_money)
+    needs = {}
+    candidates = []
+    for item, velocity in sales_velocity.items():
+        if item not in inventory:
+            continue
+        details = inventory[item]
+        need = math.ceil(velocity * cover_days) - details['stock']
+        if need <= 0:
+            continue
+        needs[item] = need
+        price = details['price']
+        for cost, pname, available in sourcing_index.offers_for(item):
+            margin = price - cost
+            if margin <= 0:
+                break  # offers come cheapest first, the rest earn even less
+            value = margin / cost if cost > 0 else math.inf
+            candidates.append((value, margin, cost, pname, item, available))
+    candidates.sort(key=lambda c: (-c[0], c[2]))
+
+    lines = []
+    spent = 0
+    expected_margin = 0
+    for value, margin, cost, pname, item, available in candidates:
+        qty = min(needs[item], available)
+        if cost > 0:
+            qty = min(qty, int((budget - spent) // cost))
+            while qty > 0 and spent + cost * qty > budget:
+                qty -= 1  # guard against float rounding
+        if qty <= 0:
+            continue
+        lines.append((pname, item, qty))
+        needs[item] -= qty
+        spent += cost * qty
+        expected_margin += margin * qty
+    return {'lines': lines, 'total_cost': spent, 'expected_margin': expected_margin}
+
+def replenish(budget=None, cover_days=7):
+    """Plan a restock order (see plan_replenishment) and buy it in one go.
+
+    Returns:
+        dict: the plan, with the bulk_purchase result under 'result'
+    """
+    plan = plan_replenishment(budget, cover_days)
+    plan['result'] = bulk_purchase(plan['lines']) if plan['lines'] else None
+    return plan
+
+@instrumented("menu.replenishment")
+def replenishment_menu():
+    """Show a suggested restock order and optionally buy it."""
+    try:
+        print_header("Automatic Restock")
+        if not sales_velocity:
+            print_submenu("❌ Simulate some days of sales first!")
+            pause()
+            return
+        budget = get_valid_number(f"Budget to spend (max ${store_money:.2f}): $")
+        cover_days = get_valid_number("Days of sales the stock should cover: ", True)
+        plan = plan_replenishment(budget, cover_days)
+        if not plan['lines']:
+            print_submenu("Nothing needs restocking within that budget.")
+            pause()
+            return
+
+        screen = Screen()
+        screen.submenu("Suggested Order")
+        screen.add(BOX_TOP)
+        for pname, item, qty in plan['lines']:
+            screen.add("│ " + f"{qty:>5} x {item[:27]:<27} from {pname[:16]:<16}" + " │")
+        screen.add("│ " + f"{'Total Cost:':<30} ${plan['total_cost']:<25.2f}" + " │")
+        screen.add("│ " + f"{'Expected Margin:':<30} ${plan['expected_margin']:<25.2f}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        if ask("Place this order? (yes/no): ").lower() != 'yes':
+            print("Operation cancelled.")
+            pause()
+            return
+
+        result = bulk_purchase(plan['lines'], expected_cost=plan['total_cost'])
+        print_submenu(f"✅ Bought {result['units']} units for ${result['total_cost']:.2f}")
+        pause()
+
+    except PurchaseError as e:
+        record_error(e)
+        screen = Screen()
+        screen.submenu("❌ Order rejected")
+        for problem in e.problems:
+            screen.add(f"  - {problem}")
+        screen.show()
+        pause()
+    except Exception as e:
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
+
+# ---------------- Low-stock alerts ----------------
+# An item is "low" when its stock drops to its reorder threshold or below:
+# its own threshold if one was set, else its provider's default, else
+# DEFAULT_REORDER_THRESHOLD. Every stock change (sales, edits, purchases) goes
+# through the inventory helpers, so the alert index re-checks just that item.
+# Low items sit in a heap ordered by days of cover (stock / sales velocity),
+# which makes "what runs out first" a look at the top of the heap. Heap
+# entries for items that changed again are marked stale and skipped.
+
+DEFAULT_REORDER_THRESHOLD = 5
+REORDER_COVER_DAYS = 7  # a suggested reorder brings stock up to this many days of sales
+reorder_thresholds = {}   # item -> threshold
+provider_thresholds = {}  # provider -> default threshold for its items
+
+def reorder_threshold(name, details):
+    """Threshold at or below which the item is low on stock."""
+    if name in reorder_thresholds:
+        return reorder_thresholds[name]
+    return provider_thresholds.get(details.get('provider'), DEFAULT_REORDER_THRESHOLD)
+
+def days_of_cover(name, stock):
+    """Days the stock lasts at the item's sales velocity (inf when it doesn't sell)."""
+    if stock <= 0:
+        return 0.0
+    velocity = sales_velocity.get(name, 0)
+    return stock / velocity if velocity > 0 else math.inf
+
+class LowStockAlerts:
+    """Items at or below their reorder threshold, fewest days of cover first."""
+
+    def __init__(self):
+        self._low = None   # name -> heap entry [cover, stock, name, live]; None = rebuild on next use
+        self._heap = []
+        self._new = set()  # names that became low since the last new_alerts()
+        self._by_provider = {}  # provider -> names of its items (kept while _low is built)
+
+    def invalidate(self):
+        self._low = None
+        self._heap = []
+        self._new = set()
+        self._by_provider = {}
+
+    def _track(self, name, old_provider, new_provider):
+        if old_provider == new_provider:
+            return
+        if old_provider is not None:
+            names = self._by_provider.get(old_provider)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._by_provider[old_provider]
+        if new_provider is not None:
+            self._by_provider.setdefault(new_provider, set()).add(name)
+
+    def _check(self, name, details):
+        old = self._low.pop(name, None)
+        if old is not None:
+            old[3] = False
+        if details is None or details['stock'] > reorder_threshold(name, details):
+            self._new.discard(name)
+            return
+        entry = [days_of_cover(name, details['stock']), details['stock'], name, True]
+        self._low[name] = entry
+        heapq.heappush(self._heap, entry)
+        if old is None:
+            self._new.add(name)
+        if len(self._heap) > 2 * len(self._low) + 64:
+            self._heap = [e for e in self._heap if e[3]]
+            heapq.heapify(self._heap)
+
+    def item_changed(self, name, old, new):
+        if self._low is not None:
+            self._track(name, old and old.get('provider'), new and new.get('provider'))
+            self._check(name, new)
+
+    def velocity_changed(self, names):
+        """Re-sort the low items among `names` after their sales velocity changed."""
+        if not self._low:
+            return
+        if len(names) > len(self._low):
+            names = [name for name in self._low if name in names]
+        for name in names:
+            if name in self._low:
+                self._check(name, inventory[name])
+
+    def recheck(self, name=None, provider=None):
+        """Check an item, or every item of a provider, again after its threshold changed."""
+        if self._low is None:
+            return  # the thresholds are read when the alerts are built
+        names = [name] if provider is None else list(self._by_provider.get(provider, ()))
+        for name in names:
+            self._check(name, dict(inventory[name]) if name in inventory else None)
+
+    def _built(self):
+        if self._low is None:
+            self._low = {}
+            for name, details in inventory.items():
+                self._track(name, None, details.get('provider'))
+                self._check(name, details)
+            self._new = set()
+        return self._low
+
+    def __len__(self):
+        return len(self._built())
+
+    def __contains__(self, name):
+        return name in self._built()
+
+    def lowest(self, limit=10):
+        """Names of up to `limit` low items, fewest days of cover first."""
+        self._built()
+        heap = self._heap
+        top = []
+        while heap and len(top) < limit:
+            entry = heapq.heappop(heap)
+            if entry[3]:
+                top.append(entry)
+        for entry in top:
+            heapq.heappush(heap, entry)
+        return [entry[2] for entry in top]
+
+    def new_alerts(self):
+        """Names that became low since the last call, fewest days of cover first."""
+        self._built()
+        names = sorted(self._new, key=lambda name: self._low[name][:3])
+        self._new = set()
+        return names
+
+low_stock = register_inventory_index(LowStockAlerts())
+
+def stock_alert(name):
+    """Alert details for a low item (None when it isn't low).
+
+    Returns:
+        dict: item, stock, threshold, days_of_cover (None when it isn't
+        selling), reorder_qty and the cheapest offer (provider, cost,
+        available - None if nobody sells it)
+    """
+    # Only this item is looked at, so a single-item change never builds the heap
+    if name not in inventory:
+        return None
+    details = inventory[name]
+    stock = details['stock']
+    threshold = reorder_threshold(name, details)
+    if stock > threshold:
+        return None
+    target = max(math.ceil(sales_velocity.get(name, 0) * REORDER_COVER_DAYS), 2 * threshold, 1)
+    qty = max(target - stock, 1)
+    offer = cheapest_offer(name, qty) or cheapest_offer(name)
+    cover = days_of_cover(name, stock)
+    return {
+        'item': name,
+        'stock': stock,
+        'threshold': threshold,
+        'days_of_cover': cover if cover != math.inf else None,
+        'reorder_qty': qty,
+        'offer': {'provider': offer[1], 'cost': offer[0], 'available': offer[2]} if offer else None,
+    }
+
+def stock_alerts(limit=10):
+    """Alerts for up to `limit` low items, the ones running out soonest first."""
+    return [stock_alert(name) for name in low_stock.lowest(limit)]
+
+def set_reorder_threshold(threshold, item=None, provider=None):
+    """Set (or with threshold None, clear) the reorder threshold of an item or a provider's items."""
+    if (item is None) == (provider is None):
+        raise ValueError("Give either an item or a provider")
+    if threshold is not None and threshold < 0:
+        raise ValueError("Threshold cannot be negative")
+    thresholds, key = (reorder_thresholds, item) if item is not None else (provider_thresholds, provider)
+    if threshold is None:
+        thresholds.pop(key, None)
+    else:
+        thresholds[key] = threshold
+    low_stock.recheck(item, provider)
+
+def format_stock_warning(name):
+    """Return a one-line warning if the item is now low on stock (None when it isn't)."""
+    alert = stock_alert(name)
+    if alert is None:
+        return None
+    offer = alert['offer']
+    source = f", cheapest from {offer['provider']} at ${offer['cost']:.2f}" if offer else ""
+    return (f"⚠️  '{name}' is low on stock ({alert['stock']} left, threshold {alert['threshold']}): "
+            f"reorder {alert['reorder_qty']}{source}")
+
+def print_stock_warning(name):
+    """Print a one-line warning if the item is now low on stock."""
+    warning = format_stock_warning(name)
+    if warning is not None:
+        print(warning)
+
+@instrumented("menu.low_stock")
+def low_stock_menu():
+    """Show the items running out soonest and optionally change thresholds."""
+    try:
+        alerts = stock_alerts(15)
+        screen = Screen()
+        screen.header("Low-Stock Alerts")
+        screen.submenu(f"Running Out Soonest ({len(alerts)} of {len(low_stock)} low items)")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Item':<15} {'stock':>5} {'days':>5} {'order':>5} {'cheapest from':<23}" + " │")
+        for alert in alerts:
+            cover = alert['days_of_cover']
+            offer = alert['offer']
+            source = f"{offer['provider'][:14]} ${offer['cost']:.2f}" if offer else "no offers"
+            screen.add("│ " + f"{alert['item'][:15]:<15} {alert['stock']:>5} "
+                       f"{'-' if cover is None else f'{cover:.1f}':>5} {alert['reorder_qty']:>5} {source[:23]:<23}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.submenu("Reorder Thresholds")
+        screen.add(BOX_TOP)
+        screen.menu_item("1", "Set an item's threshold")
+        screen.menu_item("2", "Set a provider's default threshold")
+        screen.menu_item("0", "Back")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        choice = ask("Enter your choice: ").strip()
+        if choice == '1':
+            name = choose_item_name("Item name: ")
+            if name is None:
+                return
+            if name not in inventory:
+                print_submenu("❌ Item not found in inventory!")
+                pause()
+                return
+            set_reorder_threshold(get_valid_number("Reorder when stock is at or below: ", True), item=name)
+            print_submenu("✅ Threshold saved")
+            print_stock_warning(name)
+            pause()
+        elif choice == '2':
+            provider = ask("Provider name: ").strip()
+            if provider not in providers:
+                print_submenu("❌ Provider not found!")
+                pause()
+                return
+            set_reorder_threshold(get_valid_number("Reorder when stock is at or below: ", True), provider=provider)
+            print_submenu("✅ Threshold saved")
+            pause()
+    except Exception as e:
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
+
+# ---------------- Provider feed ingestion ----------------
+# Suppliers send price/availability files (CSV, JSON lines or JSON). The
+# loader below reads many of them at the same time with asyncio: each file is
+# parsed in chunks on a worker thread and the chunks are merged into the
+# providers catalog one by one, changing only the offers that differ. A
+# refresh can run in a background thread while the menu keeps working; the
+# menu and the merger take turns through state_lock.
+#
+# Every record has: provider, item, cost, available. In CSV files the provider
+# column may be left out, then the file name (without extension) is used.
+# JSON files are streamed too, one value at a time: either a list of records or
+# {"provider": name, "items": {item: {"cost": .., "available": ..}}} (items
+# read before the "provider" key are held until it comes, so put it first).
+
+state_lock = threading.RLock()  # held while the store state is being changed
+feed_reports = []  # one summary dict per finished feed refresh
+
+FEED_CHUNK_SIZE = 2000  # records parsed and merged at a time
+FEED_READ_SIZE = 1 << 16  # characters read at a time from a JSON feed
+
+def _feed_record(record, default_provider):
+    provider = record.get('provider') or default_provider
+    item = record.get('item')
+    if not provider or not item:
+        raise ValueError("record needs a provider and an item")
+    cost = float(record['cost'])
+    available = int(record['available'])
+    if cost < 0 or available < 0:
+        raise ValueError("cost and available cannot be negative")
+    return provider, item, cost, available
+
+class _JsonStream:
+    """Reads the values of a JSON document one by one without loading the whole file."""
+
+    def __init__(self, f):
+        self._f = f
+        self._buf = ""
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _more(self):
+        data = self._f.read(FEED_READ_SIZE)
+        if not data:
+            return False
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """The next non-blank character ('' at the end of the file)."""
+        while True:
+            buf, pos = self._buf, self._pos
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._more():
+                return ""
+
+    def take(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} in JSON feed")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._more():
+                    raise
+                continue
+            # A value ending right at the end of the buffer (a number) may go on
+            if end == len(self._buf) and self._more():
+                continue
+            self._pos = end
+            return value
+
+    def members(self, open_char, close_char):
+        """Step through a list or object: True before each element, False after the last."""
+        self.take(open_char)
+        if self.peek() == close_char:
+            self.take(close_char)
+            return
+        while True:
+            yield True
+            if self.peek() != ',':
+                self.take(close_char)
+                return
+            self.take(',')
+
+def _json_feed_records(f):
+    stream = _JsonStream(f)
+    if stream.peek() == '[':
+        for _ in stream.members('[', ']'):
+            yield stream.value()
+        return
+    provider = None
+    waiting = []  # records read before the provider key
+    for _ in stream.members('{', '}'):
+        key = stream.value()
+        stream.take(':')
+        if key != 'items':
+            value = stream.value()
+            if key == 'provider':
+                provider = value
+                for record in waiting:
+                    yield dict(record, provider=provider)
+                waiting = []
+            continue
+        for _ in stream.members('{', '}'):
+            item = stream.value()
+            stream.take(':')
+            record = dict(stream.value(), item=item)
+            if provider is None:
+                waiting.append(record)
+            else:
+                yield dict(record, provider=provider)
+    for record in waiting:
+        yield dict(record, provider=provider)
+
+def _feed_records(path):
+    """Yield raw record dicts from a feed file, reading it incrementally."""
+    lower = path.lower()
+    with open(path, newline='', encoding='utf-8') as f:
+        if lower.endswith('.csv'):
+            yield from csv.DictReader(f)
+        elif lower.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _json_feed_records(f)
+
+def _feed_chunks(path, chunk_size):
+    """Yield lists of parsed (provider, item, cost, available) tuples plus a bad-record count."""
+    default_provider = os.path.splitext(os.path.basename(path))[0]
+    chunk = []
+    bad = 0
+    for record in _feed_records(path):
+        try:
+            chunk.append(_feed_record(record, default_provider))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            bad += 1
+        if len(chunk) >= chunk_size:
+            yield chunk, bad
+            chunk, bad = [], 0
+    if chunk or bad:
+        yield chunk, bad
+
+def merge_offers(offers):
+    """Apply (provider, item, cost, available) records to the providers catalog.
+
+    Returns:
+        tuple: (added, updated, unchanged) counts
+    """
+    added = updated = unchanged = 0
+    with storage_transaction():
+        for provider, item, cost, available in offers:
+            catalog = providers.get(provider)
+            current = catalog.get(item) if catalog is not None else None
+            if current is None:
+                added += 1
+            elif current['cost'] == cost and current['available'] == available:
+                unchanged += 1
+                continue
+            else:
+                updated += 1
+            set_offer(provider, item, cost, available)
+    return added, updated, unchanged
+
+async def load_provider_feeds(paths, chunk_size=FEED_CHUNK_SIZE):
+    """Read provider feed files concurrently and merge them into `providers`.
+
+    Returns:
+        dict: per-file counts of records, added, updated, unchanged and bad
+        records, plus any error that stopped a file
+    """
+    # asyncio is imported where it's used: it's the slowest import and
+    # most runs (the menu on its own) never need it
+    import asyncio
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max(4, 2 * len(paths)))
+    report = {path: {'records': 0, 'added': 0, 'updated': 0, 'unchanged': 0, 'bad': 0}
+              for path in paths}
+
+    async def read(path):
+        try:
+            chunks = _feed_chunks(path, chunk_size)
+            while 'error' not in report[path]:
+                # Parsing happens on a worker thread so the event loop stays free
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                await queue.put((path, chunk))
+        except Exception as e:
+            report[path]['error'] = f"{type(e).__name__}: {e}"
+
+    async def merge():
+        while True:
+            path, (offers, bad) = await queue.get()
+            counts = report[path]
+            try:
+                if 'error' not in counts:
+                    added, updated, unchanged = merge_offers(offers)
+                    counts['records'] += len(offers) + bad
+                    counts['added'] += added
+                    counts['updated'] += updated
+                    counts['unchanged'] += unchanged
+                    counts['bad'] += bad
+            except Exception as e:
+                # The file stops here; the other feeds carry on
+                counts['error'] = f"{type(e).__name__}: {e}"
+            finally:
+                queue.task_done()
+
+    merger = asyncio.create_task(merge())
+    await asyncio.gather(*(read(path) for path in paths))
+    await queue.join()
+    merger.cancel()
+    return report
+
+@instrumented("refresh_provider_feeds")
+def refresh_provider_feeds(paths, chunk_size=FEED_CHUNK_SIZE):
+    """Load feed files and wait for the result (see load_provider_feeds)."""
+    import asyncio
+    report = asyncio.run(load_provider_feeds(list(paths), chunk_size))
+    feed_reports.append(report)
+    return report
+
+def start_feed_refresh(paths, chunk_size=FEED_CHUNK_SIZE):
+    """Load feed files in a background thread; the report lands in feed_reports."""
+    thread = threading.Thread(target=refresh_provider_feeds, args=(list(paths), chunk_size),
+                              name="feed-refresh", daemon=True)
+    thread.start()
+    return thread
+
+@instrumented("menu.feed_refresh")
+def feed_refresh_menu():
+    """Start loading provider feed files in the background."""
+    try:
+        screen = Screen()
+        screen.header("Refresh Provider Feeds")
+        if feed_reports:
+            screen.submenu("Last Refresh")
+            screen.add(BOX_TOP)
+            for path, counts in feed_reports[-1].items():
+                status = counts.get('error') or (f"{counts['added']} new, {counts['updated']} changed, "
+                                                 f"{counts['bad']} bad")
+                screen.add("│ " + f"{os.path.basename(path)[:20]:<20} {status[:36]:<36}" + " │")
+            screen.add(BOX_BOTTOM)
+        screen.show()
+        text = ask("Feed files to load (separated by commas, empty to go back): ").strip()
+        paths = [path.strip() for path in text.split(",") if path.strip()]
+        if not paths:
+            return
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            print_submenu("❌ File not found: " + ", ".join(missing)[:40])
+            pause()
+            return
+        start_feed_refresh(paths)
+        print_submenu("✅ Loading feeds in the background")
+        pause()
+    except Exception as e:
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
+
+# ---------------- Inventory import / export ----------------
+# Inventory records (name, price, stock, cost, provider) can be written to and
+# read from CSV or JSON-lines files. Both directions stream through generators
+# a chunk at a time, so even multi-million row files use constant memory.
+
+INVENTORY_COLUMNS = ('name', 'price', 'stock', 'cost', 'provider')
+IMPORT_CHUNK_SIZE = 5000
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items from any iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _is_jsonl(path):
+    return path.lower().endswith(('.jsonl', '.ndjson'))
+
+def inventory_records():
+    """Yield one record dict per inventory item."""
+    for name, details in inventory.items():
+        yield {'name': name, 'price': details['price'], 'stock': details['stock'],
+               'cost': details.get('cost', 0), 'provider': details.get('provider', '')}
+
+@instrumented("export_inventory")
+def export_inventory(path, chunk_size=IMPORT_CHUNK_SIZE):
+    """Write the inventory to a CSV or JSONL file (chosen by extension).
+
+    Returns:
+        int: number of items written
+    """
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if _is_jsonl(path):
+            for chunk in chunked(inventory_records(), chunk_size):
+                f.write("".join(json.dumps(record, separators=(',', ':')) + "\n" for record in chunk))
+                written += len(chunk)
+        else:
+            writer = csv.DictWriter(f, fieldnames=INVENTORY_COLUMNS)
+            writer.writeheader()
+            for chunk in chunked(inventory_records(), chunk_size):
+                writer.writerows(chunk)
+                written += len(chunk)
+    return written
+
+def _read_inventory_file(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        if _is_jsonl(path):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def _parse_inventory_records(records, errors):
+    """Turn raw rows into (name, details) pairs; bad rows are counted in errors['bad']."""
+    for record in records:
+        try:
+            name = str(record['name']).strip()
+            price = float(record['price'])
+            stock = int(record['stock'])
+            cost = float(record.get('cost') or 0)
+            if not name or price < 0 or stock < 0 or cost < 0:
+                raise ValueError("invalid inventory record")
+        except (KeyError, TypeError, ValueError, AttributeError):
+            errors['bad'] += 1
+            continue
+        details = {'price': price, 'stock': stock, 'cost': cost}
+        if record.get('provider'):
+            details['provider'] = record['provider']
+        yield name, details
+
+def run_steps(steps):
+    """Run a step generator (one that yields between steps) and return its result."""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+@instrumented("import_inventory")
+def import_inventory(path, mode='upsert', chunk_size=IMPORT_CHUNK_SIZE):
+    """Load inventory records from a CSV or JSONL file.
+
+    Args:
+        path (str): file to read
+        mode (str): 'upsert' adds the imported stock to an existing item and
+            updates its weighted average cost like buying from a provider does
+            (the sale price is kept); 'replace' overwrites existing items.
+            New items are added in both modes.
+        chunk_size (int): records applied (and committed) at a time
+    Returns:
+        dict: counts of added, merged, replaced and bad records
+    """
+    return run_steps(import_inventory_steps(path, mode, chunk_size))
+
+def import_inventory_steps(path, mode='upsert', chunk_size=IMPORT_CHUNK_SIZE):
+    """import_inventory as a generator that yields after each committed chunk."""
+    if mode not in ('upsert', 'replace'):
+        raise ValueError("mode must be 'upsert' or 'replace'")
+    counts = {'added': 0, 'merged': 0, 'replaced': 0, 'bad': 0}
+    records = _parse_inventory_records(_read_inventory_file(path), counts)
+    for chunk in chunked(records, chunk_size):
+        with state_lock, storage_transaction():
+            for name, details in chunk:
+                if name not in inventory:
+                    add_inventory_item(name, details)
+                    counts['added'] += 1
+                elif mode == 'replace':
+                    add_inventory_item(name, details)
+                    counts['replaced'] += 1
+                else:
+                    current = inventory[name]
+                    old_stock = current.get('stock', 0)
+                    new_cost = weighted_average_cost(old_stock, current.get('cost', 0),
+                                                     details['stock'], details['cost'])
+                    update_item(name, stock=old_stock + details['stock'], cost=new_cost)
+                    counts['merged'] += 1
+        yield
+    return counts
+
+@instrumented("menu.import_export")
+def import_export_menu():
+    """Import inventory records from a file or export the inventory to one."""
+    try:
+        screen = Screen()
+        screen.header("Import / Export Inventory")
+        screen.add(BOX_TOP)
+        screen.menu_item("1", "Export inventory to a file (.csv or .jsonl)")
+        screen.menu_item("2", "Import and merge (adds stock, averages cost)")
+        screen.menu_item("3", "Import and replace existing items")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        choice = ask("Enter your choice (1-3): ").strip()
+        if choice not in ('1', '2', '3'):
+            print("Invalid choice!")
+            return
+        path = ask("File name: ").strip()
+        if not path:
+            print("Operation cancelled.")
+            pause()
+            return
+        if choice == '1':
+            written = export_inventory(path)
+            screen.submenu(f"✅ Exported {written} items")
+        else:
+            counts = import_inventory(path, 'upsert' if choice == '2' else 'replace')
+            screen.submenu("✅ Import finished")
+            screen.add(BOX_TOP)
+            for label, count in counts.items():
+                screen.add("│ " + f"{label.capitalize() + ':':<30} {count:<26}" + " │")
+            screen.add(BOX_BOTTOM)
+        screen.show()
+        pause()
+    except Exception as e:
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
+
+# ---------------- Catalog directory (fast start) ----------------
+# A large store keeps its catalogs as files in one directory (--catalog-dir):
+# inventory.csv (or .jsonl) plus one file per provider, named after it, in the
+# provider feed format. Nothing is read at start-up: every file becomes a
+# LazyCatalog that is loaded the first time it's used, so the menu comes up
+# just as fast whatever the catalog size. A loaded file is also saved as JSON
+# in DIR/.gamestore-cache; later runs read that instead of parsing the file
+# again, as long as the file's size and mtime (or, if only the mtime changed,
+# its content hash) still match. The cache is plain data on purpose: anyone who
+# can write to the catalog directory must not be able to make us run code.
+
+CACHE_DIR_NAME = ".gamestore-cache"
+CACHE_VERSION = 2  # bump when the cached layout changes
+
+def _file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _write_cache(cache_path, stat, digest, data):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        header = {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest}
+        f.write(json.dumps(header) + "\n")
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+
+def _read_cached_data(f):
+    data = json.loads(f.read())
+    if not isinstance(data, dict) or not all(isinstance(details, dict) for details in data.values()):
+        raise ValueError("cached catalog isn't a mapping of records")
+    return data
+
+def load_cached(path, build):
+    """Return build(path), reusing the cached result of an earlier run when the file is unchanged."""
+    stat = os.stat(path)
+    cache_path = os.path.join(os.path.dirname(path), CACHE_DIR_NAME, os.path.basename(path) + ".json")
+    digest = None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header['version'] == CACHE_VERSION and header['size'] == stat.st_size:
+                if header['mtime_ns'] == stat.st_mtime_ns:
+                    return _read_cached_data(f)
+                digest = _file_digest(path)
+                if header['hash'] == digest:
+                    data = _read_cached_data(f)
+                    _write_cache(cache_path, stat, digest, data)  # remember the new mtime
+                    return data
+    except (OSError, KeyError, TypeError, ValueError, AttributeError):
+        pass  # no cache yet, or an unreadable one: parse the file
+    if digest is None:
+        digest = _file_digest(path)
+    data = build(path)
+    try:
+        _write_cache(cache_path, stat, digest, data)
+    except OSError:
+        pass  # read-only directory: just run without a cache
+    return data
+
+def _build_inventory(path):
+    errors = {'bad': 0}
+    return dict(_parse_inventory_records(_read_inventory_file(path), errors))
+
+def _build_catalog(path):
+    default_provider = os.path.splitext(os.path.basename(path))[0]
+    catalog = {}
+    for record in _feed_records(path):
+        try:
+            _, item, cost, available = _feed_record(record, default_provider)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+        catalog[item] = {'cost': cost, 'available': available}
+    return catalog
+
+def open_catalog_dir(path):
+    """Use the inventory and provider files in `path`, each loaded on first use.
+
+    Returns:
+        int: number of provider catalogs found
+    """
+    global inventory, providers
+    catalogs = {}
+    inventory = {}  # a directory without an inventory file starts with an empty store
+    for filename in sorted(os.listdir(path)):
+        stem, extension = os.path.splitext(filename)
+        if extension.lower() not in ('.csv', '.jsonl', '.ndjson', '.json'):
+            continue
+        full_path = os.path.join(path, filename)
+        if stem == 'inventory':
+            inventory = LazyCatalog(functools.partial(load_cached, full_path, _build_inventory))
+        else:
+            catalogs[stem] = LazyCatalog(functools.partial(load_cached, full_path, _build_catalog))
+    providers = catalogs
+    invalidate_inventory_indexes()
+    invalidate_offer_indexes()
+    return len(catalogs)
+
+# ---------------- Sales simulation ----------------
+def units_sold(name, price, stock, factor):
+    """How many units of one item sell in a day (the store's sales rule).
+
+    Args:
+        name (str): item name
+        price (float): sale price
+        stock (int): units on hand at the start of the day
+        factor (float): day demand factor (0.0 quiet, 1.0 normal, 2.0 busy)
+    Returns:
+        int: units sold, never more than the stock
+    """
+    if stock <= 0:
+        return 0
+    # Simple rule: expected sales = min(stock, round(factor * (stock * 0.2)))
+    expected = int(round(factor * (stock * 0.2)))
+    # We'll simulate actually sold between 0 and expected
+    # Because we can't import random, we use a deterministic simple pseudo-random:
+    # Use the length of the name and price to vary outcomes.
+    pseudo = (len(name) + int(price)) % (expected + 1) if expected > 0 else 0
+    return min(pseudo, stock)
+
+# Recent sell-through per item: an exponential moving average of units sold
+# per day, updated after every simulated day (used by the restock planner)
+sales_velocity = {}
+SALES_SMOOTHING = 0.3  # weight of the newest day in the moving average
+
+def record_sales(units_by_item, days=1):
+    """Update the sales velocity with the units each item sold over `days` days.
+
+    Only items that were in stock (could sell) should be passed in.
+    """
+    keep = (1 - SALES_SMOOTHING) ** days
+    for name, units in units_by_item.items():
+        per_day = units / days if days else 0
+        sales_velocity[name] = keep * sales_velocity.get(name, per_day) + (1 - keep) * per_day
+    low_stock.velocity_changed(units_by_item)
+
+@instrumented("menu.simulate_day_sales")
+def simulate_day_sales():
+    """Simulate a day of sales.
+
+    This uses a simple approach: for each product we simulate a small chance of selling
+    0..some units (bounded by stock). We calculate revenue, cost of goods sold, and profit.
+    """
+    try:
+        if not inventory:
+            print_info("❌ No inventory to simulate sales.")
+            return
+
+        print_header("Simulate Day of Sales")
+        # Ask for a simple aggressiveness factor to control how busy the day is
+        factor = get_valid_number("Enter day demand factor (0.0 - quiet, 1.0 - normal, 2.0 - busy): ")
+        if factor < 0:
+            print_info("Factor cannot be negative. Using 1.0")
+            factor = 1.0
+
+        total_revenue = 0
+        total_cogs = 0
+        total_items_sold = 0
+        sales_details = []
+
+        print_submenu("Simulating Sales...")
+        low_stock.new_alerts()  # only report items that run low today
+        # The whole day is saved as one transaction (when using a database)
+        with storage_transaction():
+            # Iterate through inventory and simulate sales for each item
+            for name, details in inventory.items():
+                stock = details['stock']
+                if stock <= 0:
+                    continue
+                sold = units_sold(name, details['price'], stock, factor)
+
+                revenue = sold * details['price']
+                cogs = sold * details.get('cost', 0)
+                total_revenue += revenue
+                total_cogs += cogs
+                total_items_sold += sold
+                # reduce stock (unsold items are left alone, so their versions
+                # and the indexes don't change)
+                if sold:
+                    update_item(name, stock=stock - sold)
+                sales_details.append((name, sold, revenue, cogs, details.get('provider')))
+
+            profit = total_revenue - total_cogs
+            adjust_store_money(profit, "day of sales")
+        if metrics.enabled:
+            metrics.record_sales(total_items_sold, total_revenue, total_cogs)
+        record_sales({name: sold for name, sold, _, _, _ in sales_details})
+        sales_history.record_day(sales_details)
+
+        # Show summary
+        screen = Screen()
+        screen.submenu("Day Sales Summary")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'Total Items Sold:':<30} {total_items_sold:<26}" + " │")
+        screen.add("│ " + f"{'Total Revenue:':<30} ${total_revenue:<25.2f}" + " │")
+        screen.add("│ " + f"{'Cost of Goods Sold:':<30} ${total_cogs:<25.2f}" + " │")
+        screen.add("│ " + f"{'Profit:':<30} ${profit:<25.2f}" + " │")
+        screen.add("│ " + f"{'Store Money After Sales:':<30} ${store_money:<25.2f}" + " │")
+        screen.add(BOX_BOTTOM)
+
+        if sales_details:
+            screen.submenu("Detailed Sales by Item")
+            screen.add(BOX_TOP)
+            for name, sold, revenue, cogs, _ in sales_details:
+                if sold > 0:
+                    item_profit = revenue - cogs
+                    screen.add("│ " + f"{name[:25]:<25} {sold:>3} sold, ${revenue:>7.2f} rev" + " │")
+            screen.add(BOX_BOTTOM)
+
+        newly_low = low_stock.new_alerts()
+        if newly_low:
+            screen.submenu(f"⚠️ {len(newly_low)} items ran low today (see Low-stock alerts)")
+            for name in newly_low[:5]:
+                warning = format_stock_warning(name)
+                if warning is not None:
+                    screen.add(warning)
+        screen.show()
+        pause()
+
+    except Exception as e:
+        record_error(e)
+        print_info(f"❌ An error occurred during sales simulation: {e}")
+
+# ---------------- Batch sales simulation ----------------
+# simulate_day_sales runs one interactive day. For planning we need hundreds of
+# days over the whole catalog, so the batch engine below runs the exact same
+# sales rule as units_sold over whole stock/price/cost columns at once.
+
+# One row of the per-day ledger returned by simulate_sales_batch
+DaySales = namedtuple('DaySales', 'day factor items_sold revenue cogs profit money stockouts')
+
+def demand_schedule(days, factors=1.0):
+    """Turn a demand factor (or a list of them) into one factor per day.
+
+    Args:
+        days (int): number of days
+        factors: one number used every day, or a sequence with a factor per day
+    Returns:
+        list: `days` demand factors
+    """
+    if days < 0:
+        raise ValueError("Number of days cannot be negative")
+    if isinstance(factors, (int, float)):
+        schedule = [factors] * days
+    else:
+        schedule = list(factors)[:days]
+        if len(schedule) < days:
+            raise ValueError(f"Demand schedule has {len(schedule)} factors for {days} days")
+    if any(factor < 0 for factor in schedule):
+        raise ValueError("Demand factors cannot be negative")
+    return schedule
+
+def inventory_columns(items=None):
+    """Copy the inventory into (names, price, stock, cost) columns.
+
+    The columns are NumPy arrays when NumPy is installed and stdlib arrays
+    otherwise. Rows follow the inventory's iteration order.
+    """
+    if items is None:
+        items = inventory
+    if isinstance(items, ColumnarInventory):
+        price, stock, cost = items.columns()
+        names = list(items)
+        if np is not None:
+            return names, price.copy(), stock.copy(), cost.copy()
+        return names, array('d', price), array('q', stock), array('d', cost)
+    names = list(items)
+    rows = [items[name] for name in names]
+    price = array('d', [details['price'] for details in rows])
+    stock = array('q', [details['stock'] for details in rows])
+    cost = array('d', [details.get('cost', 0) for details in rows])
+    if np is not None:
+        return names, np.array(price), np.array(stock), np.array(cost)
+    return names, price, stock, cost
+
+def run_sales_days(names, price, stock, cost, money, schedule, on_day=None):
+    """Apply the sales rule for every day in `schedule` over inventory columns.
+
+    `stock` is updated in place. Totals are added up item by item in row order
+    so the money matches simulate_day_sales exactly. If given, on_day(sold) is
+    called after every day with the units each row sold that day.
+
+    Returns:
+        tuple: (list of DaySales, money after the last day)
+    """
+    ledger = []
+    if np is not None:
+        # Part of the pseudo-random rule that doesn't change from day to day
+        base = np.fromiter(map(len, names), dtype=np.int64, count=len(names)) + np.trunc(price).astype(np.int64)
+        for day, factor in enumerate(schedule, 1):
+            expected = np.round(factor * (stock * 0.2)).astype(np.int64)
+            selling = (stock > 0) & (expected > 0)
+            sold = np.where(selling, np.minimum(base % (expected + 1), stock), 0)
+            revenue = sold * price
+            cogs = sold * cost
+            # add.accumulate sums strictly left to right, like the per-item loop
+            total_revenue = float(np.add.accumulate(revenue)[-1]) if len(names) else 0.0
+            total_cogs = float(np.add.accumulate(cogs)[-1]) if len(names) else 0.0
+            stock -= sold
+            profit = total_revenue - total_cogs
+            money += profit
+            ledger.append(DaySales(day, factor, int(sold.sum()), total_revenue, total_cogs,
+                                   profit, money, int(np.count_nonzero(stock <= 0))))
+            if on_day is not None:
+                on_day(sold)
+        return ledger, money
+
+    base = [len(name) + int(p) for name, p in zip(names, price)]
+    for day, factor in enumerate(schedule, 1):
+        total_revenue = 0
+        total_cogs = 0
+        total_sold = 0
+        day_sold = array('q', bytes(8 * len(names))) if on_day is not None else None
+        for row in range(len(names)):
+            units = stock[row]
+            if units <= 0:
+                continue
+            expected = int(round(factor * (units * 0.2)))
+            sold = min(base[row] % (expected + 1), units) if expected > 0 else 0
+            total_revenue += sold * price[row]
+            total_cogs += sold * cost[row]
+            total_sold += sold
+            stock[row] = units - sold
+            if day_sold is not None:
+                day_sold[row] = sold
+        profit = total_revenue - total_cogs
+        money += profit
+        stockouts = sum(1 for units in stock if units <= 0)
+        ledger.append(DaySales(day, factor, total_sold, total_revenue, total_cogs,
+                               profit, money, stockouts))
+        if on_day is not None:
+            on_day(day_sold)
+    return ledger, money
+
+@instrumented("simulate_sales_batch")
+def simulate_sales_batch(days, factors=1.0):
+    """Simulate several days of sales over the whole inventory without prompts.
+
+    Args:
+        days (int): number of days to simulate
+        factors: demand factor used every day, or a sequence with one per day
+    Returns:
+        list[DaySales]: one ledger row per simulated day
+    """
+    return run_steps(simulate_sales_steps(days, factors))
+
+def simulate_sales_steps(days, factors=1.0, step_days=None):
+    """simulate_sales_batch as a generator that yields after every `step_days` days.
+
+    The days are worked out on a copy of the inventory columns; the store is
+    only changed once, after the last day.
+    """
+    schedule = demand_schedule(days, factors)
+    names, price, stock, cost = inventory_columns()
+    start_stock = stock.copy() if np is not None else array('q', stock)
+    item_providers = [inventory[name].get('provider') for name in names]
+
+    def history_day(sold):
+        rows = np.nonzero(sold)[0].tolist() if np is not None else [row for row, units in enumerate(sold) if units]
+        sales_history.record_day((names[row], int(sold[row]), float(sold[row] * price[row]), float(sold[row] * cost[row]),
+                                  item_providers[row]) for row in rows)
+
+    ledger, money = [], store_money
+    step_days = step_days or max(1, len(schedule))
+    for start in range(0, len(schedule), step_days):
+        days_run, money = run_sales_days(names, price, stock, cost, money,
+                                         schedule[start:start + step_days], history_day)
+        ledger.extend(day._replace(day=start + day.day) for day in days_run)
+        if start + step_days < len(schedule):
+            yield
+    # Write back only the items whose stock changed (keeps the indexes in sync)
+    if np is not None:
+        changed = np.nonzero(stock != start_stock)[0].tolist()
+    else:
+        changed = [row for row in range(len(names)) if stock[row] != start_stock[row]]
+    with storage_transaction():
+        for row in changed:
+            update_item(names[row], stock=int(stock[row]))
+        set_store_money(money, f"{len(schedule)} days of sales")
+    if metrics.enabled:
+        metrics.record_sales(sum(day.items_sold for day in ledger), sum(day.revenue for day in ledger),
+                             sum(day.cogs for day in ledger))
+    if schedule:
+        record_sales({names[row]: int(start_stock[row] - stock[row])
+                      for row in range(len(names)) if start_stock[row] > 0}, len(schedule))
+    return ledger
+
+# ---------------- Sales history ----------------
+# Every simulated day (interactive or batch) is recorded per item: units sold,
+# revenue and cost of goods. Days are numbered from 0 and grouped into weeks of
+# 7 and months of 30 simulated days. Each day, week and month is a "rollup"
+# that is added to as the day is written; once a period is over its totals are
+# packed into compact arrays (item ids, units, revenue, cogs, sorted by id) plus
+# per-provider totals. A query over the last N days adds up the fewest
+# rollups covering them (whole months, then whole weeks, then single days), so
+# a 30-day report reads about ten rollups however long the history gets.
+
+SALES_WEEK = 7    # days in a week rollup
+SALES_MONTH = 30  # days in a month rollup
+
+class SalesRollup:
+    """Sales totals of one day, week or month, per item and per provider."""
+
+    __slots__ = ('open', 'ids', 'units', 'revenue', 'cogs', 'by_provider')
+
+    def __init__(self):
+        self.open = {}         # item id -> [units, revenue, cogs] while the period is running
+        self.ids = None        # packed columns once the period is over
+        self.units = None
+        self.revenue = None
+        self.cogs = None
+        self.by_provider = {}  # provider -> [units, revenue, cogs]
+
+    @staticmethod
+    def _add(table, key, units, revenue, cogs):
+        totals = table.get(key)
+        if totals is None:
+            table[key] = [units, revenue, cogs]
+        else:
+            totals[0] += units
+            totals[1] += revenue
+            totals[2] += cogs
+
+    def add(self, item_id, units, revenue, cogs, provider):
+        self._add(self.open, item_id, units, revenue, cogs)
+        self._add(self.by_provider, provider, units, revenue, cogs)
+
+    @classmethod
+    def combined(cls, rollups):
+        """A running rollup holding the totals of `rollups`."""
+        result = cls()
+        for rollup in rollups:
+            for item_id, units, revenue, cogs in rollup.rows():
+                cls._add(result.open, item_id, units, revenue, cogs)
+            for provider, (units, revenue, cogs) in rollup.by_provider.items():
+                cls._add(result.by_provider, provider, units, revenue, cogs)
+        return result
+
+    def close(self):
+        """Pack the per-item totals into arrays (the period is over)."""
+        ids = sorted(self.open)
+        self.ids = array('l', ids)
+        self.units = array('q', [self.open[i][0] for i in ids])
+        self.revenue = array('d', [self.open[i][1] for i in ids])
+        self.cogs = array('d', [self.open[i][2] for i in ids])
+        self.open = None
+
+    def rows(self):
+        """(item id, units, revenue, cogs) for every item that sold."""
+        if self.open is not None:
+            return ((item_id, t[0], t[1], t[2]) for item_id, t in self.open.items())
+        return zip(self.ids, self.units, self.revenue, self.cogs)
+
+class SalesHistory:
+    """Per-item, per-day sales with day, week and month rollups."""
+
+    def __init__(self):
+        self.days = 0       # days recorded so far (the next day's number)
+        self._ids = {}      # item name -> id
+        self._names = []    # id -> item name
+        self._rollups = {'day': [], 'week': [], 'month': []}
+        self._day_units = array('q')
+        self._day_revenue = array('d')
+        self._day_cogs = array('d')
+        self._shared = None  # names known when forked, while the rollups are still the origin's
+
+    def fork(self):
+        """A copy of the history as it is now that records new days on its own.
+
+        Forking is O(1): the copy reads this history's rollups (a day already
+        recorded never changes) and takes its own copies the first time it
+        records a day.
+        """
+        history = SalesHistory.__new__(SalesHistory)
+        history.__dict__.update(self.__dict__)
+        history._shared = len(self._names) if self._shared is None else self._shared
+        return history
+
+    def _unshare(self):
+        days = self.days
+        self._names = self._names[:self._shared]
+        self._ids = {name: item_id for item_id, name in enumerate(self._names)}
+        day_rollups = self._rollups['day'][:days]
+        rollups = {'day': day_rollups}
+        for period, length in (('week', SALES_WEEK), ('month', SALES_MONTH)):
+            kept = self._rollups[period][:-(-days // length)]
+            # The last period may still be running, or have taken days the
+            # origin recorded after the fork, so it is rebuilt from its days
+            if kept and (days % length or kept[-1].open is not None):
+                start = (len(kept) - 1) * length
+                kept[-1] = SalesRollup.combined(day_rollups[start:days])
+            rollups[period] = kept
+        self._rollups = rollups
+        self._day_units = self._day_units[:days]
+        self._day_revenue = self._day_revenue[:days]
+        self._day_cogs = self._day_cogs[:days]
+        self._shared = None
+
+    def _item_id(self, name):
+        item_id = self._ids.get(name)
+        if item_id is None:
+            item_id = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return item_id
+
+    def record_day(self, sales):
+        """Record one day of sales: (name, units, revenue, cogs, provider) tuples."""
+        if self._shared is not None:
+            self._unshare()
+        day = self.days
+        rollups = self._rollups
+        if day % SALES_WEEK == 0:
+            if rollups['week']:
+                rollups['week'][-1].close()
+            rollups['week'].append(SalesRollup())
+        if day % SALES_MONTH == 0:
+            if rollups['month']:
+                rollups['month'][-1].close()
+            rollups['month'].append(SalesRollup())
+        today, week, month = SalesRollup(), rollups['week'][-1], rollups['month'][-1]
+        units_total = 0
+        revenue_total = 0.0
+        cogs_total = 0.0
+        for name, units, revenue, cogs, provider in sales:
+            if not units:
+                continue
+            item_id = self._item_id(name)
+            today.add(item_id, units, revenue, cogs, provider)
+            week.add(item_id, units, revenue, cogs, provider)
+            month.add(item_id, units, revenue, cogs, provider)
+            units_total += units
+            revenue_total += revenue
+            cogs_total += cogs
+        today.close()
+        rollups['day'].append(today)
+        self._day_units.append(units_total)
+        self._day_revenue.append(revenue_total)
+        self._day_cogs.append(cogs_total)
+        self.days = day + 1
+
+    def _covering(self, days):
+        """The fewest rollups that together cover the last `days` days (all if None)."""
+        start = 0 if days is None else max(0, self.days - days)
+        rollups = self._rollups
+        day = start
+        while day < self.days:
+            if day % SALES_MONTH == 0 and day + SALES_MONTH <= self.days:
+                yield rollups['month'][day // SALES_MONTH]
+                day += SALES_MONTH
+            elif day % SALES_WEEK == 0 and day + SALES_WEEK <= self.days:
+                yield rollups['week'][day // SALES_WEEK]
+                day += SALES_WEEK
+            else:
+                yield rollups['day'][day]
+                day += 1
+
+    def item_totals(self, days=None):
+        """Item name -> [units, revenue, cogs] over the last `days` days."""
+        totals = {}
+        for rollup in self._covering(days):
+            for item_id, units, revenue, cogs in rollup.rows():
+                entry = totals.get(item_id)
+                if entry is None:
+                    totals[item_id] = [units, revenue, cogs]
+                else:
+                    entry[0] += units
+                    entry[1] += revenue
+                    entry[2] += cogs
+        names = self._names
+        return {names[item_id]: entry for item_id, entry in totals.items()}
+
+    def top_sellers(self, days=30, k=10, by='units'):
+        """The k best-selling items over the last `days` days.
+
+        Args:
+            days (int): window length (None = the whole history)
+            k (int): how many items
+            by (str): 'units', 'revenue' or 'profit'
+        Returns:
+            list: (name, units, revenue, profit) tuples, best first
+        """
+        if by not in ('units', 'revenue', 'profit'):
+            raise ValueError("by must be 'units', 'revenue' or 'profit'")
+        rows = [(name, units, revenue, revenue - cogs)
+                for name, (units, revenue, cogs) in self.item_totals(days).items()]
+        column = {'units': 1, 'revenue': 2, 'profit': 3}[by]
+        return heapq.nlargest(k, rows, key=operator.itemgetter(column))
+
+    def revenue_by_provider(self, days=30):
+        """Provider -> (units, revenue, profit) over the last `days` days, most revenue first."""
+        totals = {}
+        for rollup in self._covering(days):
+            for provider, (units, revenue, cogs) in rollup.by_provider.items():
+                entry = totals.setdefault(provider, [0, 0.0, 0.0])
+                entry[0] += units
+                entry[1] += revenue
+                entry[2] += cogs
+        return {provider: (units, revenue, revenue - cogs)
+                for provider, (units, revenue, cogs) in sorted(totals.items(), key=lambda t: -t[1][1])}
+
+    def sell_through(self, days=30, names=None):
+        """Item name -> share of its units that sold over the last `days` days.
+
+        Sell-through is units sold / (units sold + units still in stock now).
+        Items without sales are left out unless listed in `names`.
+        """
+        totals = self.item_totals(days)
+        result = {}
+        for name in (totals if names is None else names):
+            sold = totals[name][0] if name in totals else 0
+            stock = inventory[name]['stock'] if name in inventory else 0
+            result[name] = sold / (sold + stock) if sold + stock else 0.0
+        return result
+
+    def daily_totals(self, days=30):
+        """(day, units, revenue, cogs) for each of the last `days` days."""
+        start = max(0, self.days - days)
+        return [(day, self._day_units[day], self._day_revenue[day], self._day_cogs[day])
+                for day in range(start, self.days)]
+
+sales_history = SalesHistory()
+
+@instrumented("menu.sales_history")
+def sales_history_menu():
+    """Show sales trends: top sellers, revenue by provider and sell-through."""
+    try:
+        print_header("Sales History")
+        if not sales_history.days:
+            print_info("No sales recorded yet - simulate some days first.")
+            pause()
+            return
+        days = get_valid_number("Report over how many recent days (0 = all history): ", True) or None
+        screen = Screen()
+        screen.submenu(f"Top Sellers ({'all' if days is None else days} days, {sales_history.days} recorded)")
+        screen.add(BOX_TOP)
+        for name, units, revenue, profit in sales_history.top_sellers(days, 10):
+            screen.add("│ " + f"{name[:30]:<30} {units:>6} sold ${revenue:>13.2f}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.submenu("Revenue by Provider")
+        screen.add(BOX_TOP)
+        for provider, (units, revenue, profit) in sales_history.revenue_by_provider(days).items():
+            screen.add("│ " + f"{str(provider)[:21]:<21} ${revenue:>14.2f} profit ${profit:>11.2f}" + " │")
+        screen.add(BOX_BOTTOM)
+        slowest = heapq.nsmallest(5, sales_history.sell_through(days).items(), key=operator.itemgetter(1))
+        screen.submenu("Slowest Sell-Through")
+        screen.add(BOX_TOP)
+        for name, rate in slowest:
+            screen.add("│ " + f"{name[:45]:<45} {rate:>11.1%}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        pause()
+    except Exception as e:
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
+
+# ---------------- Demand scenario sweeps ----------------
+# To compare demand factors we run many independent batch simulations. Each
+# scenario is a (factor, days, seed) combination; the seed adds random day to
+# day variation around the factor. Scenarios run in a process pool, and every
+# worker gets its own copy of the starting inventory columns and cash once (in
+# the pool initializer), so the global inventory and store_money never change.
+#   $ python gamestore.py --sweep 0.5 1.0 2.0 --sweep-days 7 30 --sweep-seeds 50
+# prints one JSON summary per (factor, days).
+
+_sweep_start = None  # (names, price, stock, cost, money) inside a worker process
+
+def _init_sweep_worker(start):
+    global _sweep_start
+    _sweep_start = start
+
+def scenario_schedule(factor, days, seed, jitter):
+    """Daily demand factors for one scenario: `factor` with seeded random noise."""
+    if not jitter:
+        return [factor] * days
+    rng = random.Random(seed)
+    return [factor * rng.lognormvariate(0.0, jitter) for _ in range(days)]
+
+def _run_scenario(scenario):
+    factor, days, seed, jitter = scenario
+    names, price, stock, cost, money = _sweep_start
+    stock = stock.copy() if np is not None else array('q', stock)
+    ledger, end_money = run_sales_days(names, price, stock, cost, money,
+                                       scenario_schedule(factor, days, seed, jitter))
+    return {
+        'factor': factor,
+        'days': days,
+        'seed': seed,
+        'profit': end_money - money,
+        'stockouts': ledger[-1].stockouts if ledger else 0,
+        'ending_cash': end_money,
+    }
+
+def _distribution(values):
+    """Summarize a list of numbers as mean, min, p5, p50, p95 and max."""
+    values = sorted(values)
+    last = len(values) - 1
+    def pct(p):
+        return values[int(round(p * last))]
+    return {
+        'mean': sum(values) / len(values),
+        'min': values[0],
+        'p5': pct(0.05),
+        'p50': pct(0.50),
+        'p95': pct(0.95),
+        'max': values[-1],
+    }
+
+@instrumented("run_scenario_sweep")
+def run_scenario_sweep(factors, horizons, seeds, jitter=0.25, workers=None):
+    """Run every (factor, horizon, seed) scenario and summarize the outcomes.
+
+    Args:
+        factors: demand factors to compare (0.0 quiet, 1.0 normal, 2.0 busy)
+        horizons: numbers of days to simulate
+        seeds: random seeds; each one is a separate run of a scenario
+        jitter (float): spread of the random daily variation (0 = none)
+        workers (int): worker processes (default: all cores, 1 = no pool)
+    Returns:
+        list[dict]: one summary per (factor, days) with the profit, stockouts
+        and ending_cash distributions over the seeds
+    """
+    scenarios = [(factor, days, seed, jitter)
+                 for factor, days, seed in product(factors, horizons, seeds)]
+    for factor, days, _, _ in scenarios:
+        demand_schedule(days, factor)  # validate before starting any worker
+    start = inventory_columns() + (store_money,)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_sweep_worker(start)
+        results = [_run_scenario(scenario) for scenario in scenarios]
+    else:
+        # Several scenarios per task keeps the inter-process traffic small
+        chunksize = max(1, len(scenarios) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                                 initargs=(start,)) as executor:
+            results = list(executor.map(_run_scenario, scenarios, chunksize=chunksize))
+
+    groups = {}
+    for result in results:
+        groups.setdefault((result['factor'], result['days']), []).append(result)
+    summary = []
+    for (factor, days), runs in groups.items():
+        summary.append({
+            'factor': factor,
+            'days': days,
+            'runs': len(runs),
+            'profit': _distribution([run['profit'] for run in runs]),
+            'stockouts': _distribution([run['stockouts'] for run in runs]),
+            'ending_cash': _distribution([run['ending_cash'] for run in runs]),
+        })
+    return summary
+
+# ---------------- SQLite storage ----------------
+# By default everything lives in memory and is lost on exit. With --db the
+# inventory, the provider catalogs and the store money are kept in a local
+# SQLite database (WAL mode). The inventory and providers globals are then
+# replaced by small dict-like wrappers that read rows only when they are asked
+# for, so looking up one item never loads the whole catalog.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory (
+    name TEXT NOT NULL UNIQUE,
+    price REAL NOT NULL,
+    stock INTEGER NOT NULL,
+    cost REAL NOT NULL DEFAULT 0,
+    provider TEXT
+);
+CREATE INDEX IF NOT EXISTS inventory_by_price ON inventory (price);
+CREATE INDEX IF NOT EXISTS inventory_by_lower_name ON inventory (lower(name));
+CREATE TABLE IF NOT EXISTS providers (
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS offers (
+    provider TEXT NOT NULL,
+    item TEXT NOT NULL,
+    cost REAL NOT NULL,
+    available INTEGER NOT NULL,
+    UNIQUE (provider, item)
+);
+CREATE INDEX IF NOT EXISTS offers_by_item ON offers (item, cost);
+CREATE INDEX IF NOT EXISTS offers_by_lower_item ON offers (lower(item));
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+# Statements are kept as constants so sqlite3's statement cache reuses them
+_SQL_ITEM_GET = "SELECT price, stock, cost, provider FROM inventory WHERE name = ?"
+_SQL_ITEM_EXISTS = "SELECT 1 FROM inventory WHERE name = ?"
+_SQL_ITEM_PUT = """INSERT INTO inventory (name, price, stock, cost, provider) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET price = excluded.price, stock = excluded.stock,
+    cost = excluded.cost, provider = excluded.provider"""
+_SQL_ITEM_DELETE = "DELETE FROM inventory WHERE name = ?"
+_SQL_ITEM_PAGE = """SELECT rowid, name, price, stock, cost, provider FROM inventory
+    WHERE rowid > ? ORDER BY rowid LIMIT ?"""
+_SQL_ITEM_UPDATE = {field: f"UPDATE inventory SET {field} = ? WHERE name = ?"
+                    for field in ('price', 'stock', 'cost', 'provider')}
+# Fields an item may do without, and what the row holds once they are deleted
+# (a missing cost counts as 0 everywhere, like the column default)
+_ITEM_OPTIONAL = {'cost': 0, 'provider': None}
+_SQL_PROVIDER_PAGE = "SELECT rowid, name FROM providers WHERE rowid > ? ORDER BY rowid LIMIT ?"
+_SQL_PROVIDER_ADD = "INSERT OR IGNORE INTO providers (name) VALUES (?)"
+_SQL_OFFER_GET = "SELECT cost, available FROM offers WHERE provider = ? AND item = ?"
+_SQL_OFFER_PUT = """INSERT INTO offers (provider, item, cost, available) VALUES (?, ?, ?, ?)
+    ON CONFLICT (provider, item) DO UPDATE SET cost = excluded.cost, available = excluded.available"""
+_SQL_OFFER_DELETE = "DELETE FROM offers WHERE provider = ? AND item = ?"
+_SQL_OFFER_PAGE = """SELECT rowid, item, cost, available FROM offers
+    WHERE provider = ? AND rowid > ? ORDER BY rowid LIMIT ?"""
+_SQL_OFFER_UPDATE = {field: f"UPDATE offers SET {field} = ? WHERE provider = ? AND item = ?"
+                     for field in ('cost', 'available')}
+_OFFER_OPTIONAL = {}
+
+_PAGE_SIZE = 1000  # rows fetched per query when walking a whole table
+
+def _sql_search_names(conn, table, column, query, limit=10, accept=None):
+    """NameIndex.search answered by SQLite, without loading the names into memory.
+
+    Same ranking as NameIndex: exact name, whole-name prefixes (a range scan of
+    the lower(name) index), names with a word starting with every query word.
+    Only when none of those match (a typo) are names scored by how many of the
+    query's trigrams they contain, which reads the whole table. Rows are
+    streamed from the cursor and `accept` is checked as they come.
+    """
+    query = query.strip()
+    key = query.lower()
+    if not key:
+        return []
+    names = f"SELECT DISTINCT {column} AS name FROM {table}"
+    found = []
+
+    def take(rows, check=None):
+        for name, *_ in rows:
+            if name not in found and (check is None or check(name)) and (accept is None or accept(name)):
+                found.append(name)
+                if len(found) >= limit:
+                    return True
+        return False
+
+    if take(conn.execute(f"{names} WHERE {column} = ?", (query,))):
+        return found
+    if take(conn.execute(f"{names} WHERE lower({column}) >= ? AND lower({column}) < ? ORDER BY lower({column})",
+                         (key, key + "\U0010ffff"))):
+        return found
+    tokens = re.findall(r"\w+", key) or [key]
+    matches_words = lambda name: all(any(w.startswith(t) for w in re.findall(r"\w+", name.lower())) for t in tokens)
+    if take(conn.execute(f"{names} WHERE " + " AND ".join(f"instr(lower({column}), ?) > 0" for _ in tokens)
+                         + f" ORDER BY length({column}), {column}", tokens), matches_words) or found:
+        return found
+    grams = sorted(_trigrams(key))
+    need = max(1, math.ceil(FUZZY_MIN_SIMILARITY * len(grams)))
+    score = " + ".join("(instr('  ' || lower(name) || ' ', ?) > 0)" for _ in grams)
+    take(conn.execute(f"SELECT name, score FROM (SELECT name, {score} AS score FROM ({names})) "
+                      f"WHERE score >= ? ORDER BY score DESC, length(name), name", grams + [need]))
+    return found
+
+class SqliteStore:
+    """Connection to the store database plus transaction handling."""
+
+    def __init__(self, path):
+        # isolation_level=None: we issue BEGIN/COMMIT ourselves. A background
+        # feed refresh writes through this connection too, so it may be used
+        # from any thread, but only while holding state_lock.
+        self.conn = sqlite3.connect(path, isolation_level=None, cached_statements=256,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self._depth = 0
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM meta WHERE key = 'store_money'").fetchone() is None
+
+    def seed(self, items, catalogs, money):
+        """Fill an empty database with the given inventory, providers and money."""
+        with self.transaction():
+            self.conn.executemany(_SQL_ITEM_PUT, (
+                (name, d['price'], d['stock'], d.get('cost', 0), d.get('provider'))
+                for name, d in items.items()))
+            for pname, offers in catalogs.items():
+                self.conn.execute(_SQL_PROVIDER_ADD, (pname,))
+                self.conn.executemany(_SQL_OFFER_PUT, (
+                    (pname, iname, d['cost'], d['available']) for iname, d in offers.items()))
+            self.save_money(money)
+
+    def load_money(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'store_money'").fetchone()
+        return row[0] if row else 0.0
+
+    def save_money(self, money):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('store_money', ?)", (money,))
+
+    @contextmanager
+    def transaction(self):
+        """Group every write inside the block into one transaction (nestable)."""
+        if self._depth == 0:
+            self.conn.execute("BEGIN IMMEDIATE")
+        self._depth += 1
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self.conn.execute("ROLLBACK")
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self.conn.execute("COMMIT")
+
+    def close(self):
+        self.conn.close()
+
+class SqliteRow(MutableMapping):
+    """Dict-like view of one database row; assignments are written straight through."""
+
+    __slots__ = ('_store', '_updates', '_optional', '_key', '_values')
+
+    def __init__(self, store, updates, optional, key, values):
+        self._store = store
+        self._updates = updates    # field -> UPDATE statement
+        self._optional = optional  # field -> value stored when it's deleted
+        self._key = key            # parameters identifying the row
+        self._values = values      # field -> current value (None = field not set)
+
+    def __getitem__(self, field):
+        value = self._values[field]
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        if field not in self._updates:
+            raise KeyError(f"Unknown field '{field}'")
+        self._store.conn.execute(self._updates[field], (value,) + self._key)
+        self._values[field] = value
+
+    def __delitem__(self, field):
+        if self._values.get(field) is None:
+            raise KeyError(field)
+        if field not in self._optional:
+            raise KeyError(f"Field '{field}' is required and can't be deleted")
+        self[field] = self._optional[field]
+
+    def __iter__(self):
+        return (field for field, value in self._values.items() if value is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class _PagedItemsView(ItemsView):
+    def __iter__(self):
+        return self._mapping._iter_rows()
+
+class _PagedValuesView(ValuesView):
+    def __iter__(self):
+        return (row for _, row in self._mapping._iter_rows())
+
+class SqliteInventory(MutableMapping):
+    """The inventory table, used like the inventory dict."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def _row(self, name, price, stock, cost, provider):
+        values = {'price': price, 'stock': stock, 'cost': cost, 'provider': provider}
+        return SqliteRow(self._store, _SQL_ITEM_UPDATE, _ITEM_OPTIONAL, (name,), values)
+
+    def __getitem__(self, name):
+        found = self._store.conn.execute(_SQL_ITEM_GET, (name,)).fetchone()
+        if found is None:
+            raise KeyError(name)
+        return self._row(name, *found)
+
+    def __setitem__(self, name, details):
+        self._store.conn.execute(_SQL_ITEM_PUT, (name, details['price'], details['stock'],
+                                                 details.get('cost', 0), details.get('provider')))
+
+    def __delitem__(self, name):
+        if self._store.conn.execute(_SQL_ITEM_DELETE, (name,)).rowcount == 0:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return self._store.conn.execute(_SQL_ITEM_EXISTS, (name,)).fetchone() is not None
+
+    def _iter_rows(self):
+        # Walk the table page by page (keyset pagination) so writes made while
+        # iterating, like simulate_day_sales updating stock, are safe.
+        last = 0
+        while True:
+            page = self._store.conn.execute(_SQL_ITEM_PAGE, (last, _PAGE_SIZE)).fetchall()
+            for rowid, name, price, stock, cost, provider in page:
+                yield name, self._row(name, price, stock, cost, provider)
+            if len(page) < _PAGE_SIZE:
+                return
+            last = page[-1][0]
+
+    def __iter__(self):
+        return (name for name, _ in self._iter_rows())
+
+    def __len__(self):
+        return self._store.conn.execute("SELECT COUNT(*) FROM inventory").fetchone()[0]
+
+    def __bool__(self):
+        return self._store.conn.execute("SELECT 1 FROM inventory LIMIT 1").fetchone() is not None
+
+    def items(self):
+        return _PagedItemsView(self)
+
+    def values(self):
+        return _PagedValuesView(self)
+
+    def __repr__(self):
+        return f"SqliteInventory({len(self)} items)"
+
+    # --- reports answered by SQLite itself ---
+    def scan_totals(self):
+        value, cost, price_sum, stock_sum, count = self._store.conn.execute(
+            "SELECT TOTAL(price * stock), TOTAL(cost * stock), TOTAL(price), TOTAL(stock), COUNT(*) FROM inventory"
+        ).fetchone()
+        return {'value': value, 'cost': cost, 'price_sum': price_sum,
+                'stock_sum': int(stock_sum), 'count': count}
+
+    def names_by_price(self, k, descending=False):
+        order = "DESC, name DESC" if descending else "ASC, name ASC"
+        rows = self._store.conn.execute(f"SELECT name FROM inventory ORDER BY price {order} LIMIT ?", (k,))
+        return [name for name, in rows]
+
+    def names_in_price_range(self, low, high):
+        rows = self._store.conn.execute(
+            "SELECT name FROM inventory WHERE price BETWEEN ? AND ? ORDER BY price, name", (low, high))
+        return [name for name, in rows]
+
+    def search_names(self, query, limit=10, accept=None):
+        return _sql_search_names(self._store.conn, 'inventory', 'name', query, limit, accept)
+
+class SqliteCatalog(MutableMapping):
+    """One provider's catalog (item -> {'cost', 'available'}) stored in SQLite."""
+
+    def __init__(self, store, provider):
+        self._store = store
+        self._provider = provider
+
+    def _row(self, item, cost, available):
+        return SqliteRow(self._store, _SQL_OFFER_UPDATE, _OFFER_OPTIONAL, (self._provider, item),
+                         {'cost': cost, 'available': available})
+
+    def __getitem__(self, item):
+        found = self._store.conn.execute(_SQL_OFFER_GET, (self._provider, item)).fetchone()
+        if found is None:
+            raise KeyError(item)
+        return self._row(item, *found)
+
+    def __setitem__(self, item, details):
+        self._store.conn.execute(_SQL_OFFER_PUT, (self._provider, item, details['cost'], details['available']))
+
+    def __delitem__(self, item):
+        if self._store.conn.execute(_SQL_OFFER_DELETE, (self._provider, item)).rowcount == 0:
+            raise KeyError(item)
+
+    def __contains__(self, item):
+        return self._store.conn.execute(_SQL_OFFER_GET, (self._provider, item)).fetchone() is not None
+
+    def _iter_rows(self):
+        last = 0
+        while True:
+            page = self._store.conn.execute(_SQL_OFFER_PAGE, (self._provider, last, _PAGE_SIZE)).fetchall()
+            for rowid, item, cost, available in page:
+                yield item, self._row(item, cost, available)
+            if len(page) < _PAGE_SIZE:
+                return
+            last = page[-1][0]
+
+    def __iter__(self):
+        return (item for item, _ in self._iter_rows())
+
+    def __len__(self):
+        return self._store.conn.execute("SELECT COUNT(*) FROM offers WHERE provider = ?",
+                                        (self._provider,)).fetchone()[0]
+
+    def items(self):
+        return _PagedItemsView(self)
+
+    def values(self):
+        return _PagedValuesView(self)
+
+class SqliteProviders(MutableMapping):
+    """All provider catalogs stored in SQLite (provider name -> SqliteCatalog)."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, provider):
+        if provider not in self:
+            raise KeyError(provider)
+        return SqliteCatalog(self._store, provider)
+
+    def __setitem__(self, provider, offers):
+        with self._store.transaction():
+            self._store.conn.execute(_SQL_PROVIDER_ADD, (provider,))
+            self._store.conn.execute("DELETE FROM offers WHERE provider = ?", (provider,))
+            catalog = SqliteCatalog(self._store, provider)
+            for item, details in offers.items():
+                catalog[item] = details
+
+    def __delitem__(self, provider):
+        with self._store.transaction():
+            if self._store.conn.execute("DELETE FROM providers WHERE name = ?", (provider,)).rowcount == 0:
+                raise KeyError(provider)
+            self._store.conn.execute("DELETE FROM offers WHERE provider = ?", (provider,))
+
+    def __contains__(self, provider):
+        return self._store.conn.execute("SELECT 1 FROM providers WHERE name = ?",
+                                        (provider,)).fetchone() is not None
+
+    def __iter__(self):
+        last = 0
+        while True:
+            page = self._store.conn.execute(_SQL_PROVIDER_PAGE, (last, _PAGE_SIZE)).fetchall()
+            for rowid, name in page:
+                yield name
+            if len(page) < _PAGE_SIZE:
+                return
+            last = page[-1][0]
+
+    def __len__(self):
+        return self._store.conn.execute("SELECT COUNT(*) FROM providers").fetchone()[0]
+
+    def offers_for_item(self, item, min_qty=1):
+        """(cost, provider, available) offers for an item, cheapest first."""
+        rows = self._store.conn.execute(
+            "SELECT cost, provider, available FROM offers WHERE item = ? AND available >= ? ORDER BY cost, provider",
+            (item, min_qty))
+        return rows.fetchall()
+
+    def search_names(self, query, limit=10, accept=None):
+        return _sql_search_names(self._store.conn, 'offers', 'item', query, limit, accept)
+
+_storage = None  # the open SqliteStore, or None when running purely in memory
+
+def open_storage(path):
+    """Keep the store in a SQLite database at `path` from now on.
+
+    A new database is filled with the current inventory, providers and money;
+    an existing one is used as it is. Returns the SqliteStore.
+    """
+    global inventory, providers, store_money, _storage
+    store = SqliteStore(path)
+    if store.is_empty():
+        store.seed(inventory, providers, store_money)
+    inventory = SqliteInventory(store)
+    providers = SqliteProviders(store)
+    store_money = store.load_money()
+    _storage = store
+    invalidate_inventory_indexes()
+    invalidate_offer_indexes()
+    return store
+
+@contextmanager
+def storage_transaction():
+    """Commit all store changes made inside the block (and the money) at once.
+
+    Without a database it only holds state_lock, so a background feed refresh
+    can't change the store half way through.
+    """
+    global store_money
+    with state_lock:
+        if _storage is None:
+            yield
+            return
+        # Ledger events and undo entries wait for the outermost transaction to commit
+        hold = _storage._depth == 0
+        if hold:
+            undo_journal.hold()
+            if _ledger is not None:
+                _ledger.hold()
+        try:
+            with _storage.transaction():
+                yield
+                _storage.save_money(store_money)
+        except BaseException:
+            if _storage._depth == 0:
+                # The database rolled back, so bring the in-memory values back in
+                # line and forget the ledger events and undo entries of the
+                # undone changes
+                if hold:
+                    undo_journal.release(commit=False)
+                    if _ledger is not None:
+                        _ledger.release(commit=False)
+                    hold = False
+                store_money = _storage.load_money()
+                _rolled_back_indexes()
+            raise
+        finally:
+            if hold:
+                undo_journal.release()
+                if _ledger is not None:
+                    _ledger.release()
+
+# ---------------- Transaction ledger ----------------
+# With --ledger every change to the cash, the inventory items and the provider
+# offers is appended to a JSON-lines file, together with the reason for cash
+# changes. Events are written in groups (one write + fsync per group) so big
+# simulations don't fsync on every item. Every so often the whole state is
+# saved as a snapshot that remembers how far into the ledger it goes, so the
+# state can be rebuilt from the snapshot plus only the events after it.
+
+class TransactionLedger:
+    """Append-only JSONL ledger with group commit and periodic snapshots."""
+
+    def __init__(self, path, snapshot_path, group_size=256, group_interval=1.0,
+                 snapshot_every=50000):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.snapshot_every = snapshot_every
+        self._file = open(path, 'ab')
+        # Drop a half-written last event (a crash mid-write), never whole events
+        end = _last_complete_event_end(path)
+        if end < self._file.seek(0, os.SEEK_END):
+            self._file.truncate(end)
+        self._buffer = []
+        self._held = None  # buffer length when a database transaction began
+        self._last_flush = time.monotonic()
+        self._since_snapshot = 0
+
+    def _record(self, event):
+        event['ts'] = round(time.time(), 3)
+        self._buffer.append(json.dumps(event, separators=(',', ':')) + "\n")
+        self._since_snapshot += 1
+        if self._held is None and (len(self._buffer) >= self.group_size
+                                   or time.monotonic() - self._last_flush >= self.group_interval):
+            self.flush()
+
+    def hold(self):
+        """Keep new events in memory until release() (a database transaction is running)."""
+        self._held = len(self._buffer)
+
+    def release(self, commit=True):
+        """End hold(): keep the held events (commit) or drop them (the transaction rolled back)."""
+        start, self._held = self._held, None
+        if not commit:
+            self._since_snapshot -= max(0, len(self._buffer) - start)
+            del self._buffer[start:]
+        elif len(self._buffer) >= self.group_size or time.monotonic() - self._last_flush >= self.group_interval:
+            self.flush()
+
+    def _write_buffer(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer).encode('utf-8'))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._buffer.clear()
+            if self._held is not None:
+                self._held = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        """Write all buffered events to disk (one write and one fsync)."""
+        self._write_buffer()
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        """Save the whole current state and the ledger position it matches.
+
+        The state is written item by item, so a database-backed store is never
+        loaded into memory as a whole.
+        """
+        self._write_buffer()
+        tmp_path = self.snapshot_path + ".tmp"
+        dumps = functools.partial(json.dumps, separators=(',', ':'))
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f'{{"ledger_offset":{self._file.tell()},"store_money":{dumps(store_money)},"inventory":{{')
+            _write_json_members(f, ((name, dict(details)) for name, details in inventory.items()), dumps)
+            f.write('},"providers":{')
+            for i, pname in enumerate(providers):
+                f.write(f'{"," if i else ""}{dumps(pname)}:{{')
+                _write_json_members(f, ((iname, dict(details)) for iname, details in providers[pname].items()),
+                                    dumps)
+                f.write('}')
+            f.write('}}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self._since_snapshot = 0
+
+    def close(self):
+        self._write_buffer()
+        self._file.close()
+
+    # --- change listeners ---
+    def item_changed(self, name, old, new):
+        self._record({'t': 'item', 'name': name, 'new': new})
+
+    def offer_changed(self, provider, item, old, new):
+        self._record({'t': 'offer', 'provider': provider, 'item': item, 'new': new})
+
+    def money_changed(self, old, new, reason):
+        self._record({'t': 'cash', 'delta': new - old, 'balance': new, 'why': reason})
+
+    def invalidate(self):
+        # The state was replaced wholesale; a snapshot keeps the ledger replayable
+        self.snapshot()
+
+    def rolled_back(self):
+        # The events of the undone changes were dropped (release(commit=False))
+        # before ever reaching the file, so the ledger still matches the state
+        pass
+
+def _write_json_members(f, pairs, dumps):
+    """Write "key":value pairs, comma separated, as the inside of a JSON object."""
+    for i, (key, value) in enumerate(pairs):
+        f.write(f'{"," if i else ""}{dumps(key)}:{dumps(value)}')
+
+def _last_complete_event_end(path):
+    """Offset just past the last newline in the file (0 for an empty or missing file)."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(65536, pos)
+            pos -= step
+            f.seek(pos)
+            i = f.read(step).rfind(b"\n")
+            if i >= 0:
+                return pos + i + 1
+    return 0
+
+def replay_ledger(path, snapshot_path):
+    """Rebuild the store state from a snapshot plus the ledger events after it.
+
+    Returns:
+        tuple: (inventory dict, providers dict, store money, ledger offset
+        just past the last complete event)
+    """
+    with open(snapshot_path, encoding='utf-8') as f:
+        state = json.load(f)
+    items = state['inventory']
+    catalogs = state['providers']
+    money = state['store_money']
+    end = state['ledger_offset']
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            f.seek(end)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # half-written last event
+                event = json.loads(line)
+                kind = event['t']
+                if kind == 'item':
+                    if event['new'] is None:
+                        items.pop(event['name'], None)
+                    else:
+                        items[event['name']] = event['new']
+                elif kind == 'offer':
+                    offers = catalogs.setdefault(event['provider'], {})
+                    if event['new'] is None:
+                        offers.pop(event['item'], None)
+                    else:
+                        offers[event['item']] = event['new']
+                elif kind == 'cash':
+                    money = event['balance']
+                end += len(line)
+    return items, catalogs, money, end
+
+_ledger = None  # the open TransactionLedger, or None
+
+def open_ledger(path, snapshot_path=None, **options):
+    """Start recording every change to the ledger at `path`.
+
+    If the ledger already has a snapshot, the store state is first rebuilt
+    from it (unless a database is open, which then stays the source of truth).
+    Extra options are passed to TransactionLedger.
+    """
+    global inventory, providers, store_money, _ledger
+    close_ledger()
+    if snapshot_path is None:
+        snapshot_path = path + ".snapshot"
+    if os.path.exists(snapshot_path):
+        if _storage is None:
+            inventory, providers, store_money, _ = replay_ledger(path, snapshot_path)
+            invalidate_inventory_indexes()
+            invalidate_offer_indexes()
+        fresh = False
+    else:
+        # Without a snapshot old events can't be replayed: they are kept as
+        # history and a new snapshot marks where replaying starts
+        fresh = True
+    _ledger = TransactionLedger(path, snapshot_path, **options)
+    if fresh:
+        _ledger.snapshot()
+    register_inventory_index(_ledger)
+    register_offer_index(_ledger)
+    register_money_listener(_ledger)
+    return _ledger
+
+def close_ledger():
+    """Flush and stop the ledger (if one is open)."""
+    global _ledger
+    if _ledger is None:
+        return
+    for listeners in (_inventory_indexes, _offer_indexes, _money_listeners):
+        if _ledger in listeners:
+            listeners.remove(_ledger)
+    _ledger.close()
+    _ledger = None
+
+def flush_ledger():
+    """Write any buffered ledger events to disk."""
+    if _ledger is not None:
+        _ledger.flush()
+
+atexit.register(close_ledger)
+
+# ---------------- Undo and what-if branches ----------------
+# Undo: every change made by one menu action (or headless command) is kept as
+# a group of (kind, key, old, new) entries by undo_journal, which follows the
+# same change notifications as the indexes. Undoing a group puts the old
+# values back through the normal helpers (so indexes, ledger and database all
+# follow); money is given back as a difference, so it can't wipe out changes
+# made in between. An entry whose item was changed again since refuses to undo.
+# Only the main store's inventory, offers and money are journaled (not the
+# sales statistics, and not changes made inside a branch). An action that
+# changes more than UNDO_MAX_CHANGES entries (a big import or simulation) is
+# not kept, so the journal never holds memory in proportion to the catalog;
+# it also ends the undo history, since older groups can't be undone past it.
+#
+# What-if branches: Branch() is an O(1) copy-on-write view of the store. Its
+# inventory and providers are overlays that read through to the main store
+# and keep only the items the branch changes. While the main store changes,
+# the old values of the touched items are copied into every live branch first,
+# so a branch keeps seeing the store as it was when it was made. Inside
+# `with branch:` all the usual functions work on the branch instead of the
+# main store; branch.apply() copies the branch's own changes into the main
+# store, refusing if the main store changed the same items meanwhile.
+
+_DELETED = None  # overlay value of a key that was removed
+UNDO_MAX_CHANGES = 10_000  # most entries kept for one undo group
+
+class CowRow(MutableMapping):
+    """An overlay row: reads the base row until written, then the overlay's own copy."""
+
+    __slots__ = ('_overlay', '_key')
+
+    def __init__(self, overlay, key):
+        self._overlay = overlay
+        self._key = key
+
+    def _row(self):
+        changed = self._overlay._changed
+        if self._key in changed:
+            row = changed[self._key]
+            if row is _DELETED:
+                raise KeyError(self._key)
+            return row
+        return self._overlay._base[self._key]
+
+    def __getitem__(self, field):
+        return self._row()[field]
+
+    def get(self, field, default=None):
+        return self._row().get(field, default)
+
+    def __setitem__(self, field, value):
+        self._overlay._own(self._key)[field] = value
+
+    def __delitem__(self, field):
+        del self._overlay._own(self._key)[field]
+
+    def __iter__(self):
+        return iter(self._row())
+
+    def __len__(self):
+        return len(self._row())
+
+    def __repr__(self):
+        return repr(dict(self._row()))
+
+class OverlayMap(MutableMapping):
+    """Copy-on-write view of a mapping of rows (item name -> {field: value}).
+
+    Only changed keys are stored (_changed, with _DELETED for removals). Keys the
+    branch wrote itself are in _written, with the value they had when the
+    branch was made in _origin; the rest were preserved for it by preserve()
+    when the base changed.
+    """
+
+    def __init__(self, base):
+        self._base = base
+        self._changed = {}
+        self._written = set()
+        self._origin = {}  # written key -> its value when the branch was made (None = absent)
+
+    def _write(self, key):
+        """Note that the branch itself changes `key` (remembering where it started)."""
+        if key not in self._written:
+            if key in self._changed:
+                value = self._changed[key]  # preserved when the base moved on
+            else:
+                value = self._base.get(key)
+            self._origin[key] = None if value is None else dict(value)
+            self._written.add(key)
+
+    def _own(self, key):
+        """The overlay's own copy of a row, made on first write."""
+        if key not in self._changed:
+            self._changed[key] = dict(self._base[key])
+        elif self._changed[key] is _DELETED:
+            raise KeyError(key)
+        self._write(key)
+        return self._changed[key]
+
+    def written(self):
+        """(key, value when the branch was made, value now) for every key the branch wrote."""
+        for key in self._written:
+            value = self._changed[key]
+            yield key, self._origin[key], None if value is _DELETED else dict(value)
+
+    def preserve(self, key, old):
+        """Keep the base's old value of `key` (the base is about to move on)."""
+        if key not in self._changed:
+            self._changed[key] = _DELETED if old is None else dict(old)
+
+    def __getitem__(self, key):
+        if key in self._changed:
+            if self._changed[key] is _DELETED:
+                raise KeyError(key)
+        elif key not in self._base:
+            raise KeyError(key)
+        return CowRow(self, key)
+
+    def __setitem__(self, key, value):
+        self._write(key)
+        self._changed[key] = dict(value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._write(key)
+        self._changed[key] = _DELETED
+
+    def __contains__(self, key):
+        if key in self._changed:
+            return self._changed[key] is not _DELETED
+        return key in self._base
+
+    def __iter__(self):
+        changed = self._changed
+        for key in self._base:
+            if key not in changed:
+                yield key
+            elif changed[key] is not _DELETED:
+                yield key
+        for key, value in list(changed.items()):
+            if value is not _DELETED and key not in self._base:
+                yield key
+
+    def __len__(self):
+        size = len(self._base)
+        for key, value in self._changed.items():
+            size += (value is not _DELETED) - (key in self._base)
+        return size
+
+class OverlayProviders(OverlayMap):
+    """Copy-on-write view of the provider catalogs (each one an OverlayMap)."""
+
+    def __init__(self, base):
+        super().__init__(base)
+        self._catalogs = {}  # provider -> OverlayMap over the base catalog
+
+    def _own(self, provider):
+        return self[provider]
+
+    def preserve_offer(self, provider, item, old):
+        if provider in self._base and provider not in self._changed:
+            self[provider].preserve(item, old)
+
+    def __getitem__(self, provider):
+        catalog = self._catalogs.get(provider)
+        if catalog is None:
+            if provider in self._changed or provider not in self._base:
+                raise KeyError(provider)
+            catalog = self._catalogs[provider] = OverlayMap(self._base[provider])
+        return catalog
+
+    def __setitem__(self, provider, offers):
+        catalog = OverlayMap({})
+        for item, details in offers.items():
+            catalog[item] = details
+        self._catalogs[provider] = catalog
+        self._changed[provider] = catalog
+        self._written.add(provider)
+
+    def __delitem__(self, provider):
+        if provider not in self:
+            raise KeyError(provider)
+        self._catalogs.pop(provider, None)
+        self._changed[provider] = _DELETED
+        self._written.add(provider)
+
+def _current_value(kind, key):
+    """The store's current copy of an item (kind 'item') or a (provider, item) offer, None if absent."""
+    if kind == 'item':
+        return dict(inventory[key]) if key in inventory else None
+    provider, item = key
+    if provider in providers and item in providers[provider]:
+        return dict(providers[provider][item])
+    return None
+
+def _put_value(kind, key, value):
+    """Make an item or offer hold `value` (None removes it)."""
+    if kind == 'item':
+        if value is None:
+            delete_inventory_item(key)
+        else:
+            add_inventory_item(key, dict(value))
+    elif value is None:
+        remove_offer(*key)
+    else:
+        set_offer(*key, value['cost'], value['available'])
+
+class UndoJournal:
+    """Groups of changes that can be undone and redone (see undo_journal)."""
+
+    def __init__(self, limit=100, max_changes=UNDO_MAX_CHANGES):
+        self.limit = limit  # most groups kept for undo
+        self.max_changes = max_changes
+        self.undo_groups = []
+        self.redo_groups = []
+        self._group = None
+        self._thread = None  # the thread whose changes go in the group
+        self._depth = 0
+        self._replaying = False
+        self._held = None  # (group, entry count) when a database transaction began
+
+    def _log(self, entry):
+        if (self._group is not None and not self._replaying and _branch_guard.active is None
+                and threading.get_ident() == self._thread):
+            entries = self._group[1]
+            if entries is None:
+                return
+            if len(entries) >= self.max_changes:
+                self._group = (self._group[0], None)  # too big to undo
+                return
+            entries.append(entry)
+
+    def item_changed(self, name, old, new):
+        self._log(('item', name, old, new))
+
+    def offer_changed(self, provider, item, old, new):
+        self._log(('offer', (provider, item), old, new))
+
+    def money_changed(self, old, new, reason):
+        self._log(('money', None, old, new))
+
+    def invalidate(self):
+        # The store was replaced wholesale; the old changes, and those of the
+        # running operation, no longer apply
+        self.undo_groups.clear()
+        self.redo_groups.clear()
+        self._group = None
+
+    def hold(self):
+        """Remember where a database transaction began in the running group."""
+        entries = self._group[1] if self._group is not None else None
+        self._held = (self._group, len(entries)) if entries is not None else None
+
+    def release(self, commit=True):
+        """End hold(): keep the entries logged since (commit) or drop them (rolled back)."""
+        held, self._held = self._held, None
+        if not commit and held is not None and held[0] is self._group and self._group[1] is not None:
+            del self._group[1][held[1]:]
+
+    def rolled_back(self):
+        # release(commit=False) already dropped the undone entries; the store
+        # rows are back as the earlier groups left them, so those still apply
+        pass
+
+    @contextmanager
+    def operation(self, label):
+        """Collect every change made inside the block as one undoable group."""
+        self._depth += 1
+        if self._depth == 1:
+            self._group = (label, [])
+            # A background feed refresh may change offers meanwhile; those
+            # changes are not part of this operation
+            self._thread = threading.get_ident()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                group, self._group = self._group, None
+                if group is not None and group[1] is None:
+                    self.undo_groups.clear()
+                    self.redo_groups.clear()
+                elif group is not None and group[1]:
+                    self.undo_groups.append(group)
+                    del self.undo_groups[:-self.limit]
+                    self.redo_groups.clear()
+
+    def _replay(self, label, entries, forward):
+        """Put the entries' old values back (forward=False) or their new ones."""
+        # Each key must still hold what the group left it at (or started from, to redo)
+        expected = {}
+        for kind, key, old, new in (entries if forward else reversed(entries)):
+            if kind != 'money':
+                expected.setdefault((kind, key), old if forward else new)
+        conflicts = [key for (kind, key), value in expected.items() if _current_value(kind, key) != value]
+        if conflicts:
+            raise ValueError(f"can't {'redo' if forward else 'undo'} '{label}': "
+                             f"{', '.join(map(str, conflicts[:3]))} changed since")
+        self._replaying = True
+        try:
+            with storage_transaction():
+                for kind, key, old, new in (entries if forward else reversed(entries)):
+                    if kind == 'money':
+                        delta = new - old if forward else old - new
+                        adjust_store_money(delta, f"{'redo' if forward else 'undo'}: {label}")
+                    else:
+                        _put_value(kind, key, new if forward else old)
+        finally:
+            self._replaying = False
+
+    def undo(self):
+        """Undo the last group of changes; returns its label (None if there is nothing to undo)."""
+        if not self.undo_groups:
+            return None
+        label, entries = self.undo_groups[-1]
+        self._replay(label, entries, forward=False)
+        self.redo_groups.append(self.undo_groups.pop())
+        return label
+
+    def redo(self):
+        """Redo the last undone group; returns its label (None if there is nothing to redo)."""
+        if not self.redo_groups:
+            return None
+        label, entries = self.redo_groups[-1]
+        self._replay(label, entries, forward=True)
+        self.undo_groups.append(self.redo_groups.pop())
+        return label
+
+undo_journal = UndoJournal()
+register_inventory_index(undo_journal)
+register_offer_index(undo_journal)
+register_money_listener(undo_journal)
+
+class _BranchGuard:
+    """Copies old values into the live branches before the main store changes them."""
+
+    def __init__(self):
+        self.branches = weakref.WeakSet()
+        self.active = None  # the branch currently standing in for the main store
+
+    def item_changed(self, name, old, new):
+        if self.active is None:
+            for branch in self.branches:
+                branch.inventory.preserve(name, old)
+
+    def offer_changed(self, provider, item, old, new):
+        if self.active is None:
+            for branch in self.branches:
+                branch.providers.preserve_offer(provider, item, old)
+
+    def invalidate(self):
+        if self.active is None:
+            for branch in self.branches:
+                branch.stale = True
+
+    def rolled_back(self):
+        # Values copied into the branches are what the rolled-back rows hold
+        # again, so the branches still match the main store
+        pass
+
+_branch_guard = _BranchGuard()
+register_inventory_index(_branch_guard)
+register_offer_index(_branch_guard)
+
+# The derived indexes a branch keeps its own copies of (global name -> how to
+# make an empty one, built lazily on first use like any index). The journal,
+# the guard and the ledger follow the main store only.
+BRANCH_INDEXES = {
+    'inventory_totals': InventoryTotals,
+    'price_index': PriceIndex,
+    'item_versions': ItemVersions,
+    'price_stats': PriceStats,
+    'inventory_names': functools.partial(NameIndex, 'inventory'),
+    'low_stock': LowStockAlerts,
+    'sourcing_index': SourcingIndex,
+    'offer_names': functools.partial(NameIndex, 'offers'),
+}
+
+class Branch:
+    """A what-if copy of the store that shares every item it doesn't change.
+
+    Creating one is O(1). Use `with branch:` to run store functions on it, then
+    compare it with the main store, apply() it or just drop it.
+    """
+
+    def __init__(self):
+        if _branch_guard.active is not None:
+            raise RuntimeError("branches can't be made inside another branch")
+        self.inventory = OverlayMap(inventory)
+        self.providers = OverlayProviders(providers)
+        self.store_money = store_money
+        self._money_at_fork = store_money
+        self.sales_velocity = ChainMap({}, sales_velocity)
+        self.sales_history = sales_history.fork()
+        self.stale = False  # the main store was replaced wholesale since
+        self._saved = None
+        self._indexes = None  # global name -> the index not in use (the branch's, or the main store's inside it)
+        _branch_guard.branches.add(self)
+
+    def _swap(self):
+        global inventory, providers, store_money, sales_velocity, sales_history, _storage
+        (inventory, self.inventory, providers, self.providers, store_money, self.store_money,
+         sales_velocity, self.sales_velocity, sales_history, self.sales_history) = (
+            self.inventory, inventory, self.providers, providers, self.store_money, store_money,
+            self.sales_velocity, sales_velocity, self.sales_history, sales_history)
+        # The branch has its own index instances, so entering and leaving only
+        # swaps which ones the globals and the change notifications point at
+        if self._indexes is None:
+            self._indexes = {name: make() for name, make in BRANCH_INDEXES.items()}
+        current = globals()
+        for name, index in self._indexes.items():
+            replaced = current[name]
+            for listeners in (_inventory_indexes, _offer_indexes):
+                for i, registered in enumerate(listeners):
+                    if registered is replaced:
+                        listeners[i] = index
+            current[name] = index
+            self._indexes[name] = replaced
+
+    def __enter__(self):
+        if self.stale:
+            raise RuntimeError("the store was replaced since this branch was made")
+        state_lock.acquire()
+        self._saved = (_storage, _ledger)
+        self._set_backends(None, None)
+        _branch_guard.active = self
+        self._swap()
+        return self
+
+    def __exit__(self, *exc):
+        self._swap()
+        _branch_guard.active = None
+        self._set_backends(*self._saved)
+        state_lock.release()
+        return False
+
+    @staticmethod
+    def _set_backends(storage, ledger):
+        # Branch changes must not reach the database or the ledger
+        global _storage
+        _storage = storage
+        if ledger is None:
+            for listeners in (_inventory_indexes, _offer_indexes, _money_listeners):
+                if _ledger in listeners:
+                    listeners.remove(_ledger)
+        elif ledger not in _money_listeners:
+            register_inventory_index(ledger)
+            register_offer_index(ledger)
+            register_money_listener(ledger)
+
+    def _writes(self):
+        """(kind, key, value when the branch was made, branch value) of everything the branch changed."""
+        for name, origin, value in self.inventory.written():
+            yield 'item', name, origin, value
+        for provider, catalog in self.providers._catalogs.items():
+            for item, origin, value in catalog.written():
+                yield 'offer', (provider, item), origin, value
+
+    def apply(self):
+        """Copy this branch's own changes into the main store.
+
+        Only the items and offers the branch changed are written, and the money
+        moves by as much as it did in the branch, so whatever the main store
+        did since the branch was made is kept. If the main store changed one
+        of those items or offers too, nothing is applied.
+        Raises:
+            ValueError: naming the items and offers changed on both sides
+        """
+        if self.stale:
+            raise RuntimeError("the store was replaced since this branch was made")
+        if _branch_guard.active is self:
+            raise RuntimeError("leave the branch before applying it")
+        with state_lock:
+            writes = []
+            conflicts = []
+            for kind, key, origin, value in self._writes():
+                current = _current_value(kind, key)
+                if value == origin or current == value:
+                    continue  # the branch ended where it started, or the main store got there too
+                if current != origin:
+                    conflicts.append(key)
+                writes.append((kind, key, value))
+            if conflicts:
+                raise ValueError(f"can't apply the what-if branch: {', '.join(map(str, conflicts[:3]))}"
+                                 f"{' and others' if len(conflicts) > 3 else ''} changed since it was made")
+            with undo_journal.operation("apply what-if branch"), storage_transaction():
+                for kind, key, value in writes:
+                    _put_value(kind, key, value)
+                if self.store_money != self._money_at_fork:
+                    adjust_store_money(self.store_money - self._money_at_fork, "apply what-if branch")
+        _branch_guard.branches.discard(self)
+        self.stale = True
+
+    def changed_items(self):
+        """Number of inventory items and provider offers this branch holds copies of."""
+        return len(self.inventory._changed) + sum(len(c._changed) for c in self.providers._catalogs.values())
+
+@instrumented("menu.undo")
+def undo_menu():
+    """Undo or redo the last change to the store."""
+    try:
+        screen = Screen()
+        screen.header("Undo / Redo")
+        screen.add(BOX_TOP)
+        last_undo = undo_journal.undo_groups[-1][0] if undo_journal.undo_groups else "-"
+        last_redo = undo_journal.redo_groups[-1][0] if undo_journal.redo_groups else "-"
+        screen.menu_item("u", f"Undo: {last_undo}")
+        screen.menu_item("r", f"Redo: {last_redo}")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        choice = ask("Choose u or r (Enter to go back): ").strip().lower()
+        if choice == 'u':
+            label = undo_journal.undo()
+            print_info(f"✅ Undone: {label}" if label else "Nothing to undo.")
+        elif choice == 'r':
+            label = undo_journal.redo()
+            print_info(f"✅ Redone: {label}" if label else "Nothing to redo.")
+        else:
+            return
+        pause()
+    except Exception as e:
+        record_error(e)
+        print(f"❌ {e}")
+        pause()
+
+@instrumented("menu.what_if")
+def what_if_menu():
+    """Try some days of sales on a branch and keep the outcome only if wanted."""
+    try:
+        print_header("What-if: Simulate Sales on a Copy")
+        days = get_valid_number("How many days to simulate: ", True)
+        factor = get_valid_number("Demand factor per day (0.0 - quiet, 1.0 - normal, 2.0 - busy): ")
+        before = inventory_totals.totals()
+        money_before = store_money
+        branch = Branch()
+        with branch:
+            simulate_sales_batch(days, factor)
+            after = inventory_totals.totals()
+            money_after = store_money
+        screen = Screen()
+        screen.submenu("Outcome")
+        screen.add(BOX_TOP)
+        screen.add("│ " + f"{'':<19} {'Now':>18} {'After':>18}" + " │")
+        screen.add("│ " + f"{'Store money:':<19} {money_before:>18.2f} {money_after:>18.2f}" + " │")
+        screen.add("│ " + f"{'Inventory value:':<19} {before['value']:>18.2f} {after['value']:>18.2f}" + " │")
+        screen.add("│ " + f"{'Units in stock:':<19} {before['stock_sum']:>18} {after['stock_sum']:>18}" + " │")
+        screen.add("│ " + f"{'Items copied:':<19} {branch.changed_items():>37}" + " │")
+        screen.add(BOX_BOTTOM)
+        screen.show()
+        if ask("Apply this outcome to the store? (yes/no): ").lower() == 'yes':
+            branch.apply()
+            print_info("✅ Applied (menu 19 can undo it)")
+        else:
+            print_info("Nothing changed.")
+        pause()
+    except Exception as e:
+        record_error(e)
+        print(f"❌ An error occurred: {e}")
+        pause()
+
+@instrumented("menu.display_inventory")
+def display_inventory():
+    """Display all items in the inventory"""
+    try:
+        if not inventory:
+            print_submenu("Inventory is Empty!")
+            return
+
+        # Items are formatted lazily, one page at a time
+        show_paged("Current Inventory", (format_item(item, details) for item, details in inventory.items()))
+
+    except Exception as e:
+        record_error(e)
+        print(f"❌ An error occurred: {str(e)}")
+
+# ---------------- Headless command mode ----------------
+# With --batch FILE the store reads one JSON command per line (from a file or
+# stdin with "-") and writes one JSON result per line, with no prompts, screen
+# clears or pauses. Every menu action has a command, for example:
+#   {"op": "modify", "name": "Pikachu Cushion", "price": 19.99}
+#   {"op": "buy", "provider": "KawaiiGoods", "item": "Pikachu Mug", "qty": 5}
+#   {"op": "simulate", "factor": 1.0, "days": 7}
+# An optional "id" in a command is copied to its result.
+
+def _number(command, field, integer=False, default=None):
+    """Read a non-negative number from a command (ValueError if invalid)."""
+    value = command.get(field, default)
+    if value is None:
+        raise ValueError(f"'{field}' is required")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (integer and not isinstance(value, int)):
+        raise ValueError(f"'{field}' must be a {'whole ' if integer else ''}number")
+    if value < 0:
+        raise ValueError(f"'{field}' cannot be negative")
+    return value
+
+class VersionConflict(Exception):
+    """The item changed since the version the command was based on."""
+
+    def __init__(self, name, expected, current):
+        super().__init__(f"'{name}' is at version {current}, not {expected}")
+        self.name = name
+        self.expected = expected
+        self.current = current
+
+def _item_record(name):
+    record = {'name': name}
+    record.update(inventory[name])
+    record['version'] = item_versions.version(name)
+    return record
+
+def _require_item(command):
+    """The command's item name; with a 'version' the item must still be at that version."""
+    name = command.get('name')
+    if name not in inventory:
+        raise KeyError(f"Item not found in inventory: {name!r}")
+    if 'version' in command and command['version'] != item_versions.version(name):
+        raise VersionConflict(name, command['version'], item_versions.version(name))
+    return name
+
+def _cmd_modify(command):
+    name = _require_item(command)
+    fields = {}
+    if 'price' in command:
+        fields['price'] = _number(command, 'price')
+    if 'stock' in command:
+        fields['stock'] = _number(command, 'stock', integer=True)
+    if not fields:
+        raise ValueError("give a new 'price' and/or 'stock'")
+    update_item(name, **fields)
+    return _item_record(name)
+
+def _cmd_remove(command):
+    name = _require_item(command)
+    delete_inventory_item(name)
+    return {'removed': name}
+
+def _cmd_sell(command):
+    name = _require_item(command)
+    qty = _number(command, 'qty', integer=True)
+    details = inventory[name]
+    if qty > details['stock']:
+        raise ValueError(f"only {details['stock']} '{name}' in stock")
+    revenue = qty * details['price']
+    cogs = qty * details.get('cost', 0)
+    with storage_transaction():
+        update_item(name, stock=details['stock'] - qty)
+        adjust_store_money(revenue - cogs, f"sold {qty} x {name}")
+    if metrics.enabled:
+        metrics.record_sales(qty, revenue, cogs)
+    record = _item_record(name)
+    record['revenue'] = revenue
+    return record
+
+def _cmd_inventory(command):
+    limit = _number(command, 'limit', integer=True, default=len(inventory))
+    return [_item_record(name) for name in islice(inventory, limit)]
+
+def _cmd_value(command):
+    totals = inventory_totals.totals()
+    return {'total_value': totals['value'], 'total_cost': totals['cost'],
+            'potential_profit': totals['value'] - totals['cost']}
+
+def _cmd_most_expensive(command):
+    k = _number(command, 'k', integer=True, default=1)
+    return [_item_record(name) for name in price_index.most_expensive(k)]
+
+def _cmd_cheapest(command):
+    k = _number(command, 'k', integer=True, default=1)
+    return [_item_record(name) for name in price_index.cheapest(k)]
+
+def _cmd_price_range(command):
+    names = price_index.in_range(_number(command, 'low'), _number(command, 'high'))
+    return [_item_record(name) for name in names]
+
+def _cmd_average(command):
+    totals = inventory_totals.totals()
+    if not totals['count']:
+        raise ValueError("Inventory is empty")
+    weighted = totals['value'] / totals['stock_sum'] if totals['stock_sum'] > 0 else 0
+    return {'average_price': totals['price_sum'] / totals['count'], 'weighted_average': weighted}
+
+def _cmd_price_stats(command):
+    if 'provider' in command:
+        names = command['provider']
+        if isinstance(names, str):
+            stats = price_stats.provider(names)
+            if stats is None:
+                raise ValueError(f"No inventory items from provider '{names}'")
+            return stats
+        return price_stats.combined(names)
+    if not inventory:
+        raise ValueError("Inventory is empty")
+    return price_stats.overall()
+
+def _cmd_low_stock(command):
+    return stock_alerts(_number(command, 'limit', integer=True, default=10))
+
+def _cmd_set_threshold(command):
+    threshold = command.get('threshold')
+    if threshold is not None:
+        threshold = _number(command, 'threshold', integer=True)
+    name = _require_item(command) if 'name' in command else None
+    provider = command.get('provider')
+    if provider is not None and provider not in providers:
+        raise KeyError(f"Provider not found: {provider!r}")
+    set_reorder_threshold(threshold, item=name, provider=provider)
+    return {'name': name, 'provider': provider, 'threshold': threshold}
+
+def _cmd_providers(command):
+    return {pname: {iname: dict(details) for iname, details in items.items()}
+            for pname, items in providers.items()}
+
+def _cmd_buy(command):
+    qty = _number(command, 'qty', integer=True)
+    return bulk_purchase([(command.get('provider'), command.get('item'), qty)])
+
+def _cmd_bulk_buy(command):
+    return bulk_purchase([tuple(line) for line in command.get('lines', [])])
+
+def _cmd_buy_best(command):
+    return buy_best_source(command.get('item'), _number(command, 'qty', integer=True))
+
+def _cmd_replenish(command):
+    budget = command.get('budget')
+    cover_days = _number(command, 'cover_days', integer=True, default=7)
+    if command.get('execute', False):
+        return replenish(budget, cover_days)
+    return plan_replenishment(budget, cover_days)
+
+def _cmd_simulate(command):
+    days = _number(command, 'days', integer=True, default=1)
+    factors = command.get('factors', command.get('factor', 1.0))
+    return [day._asdict() for day in simulate_sales_batch(days, factors)]
+
+def _simulate_steps(command):
+    days = _number(command, 'days', integer=True, default=1)
+    factors = command.get('factors', command.get('factor', 1.0))
+    ledger = yield from simulate_sales_steps(days, factors, SERVICE_STEP_DAYS)
+    return [day._asdict() for day in ledger]
+
+def _cmd_import(command):
+    return import_inventory(command.get('path'), command.get('mode', 'upsert'))
+
+def _import_steps(command):
+    return (yield from import_inventory_steps(command.get('path'), command.get('mode', 'upsert')))
+
+def _cmd_export(command):
+    return {'written': export_inventory(command.get('path'))}
+
+def _cmd_undo(command):
+    return {'undone': undo_journal.undo()}
+
+def _cmd_redo(command):
+    return {'redone': undo_journal.redo()}
+
+def _history_days(command):
+    return _number(command, 'days', integer=True, default=30) or None
+
+def _cmd_top_sellers(command):
+    rows = sales_history.top_sellers(_history_days(command), _number(command, 'limit', True, 10),
+                                     command.get('by', 'units'))
+    return [{'name': name, 'units': units, 'revenue': revenue, 'profit': profit}
+            for name, units, revenue, profit in rows]
+
+def _cmd_provider_revenue(command):
+    return {provider: {'units': units, 'revenue': revenue, 'profit': profit}
+            for provider, (units, revenue, profit) in sales_history.revenue_by_provider(_history_days(command)).items()}
+
+def _cmd_sell_through(command):
+    names = command.get('names')
+    return sales_history.sell_through(_history_days(command), names)
+
+def _cmd_balance(command):
+    return {'store_money': store_money}
+
+def _cmd_search(command):
+    scope = command.get('scope', 'inventory')
+    if scope not in ('inventory', 'offers'):
+        raise ValueError("'scope' must be 'inventory' or 'offers'")
+    index = inventory_names if scope == 'inventory' else offer_names
+    return index.search(str(command.get('query', '')), _number(command, 'limit', True, 10))
+
+COMMANDS = {
+    'modify': _cmd_modify,
+    'remove': _cmd_remove,
+    'sell': _cmd_sell,
+    'inventory': _cmd_inventory,
+    'value': _cmd_value,
+    'most_expensive': _cmd_most_expensive,
+    'cheapest': _cmd_cheapest,
+    'price_range': _cmd_price_range,
+    'average': _cmd_average,
+    'price_stats': _cmd_price_stats,
+    'low_stock': _cmd_low_stock,
+    'set_threshold': _cmd_set_threshold,
+    'providers': _cmd_providers,
+    'buy': _cmd_buy,
+    'bulk_buy': _cmd_bulk_buy,
+    'buy_best': _cmd_buy_best,
+    'replenish': _cmd_replenish,
+    'simulate': _cmd_simulate,
+    'import': _cmd_import,
+    'export': _cmd_export,
+    'balance': _cmd_balance,
+    'search': _cmd_search,
+    'top_sellers': _cmd_top_sellers,
+    'provider_revenue': _cmd_provider_revenue,
+    'sell_through': _cmd_sell_through,
+    'undo': _cmd_undo,
+    'redo': _cmd_redo,
+}
+
+# Commands that only read the inventory side of the store (never offers)
+READ_COMMANDS = {'inventory', 'value', 'most_expensive', 'cheapest', 'price_range',
+                 'average', 'price_stats', 'search', 'balance'}
+
+# Long commands, as generators that yield between steps (used by the service)
+STEPPED_COMMANDS = {
+    'simulate': _simulate_steps,
+    'import': _import_steps,
+}
+
+def command_steps(command, stepped=False):
+    """Run one command dict as a step generator that returns its result.
+
+    With stepped=True the long commands yield between their steps; everything
+    else finishes in one step.
+    """
+    op = command.get('op')
+    if op not in COMMANDS:
+        raise ValueError(f"Unknown op: {op!r}")
+    if op in READ_COMMANDS:
+        return COMMANDS[op](command)
+    with undo_journal.operation(op):
+        if stepped and op in STEPPED_COMMANDS:
+            return (yield from STEPPED_COMMANDS[op](command))
+        return COMMANDS[op](command)
+
+def _command_metric(command):
+    """Metrics name of a command: command.<op> (unknown ops share one name)."""
+    op = command.get('op')
+    return f"command.{op}" if op in COMMANDS else "command.unknown"
+
+def execute_command(command):
+    """Run one command dict and return its result (raises on errors).
+
+    Recorded in metrics per op, as command.<op>.
+    """
+    if not metrics.enabled:
+        return run_steps(command_steps(command))
+    return metrics.call(_command_metric(command), run_steps, (command_steps(command),), {})
+
+def _timed_command_steps(command):
+    """command_steps(stepped=True), counted in metrics like execute_command."""
+    if not metrics.enabled:
+        return (yield from command_steps(command, stepped=True))
+    with metrics.operation(_command_metric(command), stepped=True):
+        return (yield from command_steps(command, stepped=True))
+
+def _execute_now(command):
+    yield from ()
+    return execute_command(command)
+
+def command_reply(line):
+    """Run one JSON command line and return its reply dict (never raises)."""
+    return run_steps(command_reply_steps(line))
+
+def command_reply_steps(line, run=_execute_now):
+    """command_reply as a step generator; run(command) is the step generator for the result."""
+    command = None
+    try:
+        command = json.loads(line)
+        if not isinstance(command, dict):
+            raise ValueError("each line must be a JSON object")
+        reply = {'ok': True, 'op': command.get('op'), 'result': (yield from run(command))}
+    except PurchaseError as e:
+        reply = {'ok': False, 'error': str(e), 'problems': e.problems, 'type': 'PurchaseError'}
+    except VersionConflict as e:
+        reply = {'ok': False, 'error': str(e), 'version': e.current, 'type': 'VersionConflict'}
+    except Exception as e:
+        reply = {'ok': False, 'error': str(e), 'type': type(e).__name__}
+    if not reply['ok'] and isinstance(command, dict) and 'op' in command:
+        reply['op'] = command['op']
+    if isinstance(command, dict) and 'id' in command:
+        reply['id'] = command['id']
+    return reply
+
+def run_headless(lines, out):
+    """Run JSON commands (one per line) and write one JSON result per line.
+
+    Args:
+        lines: iterable of text lines, e.g. an open file
+        out: writable text stream for the results
+    Returns:
+        int: number of commands that failed
+    """
+    failures = 0
+    pending = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        reply = command_reply(line)
+        if not reply['ok']:
+            failures += 1
+        pending.append(json.dumps(reply, separators=(',', ':')))
+        if len(pending) >= 256:
+            out.write("\n".join(pending) + "\n")
+            pending = []
+    if pending:
+        out.write("\n".join(pending) + "\n")
+    out.flush()
+    flush_ledger()
+    return failures
+
+# ---------------- Network service ----------------
+# With --serve HOST:PORT the headless commands are offered to many clients at
+# once over TCP: every line a client sends is one JSON command and gets one JSON
+# reply line, the same as in --batch mode. Commands run on the event loop, and
+# only the loop changes the inventory (the feed refresh thread only touches
+# offers), so the READ_COMMANDS reports answer from the running indexes without
+# taking state_lock (except with --db, where the database connection is shared
+# with the feed thread and every use of it holds state_lock). Changes run one at a time: each takes the service's write
+# lock, and holds state_lock while it changes anything. The long ones
+# (STEPPED_COMMANDS: simulate, import) give the loop back between steps
+# (SERVICE_STEP_DAYS days, or one import chunk), so reports and other clients'
+# I/O carry on meanwhile. A simulate only changes the store after its last day;
+# an import commits chunk by chunk, and reports see the chunks done so far.
+# A client that reads an item and changes it later can send the "version" it
+# read with modify, remove or sell; if the item has changed since, the command
+# fails with a VersionConflict instead of silently overwriting the other change.
+#   $ python gamestore.py --serve 127.0.0.1:8765
+#   {"op": "sell", "name": "Gura Keychain", "qty": 2, "version": 17}
+
+SERVICE_FLUSH_INTERVAL = 1.0  # seconds between ledger flushes while serving
+SERVICE_STEP_DAYS = 1  # simulated days run before a long simulate gives the loop back
+
+def _service_op(line):
+    """The op of a command line, or None if it can't be parsed (it fails anyway)."""
+    try:
+        command = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(command, dict):
+        return None
+    if command.get('op') == 'search' and command.get('scope') == 'offers':
+        return 'search_offers'  # offers may be changing on the feed thread
+    return command.get('op')
+
+async def _service_reply(line, writes):
+    import asyncio
+    op = _service_op(line)
+    if op is None or op in READ_COMMANDS:
+        if _storage is None:
+            return command_reply(line)
+        with state_lock:  # the database connection is shared with the feed thread
+            return command_reply(line)
+    async with writes:
+        steps = command_reply_steps(line, _timed_command_steps)
+        while True:
+            with state_lock:
+                try:
+                    next(steps)
+                except StopIteration as done:
+                    return done.value
+            await asyncio.sleep(0)
+
+async def _serve_client(reader, writer, writes):
+    import asyncio
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            reply = await _service_reply(line, writes)
+            writer.write(json.dumps(reply, separators=(',', ':')).encode('utf-8') + b"\n")
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass  # client went away or sent a line longer than the stream limit
+    finally:
+        writer.close()
+
+async def _flush_ledger_every(interval):
+    import asyncio
+    while True:
+        await asyncio.sleep(interval)
+        with state_lock:
+            flush_ledger()
+
+async def start_service(host='127.0.0.1', port=8765):
+    """Start accepting clients; returns the asyncio server (port 0 picks a free port)."""
+    import asyncio
+    writes = asyncio.Lock()  # one change at a time, even while a long one is between steps
+    server = await asyncio.start_server(functools.partial(_serve_client, writes=writes),
+                                        host, port, limit=1 << 20)
+    server.flusher = asyncio.create_task(_flush_ledger_every(SERVICE_FLUSH_INTERVAL))
+    return server
+
+def run_service(address):
+    """Serve the store on 'HOST:PORT' until interrupted."""
+    import asyncio
+    host, _, port = address.rpartition(':')
+
+    async def serve():
+        server = await start_service(host or '127.0.0.1', int(port))
+        for sock in server.sockets:
+            print(f"Serving the store on {sock.getsockname()[0]}:{sock.getsockname()[1]}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    flush_ledger()
+
+# ---------------- Store fleet ----------------
+# Several storefronts can run at once as separate processes, each with its own
+# inventory and store_money, all buying from the same providers. The providers'
+# available counts live in one shared memory block (an int64 per offer), so no
+# store can sell units another store already took. Every offer is guarded by
+# one of FLEET_LOCK_STRIPES locks (offer number % stripes): a purchase only
+# locks its own stripe for the check-and-take in reserve(), so stores buying
+# different offers never wait for each other and there's no central process.
+# Costs and the list of offers are copied to every store and stay fixed.
+
+FLEET_LOCK_STRIPES = 64
+
+class SharedStock:
+    """Provider availability shared between processes.
+
+    Args:
+        offers: list of (provider, item, cost), one per slot
+        shm: the SharedMemory block holding one int64 per slot
+        locks: the striped multiprocessing locks
+    """
+
+    def __init__(self, offers, shm, locks):
+        self.offers = offers
+        self.slots = {(provider, item): slot for slot, (provider, item, _) in enumerate(offers)}
+        self.catalogs = {}  # provider -> {item: slot}
+        for slot, (provider, item, _) in enumerate(offers):
+            self.catalogs.setdefault(provider, {})[item] = slot
+        self.costs = [cost for _, _, cost in offers]
+        self.shm = shm
+        self.locks = locks
+        self.available = shm.buf.cast('q')
+
+    def lock(self, slot):
+        return self.locks[slot % len(self.locks)]
+
+    def reserve(self, slot, qty):
+        """Take `qty` units if that many are available; return the units left (or None)."""
+        with self.lock(slot):
+            left = self.available[slot] - qty
+            if left < 0:
+                return None
+            self.available[slot] = left
+            return left
+
+    def release(self, slot, qty):
+        """Give back `qty` reserved units; return the units now available."""
+        with self.lock(slot):
+            self.available[slot] += qty
+            return self.available[slot]
+
+    def set(self, slot, available):
+        with self.lock(slot):
+            self.available[slot] = available
+
+    def close(self):
+        self.available.release()
+        self.shm.close()
+
+def create_shared_stock(catalogs, stripes=FLEET_LOCK_STRIPES):
+    """Copy provider catalogs into a new shared memory block.
+
+    The caller owns the block and must close() and unlink it when done.
+    """
+    offers = [(provider, item, details['cost'])
+              for provider, items in catalogs.items() for item, details in items.items()]
+    shm = shared_memory.SharedMemory(create=True, size=max(8, 8 * len(offers)))
+    locks = [multiprocessing.Lock() for _ in range(stripes)]
+    stock = SharedStock(offers, shm, locks)
+    for slot, (provider, item, _) in enumerate(offers):
+        stock.available[slot] = catalogs[provider][item]['available']
+    return stock
+
+class SharedOffer(MutableMapping):
+    """One provider offer ({'cost', 'available'}); 'available' is read from shared memory."""
+
+    __slots__ = ('_stock', '_slot')
+
+    def __init__(self, stock, slot):
+        self._stock = stock
+        self._slot = slot
+
+    def __getitem__(self, field):
+        if field == 'available':
+            return self._stock.available[self._slot]
+        if field == 'cost':
+            return self._stock.costs[self._slot]
+        raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field == 'available':
+            self._stock.set(self._slot, value)
+        elif field == 'cost':
+            self._stock.costs[self._slot] = value
+        else:
+            raise KeyError(f"Unknown field '{field}'")
+
+    def __delitem__(self, field):
+        raise KeyError(f"Can't remove '{field}' from a shared offer")
+
+    def __iter__(self):
+        return iter(('cost', 'available'))
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class SharedCatalog(MutableMapping):
+    """One provider's catalog in a store fleet (item -> SharedOffer)."""
+
+    def __init__(self, stock, provider):
+        self._stock = stock
+        self._items = stock.catalogs[provider]
+
+    def __getitem__(self, item):
+        return SharedOffer(self._stock, self._items[item])
+
+    def __setitem__(self, item, details):
+        if item not in self._items:
+            raise KeyError(f"The fleet's provider catalogs are fixed; can't add '{item}'")
+        offer = self[item]
+        offer['cost'] = details['cost']
+        offer['available'] = details['available']
+
+    def __delitem__(self, item):
+        raise KeyError(f"The fleet's provider catalogs are fixed; can't remove '{item}'")
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+class SharedProviders(MutableMapping):
+    """All provider catalogs of a store fleet (provider name -> SharedCatalog).
+
+    reserve/release are picked up by take_offer_stock and return_offer_stock.
+    """
+
+    def __init__(self, stock):
+        self._stock = stock
+
+    def __getitem__(self, provider):
+        if provider not in self._stock.catalogs:
+            raise KeyError(provider)
+        return SharedCatalog(self._stock, provider)
+
+    def __setitem__(self, provider, offers):
+        raise KeyError(f"The fleet's providers are fixed; can't add '{provider}'")
+
+    def __delitem__(self, provider):
+        raise KeyError(f"The fleet's providers are fixed; can't remove '{provider}'")
+
+    def __contains__(self, provider):
+        return provider in self._stock.catalogs
+
+    def __iter__(self):
+        return iter(self._stock.catalogs)
+
+    def __len__(self):
+        return len(self._stock.catalogs)
+
+    def reserve(self, provider, item, qty):
+        """Atomically take `qty` units; return the units left (PurchaseError if short)."""
+        slot = self._stock.slots[(provider, item)]
+        left = self._stock.reserve(slot, qty)
+        if left is None:
+            raise PurchaseError([f"'{item}' from '{provider}': {qty} wanted, "
+                                 f"only {self._stock.available[slot]} available"])
+        return left
+
+    def release(self, provider, item, qty):
+        return self._stock.release(self._stock.slots[(provider, item)], qty)
+
+_fleet_start = None  # (SharedStock, inventory, store money) inside a fleet process
+
+def _init_fleet_store(offers, shm_name, locks, items, money):
+    global _fleet_start, _storage, _ledger
+    # A forked store must not write to the parent's database or ledger
+    _storage = None
+    for listeners in (_inventory_indexes, _offer_indexes, _money_listeners):
+        if _ledger in listeners:
+            listeners.remove(_ledger)
+    _ledger = None
+    stock = SharedStock(offers, shared_memory.SharedMemory(name=shm_name), locks)
+    _fleet_start = (stock, items, money)
+
+def _run_fleet_store(command_path, result_path):
+    global inventory, providers, store_money
+    stock, items, money = _fleet_start
+    # Every store starts from the same inventory and money
+    inventory = {name: dict(details) for name, details in items.items()}
+    providers = SharedProviders(stock)
+    store_money = money
+    sales_velocity.clear()
+    invalidate_inventory_indexes()
+    invalidate_offer_indexes()
+    start = time.perf_counter()
+    with open(command_path, encoding='utf-8') as source, open(result_path, 'w', encoding='utf-8') as out:
+        failures = run_headless(source, out)
+    return {
+        'commands': command_path,
+        'results': result_path,
+        'failures': failures,
+        'seconds': time.perf_counter() - start,
+        'store_money': store_money,
+        'items': len(inventory),
+        'stock': sum(details['stock'] for details in inventory.values()),
+    }
+
+def run_store_fleet(command_paths, workers=None):
+    """Run one storefront per command file, all sharing the providers' stock.
+
+    Each store runs its file like --batch and writes its results to
+    '<file>.results.jsonl'. When every store is done the providers' available
+    counts here are updated to what the fleet left.
+    Args:
+        command_paths: JSON command files, one per store
+        workers (int): processes to use (default: one per store)
+    Returns:
+        list[dict]: a summary per store (failures, seconds, store_money, items, stock)
+    """
+    flush_ledger()  # forked stores must not inherit unwritten events
+    items = {name: dict(details) for name, details in inventory.items()}
+    stock = create_shared_stock(providers)
+    try:
+        with ProcessPoolExecutor(max_workers=workers or len(command_paths), initializer=_init_fleet_store,
+                                 initargs=(stock.offers, stock.shm.name, stock.locks, items, store_money)) as executor:
+            futures = [executor.submit(_run_fleet_store, path, path + ".results.jsonl")
+                       for path in command_paths]
+            summaries = [future.result() for future in futures]
+        with storage_transaction():
+            for slot, (provider, item, _) in enumerate(stock.offers):
+                if providers[provider][item]['available'] != stock.available[slot]:
+                    update_offer(provider, item, available=stock.available[slot])
+    finally:
+        stock.close()
+        stock.shm.unlink()
+    return summaries
+
+# How each menu action is named on the undo menu
+UNDO_LABELS = {
+    '2': "modify item",
+    '3': "remove item",
+    '9': "buy from provider",
+    '10': "day of sales",
+    '13': "bulk purchase",
+    '14': "buy from cheapest source",
+    '15': "automatic restock",
+    '17': "import inventory",
+    '20': "what-if outcome",
+}
+
+def main():
+    """Main program loop"""
+    while True:
+        try:
+            # Everything done by the previous action is on disk before we wait for input
+            flush_ledger()
+            # The whole menu is drawn with one write
+            screen = Screen()
+            screen.header("Game Store Inventory Management")
+            screen.add(BOX_TOP)
+            screen.menu_item("1", "Add new item (disabled - buy from providers)")
+            screen.menu_item("2", "Modify item (price/stock)")
+            screen.menu_item("3", "Remove item")
+            screen.menu_item("4", "Display inventory")
+            screen.menu_item("5", "Calculate total inventory value")
+            screen.menu_item("6", "Find most expensive item")
+            screen.menu_item("7", "Calculate average price")
+            screen.menu_item("8", "Show providers and their catalog")
+            screen.menu_item("9", "Buy from provider")
+            screen.menu_item("10", "Simulate a day of sales")
+            screen.menu_item("11", f"Show store money (Current: ${store_money:.2f})")
+            screen.menu_item("12", "Browse items by price")
+            screen.menu_item("13", "Bulk purchase order")
+            screen.menu_item("14", "Buy from cheapest source")
+            screen.menu_item("15", "Automatic restock")
+            screen.menu_item("16", "Refresh provider feeds")
+            screen.menu_item("17", "Import / export inventory")
+            screen.menu_item("18", "Sales history and trends")
+            screen.menu_item("19", "Undo / redo last change")
+            screen.menu_item("20", "What-if: simulate sales on a copy")
+            screen.menu_item("21", "Low-stock alerts")
+            screen.menu_item("0", "Exit")
+            screen.add(BOX_BOTTOM)
+            screen.show()
+
+            choice = input("\nEnter your choice (number): ")
+            
+            clear_screen()
+            
+            # A background feed refresh waits while an action changes the store
+            # (but not while it waits for the user), and everything the action
+            # changes can be undone together
+            with menu_action(), undo_journal.operation(UNDO_LABELS.get(choice, f"menu option {choice}")):
+                if choice == '1':
+                    add_item()
+                elif choice == '2':
+                    modify_item()
+                elif choice == '3':
+                    remove_item()
+                elif choice == '4':
+                    display_inventory()
+                elif choice == '5':
+                    calculate_inventory_value()
+                elif choice == '6':
+                    find_most_expensive()
+                elif choice == '7':
+                    calculate_average_price()
+                elif choice == '8':
+                    show_providers()
+                elif choice == '9':
+                    buy_from_provider()
+                elif choice == '10':
+                    simulate_day_sales()
+                elif choice == '11':
+                    show_store_money()
+                elif choice == '12':
+                    browse_by_price()
+                elif choice == '13':
+                    bulk_purchase_menu()
+                elif choice == '14':
+                    buy_best_source_menu()
+                elif choice == '15':
+                    replenishment_menu()
+                elif choice == '16':
+                    feed_refresh_menu()
+                elif choice == '17':
+                    import_export_menu()
+                elif choice == '18':
+                    sales_history_menu()
+                elif choice == '19':
+                    undo_menu()
+                elif choice == '20':
+                    what_if_menu()
+                elif choice == '21':
+                    low_stock_menu()
+                elif choice == '0':
+                    print_submenu("✨ Thank you for using the Game Store Inventory Management System!")
+                    break
+                else:
+                    print_submenu("❌ Invalid choice! Please try again.")
+                
+        except Exception as e:
+            print(f"An unexpected error occurred: {str(e)}")
+            print("Please try again.")
+
+def parse_args(argv=None):
+    """Parse the optional command line switches."""
+    parser = argparse.ArgumentParser(description="GameStore simulator")
+    parser.add_argument('--columnar', action='store_true',
+                        help="store the inventory in columnar arrays (faster reports on big catalogs)")
+    parser.add_argument('--db', metavar='PATH',
+                        help="keep the inventory, providers and money in this SQLite database")
+    parser.add_argument('--catalog-dir', metavar='DIR',
+                        help="load inventory.csv/.jsonl and one feed file per provider from DIR "
+                             "when first needed (parsed files are cached in DIR/.gamestore-cache)")
+    parser.add_argument('--ledger', metavar='PATH',
+                        help="record every cash/stock/provider change in this ledger file (and restore from it)")
+    parser.add_argument('--feeds', metavar='FILE', nargs='+',
+                        help="load provider feed files (CSV/JSONL/JSON) at startup")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run JSON commands from FILE ('-' for stdin) without the menu")
+    parser.add_argument('--output', metavar='FILE',
+                        help="write --batch results to FILE instead of stdout")
+    parser.add_argument('--serve', metavar='HOST:PORT',
+                        help="answer JSON commands from many TCP clients instead of showing the menu")
+    parser.add_argument('--fleet', metavar='FILE', nargs='+',
+                        help="run one store process per JSON command FILE, all buying from "
+                             "the same providers (results go to FILE.results.jsonl)")
+    parser.add_argument('--sweep', metavar='FACTOR', type=float, nargs='+',
+                        help="simulate sales for each demand factor over many random seeds and "
+                             "print one JSON summary per factor and horizon (the store isn't changed)")
+    parser.add_argument('--sweep-days', metavar='N', type=int, nargs='+', default=[30],
+                        help="with --sweep, days to simulate (default 30)")
+    parser.add_argument('--sweep-seeds', metavar='N', type=int, default=20,
+                        help="with --sweep, random runs per scenario (default 20)")
+    parser.add_argument('--sweep-jitter', metavar='X', type=float, default=0.25,
+                        help="with --sweep, spread of the random daily variation (default 0.25, 0 = none)")
+    parser.add_argument('--workers', metavar='N', type=int,
+                        help="worker processes for --sweep and --fleet (default: --sweep uses "
+                             "every core, --fleet one per store)")
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="count and time every operation; write the metrics to PATH on exit "
+                             "(Prometheus text, or JSON if PATH ends in .json)")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="sample operations with cProfile and save the stats to PATH on exit")
+    parser.add_argument('--profile-every', metavar='N', type=int, default=100,
+                        help="with --profile, profile one in every N operations (default 100)")
+    args = parser.parse_args(argv)
+    if args.db and (args.catalog_dir or args.columnar):
+        parser.error("--db keeps the store in the database; it can't be combined with --catalog-dir or --columnar")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.db:
+        open_storage(args.db)
+    if args.catalog_dir:
+        open_catalog_dir(args.catalog_dir)
+    if args.columnar:
+        use_columnar_inventory()
+    if args.metrics:
+        metrics.enabled = True
+        atexit.register(export_metrics, args.metrics)
+    if args.profile:
+        enable_profiling(args.profile_every)
+        atexit.register(dump_profile, args.profile)
+    if args.ledger:
+        open_ledger(args.ledger)
+    if args.feeds:
+        if args.batch:
+            refresh_provider_feeds(args.feeds)  # commands should see the loaded catalog
+        else:
+            start_feed_refresh(args.feeds)
+    if args.serve:
+        run_service(args.serve)
+        sys.exit(0)
+    if args.sweep:
+        for summary in run_scenario_sweep(args.sweep, args.sweep_days, range(args.sweep_seeds),
+                                          args.sweep_jitter, args.workers):
+            print(json.dumps(summary))
+        sys.exit(0)
+    if args.fleet:
+        summaries = run_store_fleet(args.fleet, args.workers)
+        for summary in summaries:
+            print(json.dumps(summary))
+        sys.exit(1 if any(summary['failures'] for summary in summaries) else 0)
+    if args.batch:
+        source = sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')
+        out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        with source, out:
+            failed = run_headless(source, out)
+        sys.exit(1 if failed else 0)
     # Show welcome screen first, then enter main loop
     try:
         show_welcome()
@@ -0,0 +1,1592 @@
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import benchmark
+import gamestore
+
+
+def install_store(inventory, providers, money):
+    """Make a small in-memory store the current state."""
+    gamestore._storage = None
+    gamestore.inventory = inventory
+    gamestore.providers = providers
+    gamestore.store_money = money
+    gamestore.sales_velocity.clear()
+    gamestore.invalidate_inventory_indexes()
+    gamestore.invalidate_offer_indexes()
+
+
+def snapshot():
+    """Deep copy of the inventory, the offers and the money."""
+    return ({name: dict(details) for name, details in gamestore.inventory.items()},
+            {provider: {item: dict(offer) for item, offer in items.items()}
+             for provider, items in gamestore.providers.items()},
+            gamestore.store_money)
+
+
+class BulkPurchaseTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store(
+            {'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.5, 'provider': 'KawaiiGoods'}},
+            {'KawaiiGoods': {'Gura Plushie': {'cost': 11.0, 'available': 50},
+                             'Pikachu Mug': {'cost': 6.25, 'available': 20}},
+             'RetroHub': {'Pixel Poster': {'cost': 3.1, 'available': 9},
+                          'Broken Widget': {'cost': 1.0, 'available': 5}}},
+            1000.0)
+        self.lines = [('KawaiiGoods', 'Gura Plushie', 3),
+                      ('KawaiiGoods', 'Pikachu Mug', 2),
+                      ('RetroHub', 'Pixel Poster', 4),
+                      ('RetroHub', 'Broken Widget', 1)]
+
+    def buy_failing_on(self, failing_item):
+        """bulk_purchase(self.lines) where stocking `failing_item` fails half way."""
+        add_item = gamestore.add_inventory_item
+
+        def add_inventory_item(name, details):
+            if name == failing_item:
+                raise OSError("disk full")
+            return add_item(name, details)
+
+        with mock.patch.object(gamestore, 'add_inventory_item', add_inventory_item):
+            with self.assertRaises(OSError):
+                gamestore.bulk_purchase(self.lines)
+
+    def test_failed_order_restores_everything(self):
+        before = snapshot()
+        self.buy_failing_on('Broken Widget')
+        self.assertEqual(snapshot(), before)
+        totals = dict(gamestore.inventory_totals.totals())
+        gamestore.invalidate_inventory_indexes()
+        self.assertEqual(gamestore.inventory_totals.totals(), totals)
+
+    def test_failed_order_restores_everything_in_sqlite(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        store = gamestore.open_storage(os.path.join(directory, 'store.db'))
+        self.addCleanup(store.conn.close)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        before = snapshot()
+        self.buy_failing_on('Broken Widget')
+        self.assertEqual(snapshot(), before)
+        self.assertEqual(store.load_money(), before[2])
+
+    def test_order_is_applied(self):
+        result = gamestore.bulk_purchase(self.lines)
+        self.assertEqual(result['units'], 10)
+        self.assertEqual(gamestore.inventory['Gura Plushie']['stock'], 7)
+        self.assertEqual(gamestore.providers['RetroHub']['Broken Widget']['available'], 4)
+        self.assertAlmostEqual(gamestore.store_money, 1000.0 - result['total_cost'])
+
+    def test_rejects_bad_quantities(self):
+        for qty in (True, 0, -1, 2.0, '3'):
+            with self.subTest(qty=qty):
+                before = snapshot()
+                with self.assertRaises(gamestore.PurchaseError):
+                    gamestore.bulk_purchase([('KawaiiGoods', 'Pikachu Mug', qty)])
+                self.assertEqual(snapshot(), before)
+
+    def test_rejects_order_whose_price_changed(self):
+        gamestore.update_offer('RetroHub', 'Pixel Poster', cost=4.0)
+        before = snapshot()
+        with self.assertRaises(gamestore.PurchaseError):
+            gamestore.bulk_purchase([('RetroHub', 'Pixel Poster', 2)], expected_cost=2 * 3.1)
+        self.assertEqual(snapshot(), before)
+
+
+class SqliteStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'store.db')
+        install_store(
+            {'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.5, 'provider': 'KawaiiGoods'}},
+            {'RetroHub': {'Pixel Poster': {'cost': 3.1, 'available': 9}}},
+            1000.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        self.store = self.open()
+
+    def open(self):
+        store = gamestore.open_storage(self.path)
+        self.addCleanup(store.conn.close)
+        return store
+
+    def test_changes_are_kept_across_reopening(self):
+        with gamestore.storage_transaction():
+            gamestore.apply_purchase('RetroHub', 'Pixel Poster', 3)
+        gamestore.update_item('Gura Plushie', price=25.0)
+        after = snapshot()
+        self.store.conn.close()
+        install_store({}, {}, 0.0)
+        self.open()
+        self.assertEqual(snapshot(), after)
+        self.assertAlmostEqual(gamestore.store_money, 1000.0 - 3 * 3.1)
+
+    def test_failed_transaction_rolls_back(self):
+        before = snapshot()
+        totals = gamestore.inventory_totals.totals()
+        with self.assertRaises(RuntimeError):
+            with gamestore.storage_transaction():
+                gamestore.apply_purchase('RetroHub', 'Pixel Poster', 3)
+                gamestore.delete_inventory_item('Gura Plushie')
+                raise RuntimeError("crash")
+        self.assertEqual(snapshot(), before)
+        self.assertEqual(self.store.load_money(), 1000.0)
+        self.assertEqual(gamestore.inventory_totals.totals(), totals)
+
+    def test_nested_transactions_commit_once(self):
+        with gamestore.storage_transaction():
+            with gamestore.storage_transaction():
+                gamestore.update_item('Gura Plushie', stock=9)
+            self.assertTrue(self.store.conn.in_transaction)
+        self.assertFalse(self.store.conn.in_transaction)
+        self.assertEqual(gamestore.inventory['Gura Plushie']['stock'], 9)
+
+    def test_deleting_row_fields(self):
+        row = gamestore.inventory['Gura Plushie']
+        del row['provider']
+        del row['cost']
+        self.assertEqual(dict(gamestore.inventory['Gura Plushie']), {'price': 30.0, 'stock': 4, 'cost': 0})
+        with self.assertRaises(KeyError):
+            del row['provider']
+        for mapping, field in ((row, 'stock'), (gamestore.providers['RetroHub']['Pixel Poster'], 'cost')):
+            with self.assertRaisesRegex(KeyError, "required"):
+                del mapping[field]
+        self.assertEqual(gamestore.providers['RetroHub']['Pixel Poster']['cost'], 3.1)
+
+
+class BuyFromProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store({}, {'RetroHub': {'Pixel Poster': {'cost': 3.5, 'available': 9}}}, 100.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def buy(self, at_confirm=lambda: None):
+        """Buy 2 Pixel Posters through the menu; `at_confirm` runs while the last prompt waits."""
+        answers = iter(['1', '1', '2'])
+
+        def answer(prompt=''):
+            if prompt.startswith('Proceed'):
+                at_confirm()
+                return 'yes'
+            return next(answers, '')
+
+        with mock.patch('builtins.input', answer), mock.patch('builtins.print'):
+            gamestore.buy_from_provider()
+
+    def test_failed_buy_restores_money_and_stock(self):
+        before = snapshot()
+        with mock.patch.object(gamestore, 'add_inventory_item', side_effect=OSError("disk full")):
+            self.buy()
+        self.assertEqual(snapshot(), before)
+
+    def test_buys_at_the_shown_price(self):
+        self.buy()
+        self.assertEqual(gamestore.inventory['Pixel Poster']['stock'], 2)
+        self.assertEqual(gamestore.store_money, 93.0)
+
+    def test_price_change_while_confirming_buys_nothing(self):
+        before = snapshot()
+        self.buy(lambda: gamestore.update_offer('RetroHub', 'Pixel Poster', cost=300.0))
+        self.assertEqual(snapshot()[0], before[0])
+        self.assertEqual(gamestore.store_money, 100.0)
+
+    def test_stock_gone_while_confirming_buys_nothing(self):
+        self.buy(lambda: gamestore.update_offer('RetroHub', 'Pixel Poster', available=1))
+        self.assertNotIn('Pixel Poster', gamestore.inventory)
+        self.assertEqual(gamestore.store_money, 100.0)
+
+
+class BestSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store({}, {'PosterBarn': {'Pixel Poster': {'cost': 3.0, 'available': 4}},
+                           'RetroHub': {'Pixel Poster': {'cost': 3.5, 'available': 10}},
+                           'SoldOut': {'Pixel Poster': {'cost': 2.5, 'available': 0}},
+                           'Pricey': {'Pixel Poster': {'cost': 5.0, 'available': 100}}}, 100.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def test_cheapest_offer_covers_the_order(self):
+        self.assertEqual(gamestore.plan_best_source('Pixel Poster', 3), [('PosterBarn', 'Pixel Poster', 3)])
+
+    def test_order_is_split_when_the_cheapest_runs_short(self):
+        self.assertEqual(gamestore.plan_best_source('Pixel Poster', 6),
+                         [('PosterBarn', 'Pixel Poster', 4), ('RetroHub', 'Pixel Poster', 2)])
+        result = gamestore.buy_best_source('Pixel Poster', 6)
+        self.assertEqual((result['units'], result['total_cost']), (6, 19.0))
+        self.assertEqual(gamestore.inventory['Pixel Poster']['stock'], 6)
+        self.assertAlmostEqual(gamestore.inventory['Pixel Poster']['cost'], 19.0 / 6)
+        self.assertAlmostEqual(gamestore.store_money, 81.0)
+        self.assertEqual(gamestore.plan_best_source('Pixel Poster', 9),
+                         [('RetroHub', 'Pixel Poster', 8), ('Pricey', 'Pixel Poster', 1)])
+
+    def test_not_enough_units_or_money_changes_nothing(self):
+        before = snapshot()
+        with self.assertRaisesRegex(gamestore.PurchaseError, "only 114 of 200"):
+            gamestore.buy_best_source('Pixel Poster', 200)
+        with self.assertRaises(gamestore.PurchaseError):
+            gamestore.buy_best_source('Pixel Poster', 30)  # 4 + 10 + 16 units would cost $127
+        with self.assertRaises(gamestore.PurchaseError):
+            gamestore.buy_best_source('Game Boy', 1)
+        self.assertEqual(snapshot(), before)
+
+
+class ReplenishmentTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store(
+            {'Gura Plushie': {'price': 30.0, 'stock': 2, 'cost': 12.0, 'provider': 'KawaiiGoods'},
+             'Pixel Poster': {'price': 9.0, 'stock': 0, 'cost': 3.0, 'provider': 'RetroHub'},
+             'Dud Figure': {'price': 5.0, 'stock': 0, 'cost': 6.0, 'provider': 'RetroHub'},
+             'Slow Seller': {'price': 50.0, 'stock': 20, 'cost': 10.0, 'provider': 'RetroHub'}},
+            {'KawaiiGoods': {'Gura Plushie': {'cost': 10.0, 'available': 100}},
+             'RetroHub': {'Pixel Poster': {'cost': 3.0, 'available': 4},
+                          'Dud Figure': {'cost': 6.0, 'available': 50},
+                          'Slow Seller': {'cost': 10.0, 'available': 50}},
+             'PosterBarn': {'Pixel Poster': {'cost': 4.0, 'available': 100}}},
+            1000.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        gamestore.sales_velocity.update({'Gura Plushie': 2.0, 'Pixel Poster': 1.0,
+                                         'Dud Figure': 5.0, 'Slow Seller': 1.0})
+
+    def test_plan_covers_the_need_cheapest_value_first(self):
+        plan = gamestore.plan_replenishment(cover_days=7)
+        # 7 posters: all 4 of the cheaper offer, the rest from the other one;
+        # 12 plushies; nothing that earns no margin or is already covered
+        self.assertEqual(sorted(plan['lines']), [('KawaiiGoods', 'Gura Plushie', 12),
+                                                 ('PosterBarn', 'Pixel Poster', 3),
+                                                 ('RetroHub', 'Pixel Poster', 4)])
+        self.assertAlmostEqual(plan['total_cost'], 12 * 10.0 + 4 * 3.0 + 3 * 4.0)
+        self.assertAlmostEqual(plan['expected_margin'], 12 * 20.0 + 4 * 6.0 + 3 * 5.0)
+
+    def test_plan_stays_within_the_budget(self):
+        plan = gamestore.plan_replenishment(budget=50.0, cover_days=7)
+        # $2 of margin per dollar from the cheap posters and the plushies, then
+        # $1.25 from the dearer posters with what is left
+        self.assertEqual(plan['lines'], [('RetroHub', 'Pixel Poster', 4), ('KawaiiGoods', 'Gura Plushie', 3),
+                                         ('PosterBarn', 'Pixel Poster', 2)])
+        self.assertAlmostEqual(plan['total_cost'], 50.0)
+
+    def test_replenish_buys_the_plan(self):
+        plan = gamestore.replenish(cover_days=7)
+        self.assertEqual(plan['result']['units'], 19)
+        self.assertEqual(gamestore.inventory['Pixel Poster']['stock'], 7)
+        self.assertEqual(gamestore.inventory['Gura Plushie']['stock'], 14)
+        self.assertAlmostEqual(gamestore.store_money, 1000.0 - plan['total_cost'])
+
+
+class LowStockTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store(
+            {'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.0, 'provider': 'KawaiiGoods'},
+             'Pixel Poster': {'price': 9.0, 'stock': 3, 'cost': 3.0, 'provider': 'RetroHub'},
+             'Game Boy': {'price': 90.0, 'stock': 40, 'cost': 40.0, 'provider': 'RetroHub'}},
+            {'KawaiiGoods': {'Gura Plushie': {'cost': 10.0, 'available': 100}},
+             'RetroHub': {'Pixel Poster': {'cost': 3.5, 'available': 50}},
+             'PosterBarn': {'Pixel Poster': {'cost': 3.0, 'available': 5}}},
+            1000.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        patcher = mock.patch.multiple(gamestore, reorder_thresholds={}, provider_thresholds={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fewest_days_of_cover_first(self):
+        gamestore.record_sales({'Gura Plushie': 4, 'Pixel Poster': 1})
+        self.assertEqual(gamestore.low_stock.lowest(), ['Gura Plushie', 'Pixel Poster'])
+        gamestore.record_sales({'Pixel Poster': 30})
+        self.assertEqual(gamestore.low_stock.lowest(), ['Pixel Poster', 'Gura Plushie'])
+
+    def test_follows_stock_changes_and_thresholds(self):
+        self.assertEqual(len(gamestore.low_stock), 2)
+        gamestore.update_item('Gura Plushie', stock=20)
+        gamestore.update_item('Game Boy', stock=5)
+        self.assertEqual(sorted(gamestore.low_stock.lowest()), ['Game Boy', 'Pixel Poster'])
+        gamestore.set_reorder_threshold(2, item='Pixel Poster')
+        self.assertNotIn('Pixel Poster', gamestore.low_stock)
+        gamestore.set_reorder_threshold(25, provider='KawaiiGoods')
+        self.assertIn('Gura Plushie', gamestore.low_stock)
+        with self.assertRaises(ValueError):
+            gamestore.set_reorder_threshold(-1, item='Game Boy')
+
+    def test_new_alerts_are_reported_once(self):
+        gamestore.low_stock.new_alerts()
+        gamestore.update_item('Game Boy', stock=1)
+        self.assertEqual(gamestore.low_stock.new_alerts(), ['Game Boy'])
+        self.assertEqual(gamestore.low_stock.new_alerts(), [])
+
+    def test_provider_threshold_rechecks_only_its_items(self):
+        gamestore.low_stock.new_alerts()
+        gamestore.update_item('Game Boy', stock=1)
+        gamestore.update_item('Gura Plushie', provider='RetroHub')
+        with mock.patch.object(gamestore.low_stock, '_check', wraps=gamestore.low_stock._check) as check:
+            gamestore.set_reorder_threshold(45, provider='RetroHub')
+        self.assertEqual(sorted(call.args[0] for call in check.call_args_list),
+                         ['Game Boy', 'Gura Plushie', 'Pixel Poster'])
+        self.assertIn('Gura Plushie', gamestore.low_stock)
+        gamestore.set_reorder_threshold(0, provider='KawaiiGoods')
+        self.assertEqual(gamestore.low_stock.new_alerts(), ['Game Boy'])
+        gamestore.set_reorder_threshold(None, provider='RetroHub')
+        self.assertEqual(sorted(gamestore.low_stock.lowest()), ['Game Boy', 'Gura Plushie', 'Pixel Poster'])
+
+    def test_alert_suggests_the_cheapest_offer(self):
+        alert = gamestore.stock_alert('Pixel Poster')
+        self.assertEqual((alert['stock'], alert['threshold'], alert['reorder_qty']), (3, 5, 7))
+        # PosterBarn is cheaper but can't supply the whole reorder
+        self.assertEqual(alert['offer'], {'provider': 'RetroHub', 'cost': 3.5, 'available': 50})
+        self.assertIsNone(alert['days_of_cover'])
+        self.assertIsNone(gamestore.stock_alert('Game Boy'))
+
+
+class FeedRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        install_store({}, {'RetroHub': {'Pixel Poster': {'cost': 3.1, 'available': 9}}}, 100.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_background_refresh_with_db(self):
+        store = gamestore.open_storage(os.path.join(self.directory, 'store.db'))
+        self.addCleanup(store.conn.close)
+        path = self.write('RetroHub.csv', "item,cost,available\nPixel Poster,2.5,30\nGame Boy,40,2\n")
+        gamestore.start_feed_refresh([path]).join()
+        report = gamestore.feed_reports[-1][path]
+        self.assertNotIn('error', report)
+        self.assertEqual((report['added'], report['updated']), (1, 1))
+        self.assertEqual(dict(gamestore.providers['RetroHub']['Pixel Poster']), {'cost': 2.5, 'available': 30})
+        self.assertEqual(dict(gamestore.providers['RetroHub']['Game Boy']), {'cost': 40.0, 'available': 2})
+
+    def records(self, text):
+        """The records of a JSON feed read a few characters at a time (values split across reads)."""
+        path = self.write('feed.json', text)
+        with mock.patch.object(gamestore, 'FEED_READ_SIZE', 3):
+            return list(gamestore._feed_records(path))
+
+    def test_json_list_feed(self):
+        self.assertEqual(self.records(' [ {"provider": "RetroHub", "item": "Game Boy", "cost": 40.25, '
+                                      '"available": 12345},\n{"provider": "A", "item": "B [x]", "cost": 1, '
+                                      '"available": 0} ] '),
+                         [{'provider': 'RetroHub', 'item': 'Game Boy', 'cost': 40.25, 'available': 12345},
+                          {'provider': 'A', 'item': 'B [x]', 'cost': 1, 'available': 0}])
+        self.assertEqual(self.records('[]'), [])
+
+    def test_json_object_feed(self):
+        expected = [{'cost': 2.5, 'available': 30, 'item': 'Pixel Poster', 'provider': 'RetroHub'},
+                    {'cost': 40, 'available': 2, 'item': 'Game Boy', 'provider': 'RetroHub'}]
+        items = '"items": {"Pixel Poster": {"cost": 2.5, "available": 30}, "Game Boy": {"cost": 40, "available": 2}}'
+        self.assertEqual(self.records('{"provider": "RetroHub", ' + items + '}'), expected)
+        # Items read before the provider key wait for it
+        self.assertEqual(self.records('{' + items + ', "provider": "RetroHub", "note": [1, 2]}'), expected)
+
+    def test_malformed_json_feed_reports_an_error(self):
+        good = self.write('RetroHub.csv', "item,cost,available\nGame Boy,40,2\nBad,,x\n")
+        bad = self.write('broken.json', '[{"provider": "A", "item": "B", "cost": 1, "available": 1} {')
+        report = gamestore.refresh_provider_feeds([good, bad])
+        self.assertIn('error', report[bad])
+        self.assertNotIn('error', report[good])
+        self.assertEqual((report[good]['added'], report[good]['bad']), (1, 1))
+        self.assertEqual(dict(gamestore.providers['RetroHub']['Game Boy']), {'cost': 40.0, 'available': 2})
+
+
+class ImportExportTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store(
+            {'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.0, 'provider': 'KawaiiGoods'},
+             'Pixel Poster': {'price': 8.5, 'stock': 0, 'cost': 3.1},
+             'Retro Pad, "Deluxe"': {'price': 45.0, 'stock': 7, 'cost': 20.0, 'provider': 'RetroHub'}},
+            {}, 100.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, text):
+        with open(self.path(name), 'w', newline='', encoding='utf-8') as f:
+            f.write(text)
+        return self.path(name)
+
+    def check_round_trip(self, name):
+        before = snapshot()
+        self.assertEqual(gamestore.export_inventory(self.path(name), chunk_size=2), 3)
+        install_store({}, {}, 100.0)
+        counts = gamestore.import_inventory(self.path(name), mode='replace', chunk_size=2)
+        self.assertEqual(counts, {'added': 3, 'merged': 0, 'replaced': 0, 'bad': 0})
+        self.assertEqual(snapshot(), before)
+
+    def test_csv_round_trip(self):
+        self.check_round_trip('stock.csv')
+
+    def test_jsonl_round_trip(self):
+        self.check_round_trip('stock.jsonl')
+
+    def test_upsert_adds_stock_and_averages_cost(self):
+        path = self.write('more.jsonl',
+                          '{"name": "Gura Plushie", "price": 99.0, "stock": 6, "cost": 17.0}\n'
+                          '\n'
+                          '{"name": "Chibi Keychain", "price": 4.0, "stock": 10, "cost": 1.5}\n')
+        counts = gamestore.import_inventory(path)
+        self.assertEqual(counts, {'added': 1, 'merged': 1, 'replaced': 0, 'bad': 0})
+        plushie = gamestore.inventory['Gura Plushie']
+        self.assertEqual(plushie['stock'], 10)
+        self.assertAlmostEqual(plushie['cost'], 15.0)
+        self.assertEqual(plushie['price'], 30.0)
+        self.assertEqual(plushie['provider'], 'KawaiiGoods')
+        self.assertEqual(gamestore.inventory['Chibi Keychain'],
+                         {'price': 4.0, 'stock': 10, 'cost': 1.5})
+        self.assertEqual(gamestore.store_money, 100.0)
+
+    def test_replace_overwrites_existing_items(self):
+        path = self.write('fix.csv', "name,price,stock,cost,provider\n"
+                                     "Gura Plushie,28.0,2,11.0,\n")
+        counts = gamestore.import_inventory(path, mode='replace')
+        self.assertEqual(counts, {'added': 0, 'merged': 0, 'replaced': 1, 'bad': 0})
+        self.assertEqual(gamestore.inventory['Gura Plushie'], {'price': 28.0, 'stock': 2, 'cost': 11.0})
+
+    def test_malformed_rows_are_counted_and_skipped(self):
+        path = self.write('mixed.csv', "name,price,stock,cost,provider\n"
+                                       "Gura Plushie,30.0,lots,12.0,\n"
+                                       ",5.0,1,1.0,\n"
+                                       "Pixel Poster,-1,3,1.0,\n"
+                                       "Pixel Poster,8.5,3,-2,\n"
+                                       "Chibi Keychain,4.0,10,,\n")
+        before = snapshot()
+        counts = gamestore.import_inventory(path)
+        self.assertEqual(counts, {'added': 1, 'merged': 0, 'replaced': 0, 'bad': 4})
+        self.assertEqual(gamestore.inventory.pop('Chibi Keychain'), {'price': 4.0, 'stock': 10, 'cost': 0.0})
+        self.assertEqual(snapshot(), before)
+
+    def test_missing_fields_are_bad_rows(self):
+        path = self.write('short.jsonl', '{"name": "Gura Plushie", "stock": 1}\n'
+                                         '{"price": 1.0, "stock": 1}\n'
+                                         '["not", "a", "record"]\n')
+        before = snapshot()
+        self.assertEqual(gamestore.import_inventory(path)['bad'], 3)
+        self.assertEqual(snapshot(), before)
+
+    def test_unknown_mode_is_refused(self):
+        with self.assertRaises(ValueError):
+            gamestore.import_inventory(self.path('stock.csv'), mode='merge')
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(gamestore, 'metrics', gamestore.Metrics())
+        self.metrics = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.metrics.enabled = True
+
+    def test_errors_go_to_the_op_of_their_own_thread(self):
+        started, done = threading.Event(), threading.Event()
+
+        def feed():
+            started.set()
+            done.wait(5)
+
+        thread = threading.Thread(target=gamestore.instrumented("refresh_provider_feeds")(feed))
+        thread.start()
+        started.wait(5)
+
+        @gamestore.instrumented("menu.modify_item")
+        def modify():
+            gamestore.record_error(ValueError("bad price"))
+
+        modify()
+        done.set()
+        thread.join()
+        self.assertEqual(self.metrics.errors, {('menu.modify_item', 'ValueError'): 1})
+        self.assertEqual(self.metrics.calls, {'refresh_provider_feeds': 1, 'menu.modify_item': 1})
+
+    def test_counts_from_many_threads(self):
+        op = gamestore.instrumented("value")(lambda: None)
+
+        def run():
+            for _ in range(2000):
+                op()
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.metrics.calls['value'], 16000)
+        self.assertEqual(self.metrics.snapshot()['latency']['value']['count'], 16000)
+
+    def test_stepped_commands_are_counted_per_op(self):
+        install_store({'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.5}}, {}, 100.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        reply = gamestore.run_steps(gamestore.command_reply_steps(
+            '{"op": "modify", "name": "Nope", "price": 1}', gamestore._timed_command_steps))
+        self.assertFalse(reply['ok'])
+        self.assertEqual(self.metrics.calls, {'command.modify': 1})
+        self.assertEqual(list(self.metrics.errors), [('command.modify', 'KeyError')])
+
+    def test_purchases_count_once_committed(self):
+        install_store({}, {'RetroHub': {'Pixel Poster': {'cost': 2.0, 'available': 9},
+                                        'Game Boy': {'cost': 40.0, 'available': 2}}}, 100.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        add_item = gamestore.add_inventory_item
+
+        def add_inventory_item(name, details):
+            if name == 'Game Boy':
+                raise OSError("disk full")
+            return add_item(name, details)
+
+        with mock.patch.object(gamestore, 'add_inventory_item', add_inventory_item), self.assertRaises(OSError):
+            gamestore.bulk_purchase([('RetroHub', 'Pixel Poster', 4), ('RetroHub', 'Game Boy', 1)])
+        self.assertEqual((self.metrics.business['units_bought'], self.metrics.business['purchase_cost']), (0, 0))
+        gamestore.bulk_purchase([('RetroHub', 'Pixel Poster', 4)])
+        self.assertEqual((self.metrics.business['units_bought'], self.metrics.business['purchase_cost']), (4, 8.0))
+
+
+class PagingTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store({f"Item {i:02d}": {'price': 1.0 + i, 'stock': 3, 'cost': 0.5} for i in range(30)}, {}, 0.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def blocks(self):
+        return (gamestore.format_item(name, details) for name, details in gamestore.inventory.items())
+
+    def page(self, answer):
+        """Run show_paged from a menu action; `answer` handles every prompt."""
+        out = []
+        with mock.patch('builtins.input', answer), mock.patch('sys.stdout.write', out.append), \
+                mock.patch('builtins.print', lambda *args, **kwargs: out.append(" ".join(map(str, args)))):
+            with gamestore.menu_action():
+                gamestore.show_paged("Inventory", self.blocks(), page_lines=40)
+        return "".join(out)
+
+    def test_lock_is_free_while_the_page_prompt_waits(self):
+        free = []
+
+        def take_lock():
+            got = gamestore.state_lock.acquire(timeout=1)
+            if got:
+                gamestore.state_lock.release()
+            free.append(got)
+
+        def answer(prompt=''):
+            thread = threading.Thread(target=take_lock)
+            thread.start()
+            thread.join()
+            return ''
+
+        text = self.page(answer)
+        self.assertTrue(free)
+        self.assertTrue(all(free))
+        self.assertIn("Item 29", text)
+
+    def test_report_screens_are_one_write(self):
+        for report in (gamestore.calculate_inventory_value, gamestore.find_most_expensive,
+                       gamestore.show_store_money, gamestore.low_stock_menu):
+            with self.subTest(report=report.__name__):
+                writes = []
+                with mock.patch('builtins.input', return_value=''), mock.patch('sys.stdout.write', writes.append), \
+                        mock.patch('builtins.print', side_effect=AssertionError("printed line by line")):
+                    report()
+                self.assertEqual(len(writes), 1)
+                self.assertIn(gamestore.BOX_BOTTOM, writes[0])
+
+    def test_listing_stops_when_items_are_removed_meanwhile(self):
+        def answer(prompt=''):
+            if prompt.startswith('Press Enter for the next page'):
+                gamestore.delete_inventory_item('Item 29')
+            return ''
+
+        text = self.page(answer)
+        self.assertIn("store changed while paging", text)
+
+
+class ColumnarInventoryTest(unittest.TestCase):
+
+    ITEMS = {f"Item {i}": {'price': 2.5 * i + 1, 'stock': i % 4, 'cost': 0.5 * i,
+                           **({'provider': f"Provider {i % 3}"} if i % 2 else {})}
+             for i in range(7)}
+
+    def check_deletes(self):
+        table = gamestore.ColumnarInventory(self.ITEMS.items())
+        expected = {name: dict(details) for name, details in self.ITEMS.items()}
+        for name in ('Item 2', 'Item 0', 'Item 4'):  # middle, first, then the row moved into a hole
+            del table[name]
+            del expected[name]
+            self.assertEqual({name: dict(row) for name, row in table.items()}, expected)
+            self.assertEqual(table.scan_totals(), gamestore.scan_inventory_totals(expected))
+        self.assertNotIn('Item 2', table)
+        with self.assertRaises(KeyError):
+            table['Item 2']
+        table['Item 6']['stock'] = 9
+        table['Item 7'] = {'price': 4.0, 'stock': 2, 'cost': 1.0}
+        expected['Item 6']['stock'] = 9
+        expected['Item 7'] = {'price': 4.0, 'stock': 2, 'cost': 1.0}
+        self.assertEqual({name: dict(row) for name, row in table.items()}, expected)
+        self.assertEqual(table.scan_totals(), gamestore.scan_inventory_totals(expected))
+
+    @unittest.skipIf(gamestore.np is None, "NumPy is not installed")
+    def test_deleting_rows_with_numpy(self):
+        self.check_deletes()
+
+    def test_deleting_rows_with_arrays(self):
+        with mock.patch.object(gamestore, 'np', None):
+            self.check_deletes()
+
+
+class InventoryTotalsTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store({'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.5},
+                       'Pixel Poster': {'price': 9.0, 'stock': 10, 'cost': 3.0},
+                       'Old Cartridge': {'price': 15.0, 'stock': 2}}, {}, 0.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def test_running_totals_follow_changes(self):
+        gamestore.update_item('Pixel Poster', stock=7, price=10.0)
+        gamestore.delete_inventory_item('Old Cartridge')
+        gamestore.add_inventory_item('Game Boy', {'price': 90.0, 'stock': 1, 'cost': 40.0})
+        self.assertEqual(gamestore.inventory_totals.totals(), gamestore.scan_inventory_totals())
+        self.assertEqual(gamestore.verify_inventory_totals(), {})
+
+    def test_verify_reports_drift_and_rebuilds(self):
+        totals = gamestore.inventory_totals.totals()
+        self.assertEqual((totals['value'], totals['cost'], totals['count']), (240.0, 80.0, 3))
+        # A change that bypassed update_item, and a corrupted running sum
+        gamestore.inventory['Pixel Poster']['stock'] = 11
+        gamestore.inventory_totals._totals['price_sum'] += 100.0
+        drift = gamestore.inventory_totals.verify(rebuild=False)
+        self.assertEqual(drift, {'value': (240.0, 249.0), 'cost': (80.0, 83.0),
+                                 'price_sum': (154.0, 54.0), 'stock_sum': (16, 17)})
+        self.assertEqual(gamestore.verify_inventory_totals(), drift)
+        self.assertEqual(gamestore.inventory_totals.totals(), gamestore.scan_inventory_totals())
+        self.assertEqual(gamestore.verify_inventory_totals(), {})
+
+
+class PriceIndexTest(unittest.TestCase):
+
+    def make_store(self):
+        install_store({f"Item {i:03d}": {'price': float(i * 37 % 101), 'stock': i % 5, 'cost': 1.0}
+                       for i in range(200)}, {}, 0.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def change_store(self):
+        gamestore.update_item('Item 005', price=500.0)
+        gamestore.update_item('Item 006', price=0.5)
+        gamestore.delete_inventory_item('Item 010')
+        gamestore.add_inventory_item('Item 999', {'price': 42.0, 'stock': 1, 'cost': 1.0})
+
+    def queries(self):
+        index = gamestore.price_index
+        return index.most_expensive(5), index.cheapest(5), index.in_range(40, 45)
+
+    def expected(self):
+        keys = sorted((details['price'], name) for name, details in gamestore.inventory.items())
+        names = [name for _, name in keys]
+        return names[:-6:-1], names[:5], [name for price, name in keys if 40 <= price <= 45]
+
+    def check(self, columnar):
+        self.make_store()
+        if columnar:
+            gamestore.use_columnar_inventory()
+        self.assertEqual(self.queries(), self.expected())
+        self.change_store()
+        self.assertEqual(self.queries(), self.expected())
+        self.assertEqual(gamestore.price_index.most_expensive(1), ['Item 005'])
+
+    def test_dict_inventory(self):
+        self.check(columnar=False)
+
+    def test_columnar_inventory(self):
+        self.check(columnar=True)
+
+    def test_columnar_inventory_keeps_its_sorted_index(self):
+        self.make_store()
+        gamestore.use_columnar_inventory()
+        gamestore.price_index.cheapest(1)
+        self.change_store()
+        with mock.patch.object(gamestore.ColumnarInventory, 'columns', side_effect=AssertionError("scanned")):
+            self.assertEqual(self.queries(), self.expected())
+
+    def test_changes_across_many_buckets(self):
+        self.make_store()
+        with mock.patch.object(gamestore, 'SORTED_BUCKET_SIZE', 4):
+            gamestore.price_index.invalidate()
+            self.assertEqual(self.queries(), self.expected())
+            for i in range(300):
+                gamestore.add_inventory_item(f"Bulk Item {i:03d}", {'price': float(i % 60), 'stock': 1, 'cost': 1.0})
+            for i in range(0, 300, 3):
+                gamestore.update_item(f"Bulk Item {i:03d}", price=45.0)
+            self.change_store()
+            self.assertGreater(len(gamestore.price_index._keys._buckets), 50)
+            self.assertEqual(len(gamestore.price_index._keys), len(gamestore.inventory))
+            self.assertEqual(self.queries(), self.expected())
+            self.assertEqual(gamestore.price_index.in_range(45, 45)[:2], ['Bulk Item 000', 'Bulk Item 003'])
+            self.assertEqual(gamestore.price_index.most_expensive(0), [])
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        names = ['Megumin Figure - GSC Exclusive', 'Megaman Cartridge', 'Gawr Gura Plushie (Small)',
+                 'Pikachu Cushion', 'Pro Controller - Carbon']
+        install_store({name: {'price': 10.0, 'stock': 1, 'cost': 5.0} for name in names},
+                      {'RetroHub': {'Megaman Cartridge': {'cost': 3.0, 'available': 2}},
+                       'GoodSmileCo': {'Megaman Cartridge': {'cost': 4.0, 'available': 1}}}, 0.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        self.index = gamestore.inventory_names
+
+    def test_prefix_matches(self):
+        self.assertEqual(self.index.search('meg'), ['Megaman Cartridge', 'Megumin Figure - GSC Exclusive'])
+        self.assertEqual(self.index.search('megumin fig'), ['Megumin Figure - GSC Exclusive'])
+        self.assertEqual(self.index.search('fig gsc')[0], 'Megumin Figure - GSC Exclusive')
+        self.assertEqual(self.index.search('pro car')[0], 'Pro Controller - Carbon')
+
+    def test_typo_matches(self):
+        self.assertEqual(self.index.search('megumni figre')[0], 'Megumin Figure - GSC Exclusive')
+        self.assertEqual(self.index.search('pikachu cushon')[0], 'Pikachu Cushion')
+        self.assertEqual(self.index.search('zzzz'), [])
+
+    def test_follows_adds_and_removes(self):
+        self.index.search('meg')  # built now, changes are applied incrementally
+        gamestore.add_inventory_item('Megumin Mug', {'price': 8.0, 'stock': 3, 'cost': 2.0})
+        gamestore.delete_inventory_item('Megaman Cartridge')
+        self.assertEqual(self.index.search('meg'), ['Megumin Figure - GSC Exclusive', 'Megumin Mug'])
+        self.assertNotIn('Megaman Cartridge', self.index)
+        self.assertIn('Megumin Mug', self.index)
+
+    def test_offer_names_last_while_any_provider_offers_them(self):
+        offers = gamestore.offer_names
+        self.assertEqual(offers.search('mega'), ['Megaman Cartridge'])
+        gamestore.remove_offer('RetroHub', 'Megaman Cartridge')
+        self.assertIn('Megaman Cartridge', offers)
+        gamestore.remove_offer('GoodSmileCo', 'Megaman Cartridge')
+        self.assertNotIn('Megaman Cartridge', offers)
+
+    def test_many_names_across_buckets(self):
+        with mock.patch.object(gamestore, 'NAME_BUCKET_SIZE', 4):
+            self.index.invalidate()
+            self.index.search('x')
+            for i in range(200):
+                gamestore.add_inventory_item(f"Bulk Item {i:03d}", {'price': 1.0, 'stock': 1, 'cost': 1.0})
+            for i in range(0, 200, 2):
+                gamestore.delete_inventory_item(f"Bulk Item {i:03d}")
+            self.assertGreater(len(self.index._words._buckets), 10)
+            self.assertEqual(self.index.prefix_matches('bulk item 1', 100),
+                             [f"Bulk Item {i:03d}" for i in range(101, 200, 2)])
+            self.assertEqual(self.index.prefix_matches('bulk 05'), ['Bulk Item 051', 'Bulk Item 053',
+                                                                    'Bulk Item 055', 'Bulk Item 057',
+                                                                    'Bulk Item 059'])
+
+
+class LedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'store.ledger')
+        self.directory = directory
+        install_store(
+            {'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.5, 'provider': 'KawaiiGoods'}},
+            {'KawaiiGoods': {'Gura Plushie': {'cost': 11.0, 'available': 50}},
+             'RetroHub': {'Pixel Poster': {'cost': 3.1, 'available': 9},
+                          'Broken Widget': {'cost': 1.0, 'available': 5}}},
+            1000.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        self.addCleanup(gamestore.close_ledger)
+
+    def change_store(self):
+        gamestore.bulk_purchase([('RetroHub', 'Pixel Poster', 4), ('KawaiiGoods', 'Gura Plushie', 2)])
+        gamestore.update_item('Pixel Poster', price=7.5)
+        gamestore.delete_inventory_item('Gura Plushie')
+        gamestore.set_offer('RetroHub', 'Game Boy', 40.0, 2)
+
+    def reopen(self, **options):
+        """Close the ledger, forget the store and rebuild it from the ledger."""
+        gamestore.close_ledger()
+        install_store({}, {}, 0.0)
+        gamestore.open_ledger(self.path, **options)
+
+    def test_reopen_replays_the_changes(self):
+        gamestore.open_ledger(self.path)
+        self.change_store()
+        after = snapshot()
+        self.reopen()
+        self.assertEqual(snapshot(), after)
+
+    def test_replay_starts_from_the_latest_snapshot(self):
+        gamestore.open_ledger(self.path, snapshot_every=3, group_size=1)
+        self.change_store()
+        after = snapshot()
+        end = gamestore.replay_ledger(self.path, self.path + ".snapshot")[3]
+        self.assertEqual(end, os.path.getsize(self.path))
+        self.reopen()
+        self.assertEqual(snapshot(), after)
+
+    def test_half_written_event_is_dropped_on_reopen(self):
+        gamestore.open_ledger(self.path)
+        self.change_store()
+        after = snapshot()
+        gamestore.close_ledger()
+        with open(self.path, 'ab') as f:
+            f.write(b'{"t":"cash","delta":-5,"bala')
+        self.reopen()
+        self.assertEqual(snapshot(), after)
+        with open(self.path, 'rb') as f:
+            self.assertTrue(f.read().endswith(b"\n"))
+
+    def test_rolled_back_order_leaves_no_events(self):
+        store = gamestore.open_storage(os.path.join(self.directory, 'store.db'))
+        self.addCleanup(store.conn.close)
+        gamestore.open_ledger(self.path)
+        before = snapshot()
+        add_item = gamestore.add_inventory_item
+
+        def add_inventory_item(name, details):
+            if name == 'Broken Widget':
+                raise OSError("disk full")
+            return add_item(name, details)
+
+        with mock.patch.object(gamestore, 'add_inventory_item', add_inventory_item):
+            with self.assertRaises(OSError):
+                gamestore.bulk_purchase([('RetroHub', 'Pixel Poster', 4), ('RetroHub', 'Broken Widget', 1)])
+        gamestore.flush_ledger()
+        items, catalogs, money, _ = gamestore.replay_ledger(self.path, self.path + ".snapshot")
+        self.assertEqual((items, catalogs, money), before)
+
+    def test_rollback_writes_no_snapshot(self):
+        store = gamestore.open_storage(os.path.join(self.directory, 'store.db'))
+        self.addCleanup(store.conn.close)
+        ledger = gamestore.open_ledger(self.path)
+        with mock.patch.object(ledger, 'snapshot') as snapshot_state:
+            with self.assertRaises(ValueError):
+                with gamestore.storage_transaction():
+                    gamestore.update_item('Gura Plushie', stock=1)
+                    raise ValueError("cancelled")
+        snapshot_state.assert_not_called()
+        self.assertEqual(gamestore.inventory['Gura Plushie']['stock'], 4)
+
+    def test_snapshot_is_streamed_from_the_database(self):
+        store = gamestore.open_storage(os.path.join(self.directory, 'store.db'))
+        self.addCleanup(store.conn.close)
+        before = snapshot()
+        gamestore.open_ledger(self.path)
+        with open(self.path + ".snapshot", encoding='utf-8') as f:
+            state = json.load(f)
+        self.assertEqual((state['inventory'], state['providers'], state['store_money']), before)
+        gamestore.close_ledger()
+        with mock.patch.object(gamestore, 'replay_ledger') as replay:
+            gamestore.open_ledger(self.path)
+        replay.assert_not_called()
+        self.assertEqual(snapshot(), before)
+
+
+class HeadlessTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store({'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.5, 'provider': 'KawaiiGoods'}},
+                      {'RetroHub': {'Pixel Poster': {'cost': 3.0, 'available': 9}}}, 100.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def run_script(self, *lines):
+        out = io.StringIO()
+        failures = gamestore.run_headless(lines, out)
+        return failures, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_script_of_commands(self):
+        failures, replies = self.run_script(
+            '{"op": "value", "id": 1}',
+            '',
+            '{"op": "sell", "name": "Gura Plushie", "qty": 1}',
+            '{"op": "buy", "provider": "RetroHub", "item": "Pixel Poster", "qty": 2}',
+            '{"op": "cheapest", "k": 1}',
+            '{"op": "balance"}')
+        self.assertEqual(failures, 0)
+        self.assertEqual([reply['op'] for reply in replies], ['value', 'sell', 'buy', 'cheapest', 'balance'])
+        self.assertEqual(replies[0]['id'], 1)
+        self.assertEqual(replies[0]['result'], {'total_value': 120.0, 'total_cost': 50.0, 'potential_profit': 70.0})
+        self.assertEqual((replies[1]['result']['stock'], replies[1]['result']['revenue']), (3, 30.0))
+        self.assertEqual(replies[2]['result']['new_items'], ['Pixel Poster'])
+        self.assertEqual([item['name'] for item in replies[3]['result']], ['Pixel Poster'])
+        self.assertEqual(gamestore.store_money, 100.0 + 30.0 - 12.5 - 6.0)
+
+    def test_bad_commands_fail_alone(self):
+        before = snapshot()
+        failures, replies = self.run_script(
+            '{"op": "fly", "id": "a"}',
+            'not json',
+            '[1, 2]',
+            '{"op": "modify", "name": "Gura Plushie", "price": "abc"}',
+            '{"op": "modify", "name": "Nope", "price": 1}',
+            '{"op": "buy", "provider": "RetroHub", "item": "Pixel Poster", "qty": -1}',
+            '{"op": "cheapest", "k": true}',
+            '{"op": "buy", "provider": "RetroHub", "item": "Pixel Poster", "qty": 50}')
+        self.assertEqual(failures, 8)
+        self.assertFalse(any(reply['ok'] for reply in replies))
+        self.assertEqual([reply['type'] for reply in replies],
+                         ['ValueError', 'JSONDecodeError', 'ValueError', 'ValueError', 'KeyError',
+                          'ValueError', 'ValueError', 'PurchaseError'])
+        self.assertEqual((replies[0]['op'], replies[0]['id']), ('fly', 'a'))
+        self.assertIn("Unknown op", replies[0]['error'])
+        self.assertIn("'price' must be a number", replies[3]['error'])
+        self.assertTrue(replies[7]['problems'])
+        self.assertEqual(snapshot(), before)
+
+    def test_every_op_is_in_the_table(self):
+        self.assertLessEqual(gamestore.READ_COMMANDS, set(gamestore.COMMANDS))
+        self.assertLessEqual(set(gamestore.STEPPED_COMMANDS), set(gamestore.COMMANDS))
+
+
+class ServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store({'Gura Keychain': {'price': 5.0, 'stock': 30, 'cost': 2.0, 'provider': 'KawaiiGoods'},
+                       'Pixel Poster': {'price': 9.0, 'stock': 50, 'cost': 3.0, 'provider': 'RetroHub'}},
+                      {}, 100.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        patcher = mock.patch.object(gamestore, 'sales_history', gamestore.SalesHistory())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, *clients):
+        """Run each client(send) against one service at the same time; returns their results."""
+        async def run():
+            server = await gamestore.start_service('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+
+            async def connect(client):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+                async def send(command):
+                    writer.write(json.dumps(command).encode('utf-8') + b"\n")
+                    await writer.drain()
+                    return json.loads(await reader.readline())
+
+                try:
+                    return await client(send)
+                finally:
+                    writer.close()
+
+            try:
+                return await asyncio.gather(*(connect(client) for client in clients))
+            finally:
+                server.flusher.cancel()
+                server.close()
+                await server.wait_closed()
+
+        return asyncio.run(run())
+
+    def test_concurrent_sales_never_oversell(self):
+        async def seller(send):
+            return [await send({'op': 'sell', 'name': 'Gura Keychain', 'qty': 1}) for _ in range(5)]
+
+        replies = [reply for replies in self.serve(*[seller] * 10) for reply in replies]
+        self.assertEqual(sum(reply['ok'] for reply in replies), 30)
+        self.assertEqual(gamestore.inventory['Gura Keychain']['stock'], 0)
+        self.assertAlmostEqual(gamestore.store_money, 100.0 + 30 * 3.0)
+        self.assertEqual(gamestore.inventory_totals.verify(), {})
+
+    def test_stale_version_is_rejected(self):
+        async def client(send):
+            records = (await send({'op': 'inventory'}))['result']
+            version = next(record['version'] for record in records if record['name'] == 'Pixel Poster')
+            first = await send({'op': 'modify', 'name': 'Pixel Poster', 'price': 10.0, 'version': version})
+            second = await send({'op': 'modify', 'name': 'Pixel Poster', 'price': 11.0, 'version': version})
+            return first, second
+
+        (first, second), = self.serve(client)
+        self.assertTrue(first['ok'])
+        self.assertEqual(second['type'], 'VersionConflict')
+        self.assertEqual(second['version'], first['result']['version'])
+        self.assertEqual(gamestore.inventory['Pixel Poster']['price'], 10.0)
+
+    def test_reports_are_answered_during_a_long_simulation(self):
+        order = []
+
+        async def simulator(send):
+            reply = await send({'op': 'simulate', 'days': 200})
+            order.append('simulate')
+            return reply
+
+        async def reporter(send):
+            await asyncio.sleep(0)
+            reply = await send({'op': 'value'})
+            order.append('value')
+            return reply
+
+        simulated, value = self.serve(simulator, reporter)
+        self.assertTrue(simulated['ok'])
+        self.assertEqual(len(simulated['result']), 200)
+        self.assertTrue(value['ok'])
+        self.assertEqual(order, ['value', 'simulate'])
+
+
+class StoreFleetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        install_store({}, {'RetroHub': {'Pixel Poster': {'cost': 1.0, 'available': 25},
+                                        'Game Boy': {'cost': 40.0, 'available': 100}}}, 1000.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def command_file(self, number, commands):
+        path = os.path.join(self.directory, f"store{number}.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(command) + "\n" for command in commands)
+        return path
+
+    def test_stores_never_oversell_shared_stock(self):
+        buy = {'op': 'buy', 'provider': 'RetroHub', 'item': 'Pixel Poster', 'qty': 1}
+        paths = [self.command_file(i, [buy] * 10) for i in range(4)]
+        summaries = gamestore.run_store_fleet(paths)
+        self.assertEqual(sum(summary['stock'] for summary in summaries), 25)
+        self.assertEqual(sum(summary['failures'] for summary in summaries), 15)
+        for summary in summaries:
+            self.assertAlmostEqual(summary['store_money'], 1000.0 - summary['stock'] * 1.0)
+            with open(summary['results'], encoding='utf-8') as f:
+                replies = [json.loads(line) for line in f]
+            refused = [reply for reply in replies if not reply['ok']]
+            self.assertTrue(all(reply['type'] == 'PurchaseError' for reply in refused))
+        self.assertEqual(gamestore.providers['RetroHub']['Pixel Poster']['available'], 0)
+        self.assertEqual(gamestore.providers['RetroHub']['Game Boy']['available'], 100)
+
+
+class UndoTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store(
+            {'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.5, 'provider': 'KawaiiGoods'}},
+            {'RetroHub': {'Pixel Poster': {'cost': 3.1, 'available': 9}}},
+            1000.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        self.journal = gamestore.undo_journal
+
+    def test_undo_and_redo_a_group(self):
+        before = snapshot()
+        with self.journal.operation("buy"):
+            gamestore.bulk_purchase([('RetroHub', 'Pixel Poster', 3)])
+            gamestore.update_item('Gura Plushie', price=25.0)
+        after = snapshot()
+        self.assertEqual(self.journal.undo(), "buy")
+        self.assertEqual(snapshot(), before)
+        self.assertEqual(self.journal.redo(), "buy")
+        self.assertEqual(snapshot(), after)
+        self.assertIsNone(self.journal.redo())
+
+    def test_undo_gives_money_back_as_a_difference(self):
+        with self.journal.operation("buy"):
+            gamestore.bulk_purchase([('RetroHub', 'Pixel Poster', 3)])
+        gamestore.adjust_store_money(50.0, "sale made meanwhile")
+        self.journal.undo()
+        self.assertAlmostEqual(gamestore.store_money, 1050.0)
+
+    def test_refuses_to_undo_over_a_later_change(self):
+        with self.journal.operation("reprice"):
+            gamestore.update_item('Gura Plushie', price=25.0)
+        gamestore.update_item('Gura Plushie', price=20.0)  # not journaled
+        with self.assertRaises(ValueError):
+            self.journal.undo()
+        self.assertEqual(gamestore.inventory['Gura Plushie']['price'], 20.0)
+
+    def test_changes_of_a_failed_operation_can_be_undone(self):
+        with self.assertRaises(RuntimeError):
+            with self.journal.operation("half done"):
+                gamestore.update_item('Gura Plushie', price=25.0)
+                raise RuntimeError("crash")
+        self.assertEqual(self.journal.undo(), "half done")
+        self.assertEqual(gamestore.inventory['Gura Plushie']['price'], 30.0)
+
+    def test_oversized_group_ends_the_history(self):
+        with self.journal.operation("reprice"):
+            gamestore.update_item('Gura Plushie', price=25.0)
+        with mock.patch.object(self.journal, 'max_changes', 2):
+            with self.journal.operation("big import"):
+                for i in range(3):
+                    gamestore.add_inventory_item(f"Item {i}", {'price': 1.0, 'stock': 1, 'cost': 1.0})
+        self.assertIsNone(self.journal.undo())
+
+    def test_rolled_back_purchase_keeps_the_history(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        store = gamestore.open_storage(os.path.join(directory, 'store.db'))
+        self.addCleanup(store.conn.close)
+        branch = gamestore.Branch()
+        with self.journal.operation("reprice"):
+            gamestore.update_item('Gura Plushie', price=25.0)
+        with self.journal.operation("failed buy"):
+            gamestore.update_item('Gura Plushie', stock=6)
+            with mock.patch.object(gamestore, 'add_inventory_item', side_effect=OSError("disk full")), \
+                    self.assertRaises(OSError):
+                gamestore.bulk_purchase([('RetroHub', 'Pixel Poster', 3)])
+        self.assertFalse(branch.stale)
+        self.assertEqual(self.journal.undo(), "failed buy")
+        self.assertEqual(gamestore.inventory['Gura Plushie']['stock'], 4)
+        self.assertEqual(self.journal.undo(), "reprice")
+        self.assertEqual(gamestore.inventory['Gura Plushie']['price'], 30.0)
+        self.assertEqual(gamestore.providers['RetroHub']['Pixel Poster']['available'], 9)
+        self.assertAlmostEqual(gamestore.store_money, 1000.0)
+
+
+class BranchTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store(
+            {'Gura Plushie': {'price': 30.0, 'stock': 4, 'cost': 12.5, 'provider': 'KawaiiGoods'},
+             'Pixel Poster': {'price': 9.0, 'stock': 10, 'cost': 3.1, 'provider': 'RetroHub'}},
+            {'KawaiiGoods': {'Gura Plushie': {'cost': 11.0, 'available': 50}},
+             'RetroHub': {'Pixel Poster': {'cost': 3.1, 'available': 9}}},
+            1000.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def test_branch_does_not_touch_the_store(self):
+        before = snapshot()
+        branch = gamestore.Branch()
+        with branch:
+            gamestore.update_item('Gura Plushie', stock=1)
+            gamestore.apply_purchase('RetroHub', 'Pixel Poster', 2)
+            self.assertEqual(gamestore.inventory['Pixel Poster']['stock'], 12)
+        self.assertEqual(snapshot(), before)
+
+    def test_branch_keeps_seeing_the_store_as_it_was(self):
+        branch = gamestore.Branch()
+        gamestore.update_item('Gura Plushie', price=35.0)
+        gamestore.delete_inventory_item('Pixel Poster')
+        with branch:
+            self.assertEqual(gamestore.inventory['Gura Plushie']['price'], 30.0)
+            self.assertIn('Pixel Poster', gamestore.inventory)
+            self.assertEqual(gamestore.price_index.most_expensive(1), ['Gura Plushie'])
+            self.assertAlmostEqual(gamestore.inventory_totals.totals()['value'], 30.0 * 4 + 9.0 * 10)
+        self.assertEqual(gamestore.inventory_totals.totals()['value'], 35.0 * 4)
+
+    def test_branch_uses_its_own_indexes(self):
+        main = gamestore.price_index
+        self.assertEqual(main.cheapest(1), ['Pixel Poster'])
+        keys = main._keys
+        branch = gamestore.Branch()
+        for price in (1.0, 2.0):
+            with branch:
+                self.assertIsNot(gamestore.price_index, main)
+                self.assertIn(gamestore.price_index, gamestore._inventory_indexes)
+                self.assertNotIn(main, gamestore._inventory_indexes)
+                gamestore.update_item('Gura Plushie', price=price)
+                self.assertEqual(gamestore.price_index.cheapest(1), ['Gura Plushie'])
+        self.assertIs(gamestore.price_index, main)
+        self.assertIs(main._keys, keys)
+        self.assertEqual(main.cheapest(1), ['Pixel Poster'])
+
+    def test_apply_keeps_main_store_changes(self):
+        branch = gamestore.Branch()
+        with branch:
+            gamestore.apply_purchase('RetroHub', 'Pixel Poster', 2)
+        # Made after the branch, on items and offers the branch didn't change
+        gamestore.update_item('Gura Plushie', price=35.0)
+        gamestore.update_offer('KawaiiGoods', 'Gura Plushie', cost=13.0, available=40)
+        gamestore.adjust_store_money(-100.0, "rent")
+        branch.apply()
+        self.assertEqual(gamestore.inventory['Gura Plushie']['price'], 35.0)
+        self.assertEqual(gamestore.providers['KawaiiGoods']['Gura Plushie'], {'cost': 13.0, 'available': 40})
+        self.assertEqual(gamestore.inventory['Pixel Poster']['stock'], 12)
+        self.assertEqual(gamestore.providers['RetroHub']['Pixel Poster']['available'], 7)
+        self.assertAlmostEqual(gamestore.store_money, 1000.0 - 100.0 - 2 * 3.1)
+        gamestore.invalidate_inventory_indexes()
+        self.assertEqual(gamestore.inventory_totals.verify(), {})
+
+    def test_apply_refuses_conflicting_changes(self):
+        branch = gamestore.Branch()
+        with branch:
+            gamestore.apply_purchase('RetroHub', 'Pixel Poster', 2)
+        gamestore.update_offer('RetroHub', 'Pixel Poster', cost=4.0)
+        before = snapshot()
+        with self.assertRaises(ValueError):
+            branch.apply()
+        self.assertEqual(snapshot(), before)
+
+    def test_apply_is_undoable(self):
+        before = snapshot()
+        branch = gamestore.Branch()
+        with branch:
+            gamestore.update_item('Gura Plushie', stock=1)
+            gamestore.adjust_store_money(50.0, "sale")
+        branch.apply()
+        self.assertEqual(gamestore.store_money, 1050.0)
+        self.assertEqual(gamestore.undo_journal.undo(), "apply what-if branch")
+        self.assertEqual(snapshot(), before)
+
+
+class PriceSketchTest(unittest.TestCase):
+
+    def exact(self, values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def test_quantiles_within_accuracy(self):
+        rng = random.Random(7)
+        values = [round(rng.lognormvariate(3, 1.2), 2) for _ in range(5000)]
+        sketch = gamestore.QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        for q in (0.1, 0.5, 0.9, 0.99):
+            with self.subTest(q=q):
+                self.assertLessEqual(abs(sketch.quantile(q) - self.exact(values, q)),
+                                     gamestore.PRICE_SKETCH_ACCURACY * self.exact(values, q) + 1e-9)
+
+    def test_removal_and_merge_are_exact(self):
+        kept, removed = [1.0, 5.5, 12.0, 99.99, 0.0], [7.0, 250.0, 5.5]
+        sketch = gamestore.QuantileSketch()
+        for value in kept + removed:
+            sketch.add(value)
+        for value in removed:
+            sketch.remove(value)
+        expected = gamestore.QuantileSketch()
+        for value in kept:
+            expected.add(value)
+        self.assertEqual((sketch._counts, sketch.zeros, sketch.total),
+                         (expected._counts, expected.zeros, expected.total))
+        merged = gamestore.QuantileSketch().merge(sketch).merge(expected)
+        self.assertEqual(merged.total, 2 * len(kept))
+        self.assertEqual(merged.quantile(0.5), expected.quantile(0.5))
+        self.assertIsNone(gamestore.QuantileSketch().quantile(0.5))
+
+    def test_price_stats_follow_item_changes(self):
+        install_store({f"Item {i}": {'price': 2.0 + i * 3, 'stock': i % 4, 'cost': 1.0, 'provider': f"P{i % 3}"}
+                       for i in range(100)}, {}, 0.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        stats = gamestore.price_stats
+        stats.overall()
+        gamestore.update_item('Item 3', price=400.0, stock=9)
+        gamestore.delete_inventory_item('Item 4')
+        gamestore.add_inventory_item('Item X', {'price': 1.0, 'stock': 2, 'cost': 0.5, 'provider': 'P9'})
+        running = (stats.overall(), {name: stats.provider(name) for name in ('P0', 'P1', 'P2', 'P9')})
+        stats.invalidate()
+        rebuilt = (stats.overall(), {name: stats.provider(name) for name in ('P0', 'P1', 'P2', 'P9')})
+        self.assertEqual(running, rebuilt)
+        self.assertEqual(sum(rebuilt[0]['bands'].values()), 100)
+        self.assertEqual(rebuilt[0]['bands']['< $5'], 2)
+        self.assertEqual(rebuilt[1]['P9']['items'], 1)
+
+
+class SalesHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store({'Gura Plushie': {'price': 30.0, 'stock': 10, 'cost': 12.0},
+                       'Pixel Poster': {'price': 8.0, 'stock': 0, 'cost': 3.0},
+                       'Game Boy': {'price': 90.0, 'stock': 3, 'cost': 60.0}}, {}, 0.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        self.history = gamestore.SalesHistory()
+        self.recorded = []
+
+    @staticmethod
+    def sales(day, extra=0):
+        """One day of sales: a plushie every day, posters on some days."""
+        rows = [('Gura Plushie', 1 + extra, 30.0 * (1 + extra), 12.0 * (1 + extra), 'KawaiiGoods')]
+        if day % 3:
+            rows.append(('Pixel Poster', day % 3, 8.0 * (day % 3), 3.0 * (day % 3), 'RetroHub'))
+        return rows
+
+    def record(self, history, days, extra=0):
+        for _ in range(days):
+            day = history.days
+            rows = self.sales(day, extra)
+            history.record_day(rows)
+            self.recorded.append(rows)
+
+    def expected(self, recorded, days):
+        totals = {}
+        for rows in (recorded if days is None else recorded[-days:]):
+            for name, units, revenue, cogs, _ in rows:
+                entry = totals.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += units
+                entry[1] += revenue
+                entry[2] += cogs
+        return totals
+
+    def assert_totals(self, totals, expected):
+        self.assertEqual(totals.keys(), expected.keys())
+        for name, (units, revenue, cogs) in expected.items():
+            self.assertEqual(totals[name][0], units)
+            self.assertAlmostEqual(totals[name][1], revenue)
+            self.assertAlmostEqual(totals[name][2], cogs)
+
+    def test_rollups_match_day_by_day_totals(self):
+        self.record(self.history, 75)
+        for days in (None, 1, 5, 7, 13, 29, 30, 31, 44, 60, 75, 500):
+            with self.subTest(days=days):
+                self.assert_totals(self.history.item_totals(days), self.expected(self.recorded, days))
+
+    def test_covering_uses_the_fewest_rollups(self):
+        self.record(self.history, 70)
+        # two months, days 60-62 and the week from day 63
+        self.assertEqual(len(list(self.history._covering(None))), 6)
+        # days 40-41 and the weeks from 42, 49, 56 and 63
+        self.assertEqual(len(list(self.history._covering(30))), 6)
+        self.assertEqual(len(list(self.history._covering(9))), 3)
+        self.assertEqual(list(self.history._covering(0)), [])
+
+    def test_reports_over_a_window(self):
+        self.record(self.history, 12)
+        by_provider = self.history.revenue_by_provider(6)
+        self.assertEqual(list(by_provider), ['KawaiiGoods', 'RetroHub'])
+        self.assertEqual(by_provider['KawaiiGoods'][0], 6)
+        self.assertAlmostEqual(by_provider['KawaiiGoods'][2], 6 * 18.0)
+        self.assertEqual(by_provider['RetroHub'][0], 6)  # days 6-11 sell 0, 1, 2, 0, 1, 2
+        top = self.history.top_sellers(6, 1, by='revenue')
+        self.assertEqual([row[0] for row in top], ['Gura Plushie'])
+        with self.assertRaises(ValueError):
+            self.history.top_sellers(6, by='margin')
+        self.assertEqual(self.history.daily_totals(2), [(10, 2, 38.0, 15.0), (11, 3, 46.0, 18.0)])
+
+    def test_sell_through(self):
+        self.record(self.history, 12)
+        with mock.patch.object(gamestore, 'sales_history', self.history):
+            through = gamestore.sales_history.sell_through(5)
+        self.assertAlmostEqual(through['Gura Plushie'], 5 / 15)
+        self.assertEqual(through['Pixel Poster'], 1.0)  # none left
+        self.assertNotIn('Game Boy', through)
+        listed = self.history.sell_through(5, ['Game Boy', 'Gura Plushie', 'Unknown Item'])
+        self.assertEqual(listed, {'Game Boy': 0.0, 'Gura Plushie': 5 / 15, 'Unknown Item': 0.0})
+
+    def test_branch_reads_the_main_history(self):
+        self.record(self.history, 10)
+        with mock.patch.object(gamestore, 'sales_history', self.history):
+            branch = gamestore.Branch()
+            with branch:
+                self.assertEqual(gamestore.sales_history.days, 10)
+                self.assertEqual(gamestore.sales_history.top_sellers(30), self.history.top_sellers(30))
+
+    def test_branch_history_forks_from_the_main_history(self):
+        self.record(self.history, 10)
+        main_days = list(self.recorded)
+        with mock.patch.object(gamestore, 'sales_history', self.history):
+            branch = gamestore.Branch()
+        # The main store keeps selling after the fork, into the running week and month
+        self.record(self.history, 25)
+        main_recorded, self.recorded = self.recorded, list(main_days)
+        with branch:
+            self.assertEqual(gamestore.sales_history.days, 10)
+            self.assert_totals(gamestore.sales_history.item_totals(None), self.expected(self.recorded, None))
+            self.record(gamestore.sales_history, 40, extra=2)
+            for days in (None, 3, 7, 30, 45):
+                with self.subTest(days=days):
+                    self.assert_totals(gamestore.sales_history.item_totals(days),
+                                       self.expected(self.recorded, days))
+        self.assertEqual(self.history.days, 35)
+        for days in (None, 7, 30):
+            self.assert_totals(self.history.item_totals(days), self.expected(main_recorded, days))
+
+
+class SalesBatchTest(unittest.TestCase):
+    """simulate_sales_batch must match simulate_day_sales run day after day."""
+
+    FACTORS = [1.0, 1.7, 0.4, 2.0, 0.0, 1.3]
+
+    def make_store(self):
+        inventory = {}
+        for i in range(300):
+            inventory[f"Item {i:03d} {'x' * (i % 7)}"] = {
+                'price': round(1.5 + (i * 37 % 400) / 3, 2), 'stock': i * 13 % 90,
+                'cost': round(1 + (i * 11 % 200) / 4, 2), 'provider': f"Provider {i % 4}"}
+        install_store(inventory, {}, 2500.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        history = gamestore.SalesHistory()
+        patcher = mock.patch.object(gamestore, 'sales_history', history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return history
+
+    def day_by_day(self):
+        history = self.make_store()
+        factors = iter(self.FACTORS)
+        money = []
+
+        def answer(prompt=''):
+            return str(next(factors)) if 'factor' in prompt else ""
+
+        with mock.patch('builtins.input', answer), mock.patch('builtins.print'):
+            for _ in self.FACTORS:
+                gamestore.simulate_day_sales()
+                money.append(gamestore.store_money)
+        return snapshot()[0], money, history.item_totals()
+
+    def batch(self):
+        history = self.make_store()
+        ledger = gamestore.simulate_sales_batch(len(self.FACTORS), self.FACTORS)
+        self.assertEqual([day.day for day in ledger], list(range(1, len(self.FACTORS) + 1)))
+        return snapshot()[0], [day.money for day in ledger], history.item_totals()
+
+    def check_equivalent(self):
+        items, money, totals = self.day_by_day()
+        batch_items, batch_money, batch_totals = self.batch()
+        self.assertEqual(batch_items, items)
+        self.assertEqual(batch_money, money)
+        self.assertEqual(batch_totals.keys(), totals.keys())
+        for name, (units, revenue, cogs) in totals.items():
+            self.assertEqual(batch_totals[name][0], units)
+            self.assertAlmostEqual(batch_totals[name][1], revenue)
+            self.assertAlmostEqual(batch_totals[name][2], cogs)
+
+    @unittest.skipIf(gamestore.np is None, "NumPy is not installed")
+    def test_numpy_matches_day_by_day(self):
+        self.check_equivalent()
+
+    def test_pure_python_matches_day_by_day(self):
+        with mock.patch.object(gamestore, 'np', None):
+            self.check_equivalent()
+
+    def test_quiet_day_leaves_unsold_items_alone(self):
+        self.make_store()
+        versions = {name: gamestore.item_versions.version(name) for name in gamestore.inventory}
+        with mock.patch('builtins.input', lambda prompt='': "0" if 'factor' in prompt else ""), \
+                mock.patch('builtins.print'), mock.patch.object(gamestore, 'update_item') as update_item:
+            gamestore.simulate_day_sales()
+        update_item.assert_not_called()
+        self.assertEqual({name: gamestore.item_versions.version(name) for name in gamestore.inventory}, versions)
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def stats(self, p50, spread=0.0, calls=20):
+        return {'calls': calls, 'p50_ms': p50, 'spread_ms': spread}
+
+    def test_compare_to_baseline(self):
+        baseline = {'results': {'1000': {'fast': self.stats(1.0), 'noisy': self.stats(1.0, spread=1.0),
+                                         'tiny': self.stats(0.01), 'few': self.stats(1.0, calls=3)}}}
+        report = {'results': {'1000': {'fast': self.stats(1.5), 'noisy': self.stats(2.5),
+                                       'tiny': self.stats(0.04), 'few': self.stats(9.0),
+                                       'new': self.stats(9.0)},
+                              '5000': {'fast': self.stats(9.0)}}}
+        self.assertEqual(benchmark.compare_to_baseline(report, baseline), [('1000', 'fast', 1.0, 1.5)])
+        report['results']['1000']['fast'] = self.stats(1.2)
+        self.assertEqual(benchmark.compare_to_baseline(report, baseline), [])
+
+    def test_every_timed_purchase_buys(self):
+        report = benchmark.run_benchmarks([200], repeats=6, operations=['buy_from_provider'])
+        self.assertEqual(report['results']['200']['buy_from_provider']['calls'], 6)
+        provider = next(iter(gamestore.providers))
+        item = next(iter(gamestore.providers[provider]))
+        self.assertEqual(gamestore.providers[provider][item]['available'], 0)
+        self.assertEqual(gamestore.inventory[item]['stock'],
+                         benchmark.make_synthetic_store(200)[0][item]['stock'] + 8)
+
+    def test_failed_purchases_are_reported(self):
+        with mock.patch.dict(benchmark.OPERATIONS, buy_from_provider=(gamestore.buy_from_provider,
+                                                                      ["1", "1", "1", "no", ""])):
+            with self.assertRaises(RuntimeError):
+                benchmark.run_benchmarks([200], repeats=2, operations=['buy_from_provider'])
+
+
+class CatalogDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.addCleanup(install_store, {}, {}, 0.0)
+        with open(os.path.join(self.dir, 'inventory.csv'), 'w') as f:
+            f.write("name,price,stock,cost\nChess,12.5,4,6\nGo,20,2,9\n")
+        with open(os.path.join(self.dir, 'acme.csv'), 'w') as f:
+            f.write("item,cost,available\nChess,5.5,30\n")
+
+    def load(self, build):
+        path = os.path.join(self.dir, 'inventory.csv')
+        return gamestore.load_cached(path, build)
+
+    def cache_path(self):
+        return os.path.join(self.dir, gamestore.CACHE_DIR_NAME, 'inventory.csv.json')
+
+    def test_lazy_catalogs_and_plain_json_cache(self):
+        self.assertEqual(gamestore.open_catalog_dir(self.dir), 1)
+        self.assertFalse(gamestore.inventory.loaded)
+        self.assertEqual(gamestore.inventory['Chess'], {'price': 12.5, 'stock': 4, 'cost': 6.0})
+        self.assertEqual(gamestore.providers['acme']['Chess'], {'cost': 5.5, 'available': 30})
+        with open(self.cache_path(), encoding='utf-8') as f:
+            header, data = (json.loads(line) for line in f)
+        self.assertEqual(header['version'], gamestore.CACHE_VERSION)
+        self.assertEqual(data['Go'], {'price': 20.0, 'stock': 2, 'cost': 9.0})
+
+    def test_directory_without_inventory_starts_empty(self):
+        os.remove(os.path.join(self.dir, 'inventory.csv'))
+        gamestore.open_catalog_dir(self.dir)
+        self.assertEqual(dict(gamestore.inventory), {})
+        self.assertEqual(list(gamestore.providers), ['acme'])
+
+    def test_demo_store_is_built_on_first_use(self):
+        script = ("import gamestore; loaded = gamestore.inventory.loaded or gamestore.providers.loaded; "
+                  "print(loaded, len(gamestore.inventory) > 0, gamestore.inventory.loaded)")
+        out = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, check=True, timeout=60).stdout
+        self.assertEqual(out.split(), ['False', 'True', 'True'])
+
+    def test_unchanged_file_reuses_the_cache(self):
+        first = self.load(gamestore._build_inventory)
+        build = mock.Mock(side_effect=AssertionError("file parsed again"))
+        self.assertEqual(self.load(build), first)
+
+    def test_unreadable_cache_is_rebuilt(self):
+        first = self.load(gamestore._build_inventory)
+        for garbage in (b"\x80\x04\x95 not json\n", b'{"version": 2}\n', b""):
+            with open(self.cache_path(), 'wb') as f:
+                f.write(garbage)
+            self.assertEqual(self.load(gamestore._build_inventory), first)
+
+    def test_db_rejects_catalog_dir_and_columnar(self):
+        for extra in (['--catalog-dir', self.dir], ['--columnar']):
+            with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+                gamestore.parse_args(['--db', 'store.db'] + extra)
+        self.assertTrue(gamestore.parse_args(['--catalog-dir', self.dir, '--columnar']).columnar)
+
+
+class ScenarioSweepTest(unittest.TestCase):
+
+    def setUp(self):
+        install_store({f"Item {i}": {'price': 5.0 + i, 'stock': 10 + i % 7, 'cost': 2.0 + i / 2}
+                       for i in range(40)}, {}, 500.0)
+        self.addCleanup(install_store, {}, {}, 0.0)
+
+    def test_pool_matches_a_single_process(self):
+        before = snapshot()
+        alone = gamestore.run_scenario_sweep([0.5, 2.0], [3, 10], range(6), workers=1)
+        pooled = gamestore.run_scenario_sweep([0.5, 2.0], [3, 10], range(6), workers=2)
+        self.assertEqual(pooled, alone)
+        self.assertEqual(snapshot(), before)
+        self.assertEqual([(s['factor'], s['days'], s['runs']) for s in alone],
+                         [(0.5, 3, 6), (0.5, 10, 6), (2.0, 3, 6), (2.0, 10, 6)])
+
+    def test_without_jitter_every_seed_agrees(self):
+        summary, = gamestore.run_scenario_sweep([1.0], [5], range(4), jitter=0, workers=1)
+        self.assertEqual(summary['profit']['min'], summary['profit']['max'])
+        quiet, = gamestore.run_scenario_sweep([0.0], [5], range(2), jitter=0, workers=1)
+        self.assertEqual(quiet['profit']['max'], 0)
+        self.assertEqual(quiet['ending_cash']['mean'], 500.0)
+
+    def test_command_line(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gamestore.py')
+        out = subprocess.run([sys.executable, script, '--sweep', '1.0', '2.0', '--sweep-days', '3',
+                              '--sweep-seeds', '2', '--workers', '1'],
+                             capture_output=True, text=True, check=True, timeout=60).stdout
+        summaries = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual([(s['factor'], s['days'], s['runs']) for s in summaries], [(1.0, 3, 2), (2.0, 3, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()